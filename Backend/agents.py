@@ -1,55 +1,150 @@
+from __future__ import annotations
+
 import os
+import re
 import json
+import time
+import copy
+import shlex
+import shutil
+import asyncio
 import logging
-from typing import Dict, List, Optional, Any, Tuple
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Any, Tuple, TYPE_CHECKING
 
-import google.generativeai as genai
-from llama_index.core import VectorStoreIndex
-from llama_index.core.node_parser import CodeSplitter
-from llama_index.llms.gemini import Gemini
-from llama_index.embeddings.gemini import GeminiEmbedding
 from code_agent import CodeChangeAgent
-from llama_index.core.agent import ReActAgent
-from llama_index.core.tools import BaseTool, FunctionTool
-from llama_index.core import SimpleDirectoryReader
-from llama_index.core import Settings
-from llama_index.core.base.response.schema import Response
-from git import Repo
+import tracing
+from tracing import traced, trace_span
+from json_extract import extract_json, repair_json
+from diff_engine import unified_diff
+from classes import ImplementationPlan, PLAN_FIELDS
+from metrics import record_cache
+from repo_map import RepoMap
+from embedding_pipeline import EmbeddingCheckpoint, EmbeddingPipeline
+from workspace import workspace_for, link_file, sandbox_pool
+from blob_store import blob_store
 from dotenv import load_dotenv
-import re
+
+if TYPE_CHECKING:
+    from llama_index.core import VectorStoreIndex
+
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY environment variable not set")
 
-genai.configure(api_key=GEMINI_API_KEY)
+def run_sync(coroutine: Any) -> Any:
+    """Run a coroutine to completion for a synchronous caller.
+    
+    Args:
+        coroutine: The coroutine, e.g. of the async version of a method
+    
+    Returns:
+        Its result
+    
+    Raises:
+        RuntimeError: When called from a running event loop, which this would
+            block; async callers await the coroutine instead
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coroutine)
+    name = getattr(coroutine, "__qualname__", "the coroutine")
+    coroutine.close()
+    raise RuntimeError(f"Called the blocking version of {name} from a running event loop; await {name} instead")
 
-llm = Gemini(
-    model_name="gemini-2.0-flash",
-    api_key=GEMINI_API_KEY,
-    temperature=0.2
-)
 
-embed_model = GeminiEmbedding(
-    model_name="models/embedding-001",
-    api_key=GEMINI_API_KEY,
-)
+# llama_index, GitPython and the model clients are imported and built on first
+# use (or by warm_up), so importing this module stays cheap.
+#
+# Backends are chosen with LLM_BACKEND / EMBED_BACKEND (gemini, openai_like,
+# huggingface, fake). LLM_BACKEND_FAST optionally selects a separate model for
+# the high-volume file structure and change point queries.
+_models: Dict[str, Any] = {}
+_models_lock = threading.Lock()
+
+
+def get_llm() -> Any:
+    """Get the shared LLM, building it on first use."""
+    if "llm" not in _models:
+        with _models_lock:
+            if "llm" not in _models:
+                from llama_index.core import Settings
+                from backends import create_llm
+                _models["llm"] = create_llm()
+                Settings.llm = _models["llm"]
+                tracing.install(_models["llm"])
+    return _models["llm"]
+
+
+def get_fast_llm() -> Any:
+    """Get the LLM for high-volume analysis queries; the shared LLM unless LLM_BACKEND_FAST is set."""
+    if "fast_llm" not in _models:
+        if not os.getenv("LLM_BACKEND_FAST"):
+            return get_llm()
+        with _models_lock:
+            if "fast_llm" not in _models:
+                from backends import create_llm
+                _models["fast_llm"] = create_llm(role="fast")
+                tracing.install(_models["fast_llm"])
+    return _models["fast_llm"]
+
+
+def get_embed_model() -> Any:
+    """Get the shared embedding model, building it on first use."""
+    if "embed_model" not in _models:
+        with _models_lock:
+            if "embed_model" not in _models:
+                from llama_index.core import Settings
+                from backends import create_embed_model
+                _models["embed_model"] = create_embed_model()
+                Settings.embed_model = _models["embed_model"]
+                tracing.install(_models["embed_model"])
+    return _models["embed_model"]
+
+
+def configure_models(llm: Any = None, fast_llm: Any = None, embed_model: Any = None):
+    """Use the given model instances instead of the configured backends (tests, benchmarks)."""
+    from llama_index.core import Settings
+    
+    with _models_lock:
+        if llm is not None:
+            _models["llm"] = Settings.llm = llm
+        if fast_llm is not None:
+            _models["fast_llm"] = fast_llm
+        if embed_model is not None:
+            _models["embed_model"] = Settings.embed_model = embed_model
+    tracing.install(*[model for model in (llm, fast_llm, embed_model) if model is not None])
+
+
+def warm_up():
+    """Import the heavy dependencies and build the model clients ahead of the first request."""
+    import llama_index.core.agent  # noqa: F401
+    import llama_index.core.node_parser  # noqa: F401
+    import git  # noqa: F401
+    get_llm()
+    get_fast_llm()
+    get_embed_model()
+    logger.info("Agent backends warmed up")
+
 
-Settings.llm = llm
-Settings.embed_model = embed_model
+def __getattr__(name: str) -> Any:
+    # Backwards compatible module attributes (agents.llm, agents.embed_model, ...)
+    if name == "llm":
+        return get_llm()
+    if name == "fast_llm":
+        return get_fast_llm()
+    if name == "embed_model":
+        return get_embed_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def prepare_for_json(s: str) -> str:
-    s = re.sub(r'```json\s*|\s*```', '', s)
-    s = re.sub(r',\s*(?=[}\]])', '', s)
-    def esc_newlines(m):
-        inner = m.group(1).replace('\n', r'\n')
-        return f'"{inner}"'
-    s = re.sub(r'"([^"]*?)"', esc_newlines, s, flags=re.DOTALL)
-    return s
+    """Repair an LLM response into a JSON document; see json_extract.repair_json."""
+    return repair_json(s)
 
 class CodebaseIngestor:
     """Component for ingesting and processing codebase files."""
@@ -60,15 +155,24 @@ class CodebaseIngestor:
         Args:
             repo_path: Path to the repository to ingest
         """
+        from llama_index.core import SimpleDirectoryReader
+        
         self.repo_path = repo_path
         self.reader = SimpleDirectoryReader(input_dir=self.repo_path,recursive=True)
-        self.code_splitter = CodeSplitter(
+        self.code_splitter = self.create_code_splitter()
+    
+    @staticmethod
+    def create_code_splitter() -> Any:
+        from llama_index.core.node_parser import CodeSplitter
+        
+        return CodeSplitter(
             language="python",
             chunk_lines=100,
             chunk_lines_overlap=20,
             max_chars=4000
         )
     
+    @traced("ingest")
     def ingest(self, exclude_dirs: List[str] = None) -> List:
         """Ingest all code files from the repository.
         
@@ -90,33 +194,90 @@ class CodebaseIngestor:
         
         all_docs = self.reader.load_data(self.repo_path)
         filtered_docs = [doc for doc in all_docs if should_include(doc.metadata.get("file_path", ""))]
+        self._set_doc_ids(filtered_docs)
         
         logger.info(f"Found {len(filtered_docs)} code files in repository")
         nodes = self.code_splitter.get_nodes_from_documents(filtered_docs)
         logger.info(f"Split into {len(nodes)} code nodes")
         
         return nodes
+    
+    @traced("ingest_files")
+    def ingest_files(self, paths: List[str]) -> List:
+        """Ingest only some files, e.g. those changed since the index was built.
+        
+        Args:
+            paths: Paths relative to the repository; files that no longer
+                exist are skipped
+            
+        Returns:
+            List of document nodes
+        """
+        from llama_index.core import SimpleDirectoryReader
+        
+        files = [os.path.join(self.repo_path, path) for path in paths if os.path.isfile(os.path.join(self.repo_path, path))]
+        if not files:
+            return []
+        docs = SimpleDirectoryReader(input_files=files).load_data()
+        self._set_doc_ids(docs)
+        return self.code_splitter.get_nodes_from_documents(docs)
+    
+    def doc_id(self, file_path: str) -> str:
+        """Document id of a file: its path relative to the repository, so re-ingesting it replaces its nodes."""
+        if os.path.isabs(file_path):
+            file_path = os.path.relpath(file_path, self.repo_path)
+        return os.path.normpath(file_path).replace(os.sep, "/")
+    
+    def record(self, nodes: List):
+        """Remember embedded nodes for later ingestions; working-tree ingestion keeps nothing."""
+    
+    def _set_doc_ids(self, docs: List):
+        for doc in docs:
+            doc.id_ = self.doc_id(doc.metadata.get("file_path", doc.id_))
 
 
 class KnowledgeBuilder:
     """Component for building a knowledge index from code nodes."""
     
-    def __init__(self):
-        """Initialize the knowledge builder."""
-        pass
+    def __init__(self, progress: Optional[Callable[[int, int], None]] = None):
+        """Initialize the knowledge builder.
+        
+        Args:
+            progress: Called with (embedded nodes, total nodes) while an index is built
+        """
+        self.progress = progress
+        self.embedding_stats: Optional[Dict] = None
+        # "simple" keeps float vectors in memory, "int8" or "pq" quantizes them
+        self.vector_store = os.getenv("VECTOR_STORE", "simple")
+        self.vector_rerank = int(os.getenv("VECTOR_RERANK", "4"))
     
-    def build_index(self, nodes: List) -> VectorStoreIndex:
+    @traced("build_index")
+    def build_index(self, nodes: List, checkpoint_path: Optional[str] = None) -> VectorStoreIndex:
         """Build a searchable index from code nodes.
         
         Args:
             nodes: List of document nodes
+            checkpoint_path: Embedding checkpoint to resume an interrupted
+                build from and to record this one in
             
         Returns:
             A VectorStoreIndex built from the nodes
         """
+        from llama_index.core import VectorStoreIndex
+        
         logger.info("Building knowledge index from code nodes")
+        nodes = list(nodes)
+        embed_model = get_embed_model()
+        checkpoint = None
+        if checkpoint_path:
+            checkpoint = EmbeddingCheckpoint(checkpoint_path, getattr(embed_model, "model_name", ""))
+        # Nodes that already carry an embedding aren't sent to the model again by the index
+        pipeline = EmbeddingPipeline(embed_model, progress=self.progress, checkpoint=checkpoint)
+        self.embedding_stats = pipeline.embed_nodes(nodes)
         index = VectorStoreIndex(
-            nodes=nodes
+            nodes=nodes,
+            embed_model=get_embed_model(),
+            storage_context=self._storage_context()
         )
         logger.info("Knowledge index built successfully")
         return index
@@ -130,7 +291,95 @@ class KnowledgeBuilder:
         """
         logger.info(f"Saving index to {path}")
         index.storage_context.persist(persist_dir=path)
+        # The saved index holds every embedding of the build
+        EmbeddingCheckpoint(self.checkpoint_path(path)).remove()
     
+    @traced("update_index")
+    def update_index(self, index: VectorStoreIndex, nodes: List, doc_ids: List[str]):
+        """Replace the nodes of some documents in an index, embedding only the new ones.
+        
+        Args:
+            index: The index to update in place
+            nodes: New nodes of the documents that still exist
+            doc_ids: Documents whose old nodes are removed: the changed and
+                the deleted files
+        """
+        logger.info(f"Updating {len(doc_ids)} documents in the knowledge index")
+        for doc_id in doc_ids:
+            index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        pipeline = EmbeddingPipeline(get_embed_model(), progress=self.progress)
+        self.embedding_stats = pipeline.embed_nodes(nodes)
+        index.insert_nodes(nodes)
+    
+    def copy_index(self, index: VectorStoreIndex, doc_ids: List[str] = ()) -> VectorStoreIndex:
+        """A copy of an index to update while runs keep querying the original.
+        
+        Only the maps are copied; node data, metadata and embeddings are
+        shared, since updates replace entries rather than changing them. The
+        reference entries of ``doc_ids``, which deleting their nodes changes
+        in place, are copied as well. Supports the simple and the quantized
+        vector stores.
+        
+        Args:
+            index: Index to copy; it is not changed
+            doc_ids: Documents the copy will be updated for
+        """
+        import dataclasses
+        from llama_index.core import VectorStoreIndex
+        from llama_index.core.storage.docstore import SimpleDocumentStore
+        from llama_index.core.storage.index_store import SimpleIndexStore
+        from llama_index.core.storage.storage_context import DEFAULT_VECTOR_STORE
+        from llama_index.core.vector_stores.simple import SimpleVectorStore, SimpleVectorStoreData
+        from quantized_store import as_vector_store
+        
+        storage_context = index.storage_context
+        vector_store = storage_context.vector_store
+        if isinstance(vector_store, SimpleVectorStore):
+            data = vector_store.data
+            vector_store = SimpleVectorStore(data=SimpleVectorStoreData(
+                embedding_dict=dict(data.embedding_dict),
+                text_id_to_ref_doc_id=dict(data.text_id_to_ref_doc_id),
+                metadata_dict=dict(data.metadata_dict or {}),
+            ))
+        elif vector_store.class_name() == "QuantizedVectorStore":
+            vector_store = as_vector_store(vector_store.client.copy())
+        else:
+            raise ValueError(f"Can't copy an index kept in a {vector_store.class_name()}")
+        
+        collections = {name: dict(mapping) for name, mapping in storage_context.docstore.to_dict().items()}
+        for name, mapping in collections.items():
+            if name.endswith("/ref_doc_info"):
+                for doc_id in doc_ids:
+                    if doc_id in mapping:
+                        mapping[doc_id] = copy.deepcopy(mapping[doc_id])
+        index_struct = index.index_struct
+        index_struct = dataclasses.replace(index_struct, **{
+            field.name: dict(getattr(index_struct, field.name))
+            for field in dataclasses.fields(index_struct) if isinstance(getattr(index_struct, field.name), dict)
+        })
+        storage_context = dataclasses.replace(
+            storage_context,
+            docstore=SimpleDocumentStore.from_dict(collections),
+            index_store=SimpleIndexStore.from_dict({name: dict(mapping) for name, mapping in storage_context.index_store.to_dict().items()}),
+            vector_stores={**storage_context.vector_stores, DEFAULT_VECTOR_STORE: vector_store},
+        )
+        return VectorStoreIndex(index_struct=index_struct, storage_context=storage_context, embed_model=get_embed_model())
+    
+    def _storage_context(self) -> Optional[Any]:
+        """Storage with a quantized vector store, or None for llama_index's default."""
+        if self.vector_store == "simple":
+            return None
+        from llama_index.core import StorageContext
+        from quantized_store import create_vector_store
+        vector_store = create_vector_store(self.vector_store, rerank=self.vector_rerank)
+        return StorageContext.from_defaults(vector_store=vector_store)
+    
+    @staticmethod
+    def checkpoint_path(index_path: str) -> str:
+        """Embedding checkpoint kept next to an index while it is being built."""
+        return index_path.rstrip("/\\") + ".embeddings.jsonl"
+    
+    @traced("load_index")
     def load_index(self, path: str) -> VectorStoreIndex:
         """Load an index from disk.
         
@@ -141,34 +390,176 @@ class KnowledgeBuilder:
             The loaded index
         """
         logger.info(f"Loading index from {path}")
-        from llama_index import StorageContext, load_index_from_storage
-        storage_context = StorageContext.from_defaults(persist_dir=path)
-        index = load_index_from_storage(storage_context)
+        from llama_index.core import StorageContext, load_index_from_storage
+        from quantized_store import QuantizedVectors, load_vector_store
+        if QuantizedVectors.exists(path):
+            storage_context = StorageContext.from_defaults(persist_dir=path, vector_store=load_vector_store(path))
+        else:
+            storage_context = StorageContext.from_defaults(persist_dir=path)
+        index = load_index_from_storage(storage_context, embed_model=get_embed_model())
         return index
+    
+    def publish_index(self, index: VectorStoreIndex, index_path: str) -> str:
+        """Publish the index as the live shared segment of an index path.
+        
+        Call while holding the segments' build_lock.
+        
+        Args:
+            index: The index to publish
+            index_path: Shared index directory
+            
+        Returns:
+            Name of the new segment
+        """
+        from shared_index import IndexSegments, write_segment
+        name = IndexSegments(index_path).publish(lambda directory: write_segment(index, directory))
+        EmbeddingCheckpoint(self.checkpoint_path(index_path)).remove()
+        return name
+    
+    @traced("attach_index")
+    def attach_index(self, index_path: str, segment: str) -> VectorStoreIndex:
+        """Attach read-only to a shared index segment, mapping its vectors and texts.
+        
+        Args:
+            index_path: Shared index directory
+            segment: Name of the segment
+            
+        Returns:
+            The index; it can be queried but not changed
+        """
+        from shared_index import IndexSegments, attach_segment
+        logger.info(f"Attaching to index segment {segment} in {index_path}")
+        return attach_segment(IndexSegments(index_path).segment_path(segment), embed_model=get_embed_model())
+    
+    def open_index(self, index_path: str, segment: str) -> VectorStoreIndex:
+        """A private, writable copy of a shared index segment, e.g. to update and publish."""
+        from shared_index import IndexSegments, open_segment
+        return open_segment(IndexSegments(index_path).segment_path(segment), embed_model=get_embed_model())
+
+
+PLANNER_CONTEXT = """You are a Planning Agent
+            Instrucutions:
+            - Generate a plan to develop a code base base on the requirements
+            - Search the codebase to find relevant files using search_codebase tool
+            - If relevant files exist analyze the dependencies between then usig analyze_dependencies tool
+            - With the information generate a plan with the following fields
+                Your plan should include:
+                1. Files that need to be modified or created
+                2. Specific changes needed in each file
+                3. Implementation steps in order
+                4. Potential risks or considerations
+                5. Tests that should be added or modified
+            - You plan should always include the mentioned fields.
+            - Do not deviate from the instructions"""
+
+STRUCTURED_PLAN_INSTRUCTIONS = """
+            - When the plan is complete, call the submit_plan tool with it. Do not write the plan as a final answer.
+            - Put every file path from the plan in files_to_modify or files_to_create, and name the file in each implementation step."""
+
+
+FINISH_PLANNING_MESSAGE = (
+    "The planning budget is used up. Do not call any more search or analysis tools. "
+    "Finish now with the best plan you can make from what you have found."
+)
+
+# Tool results memoized for the duration of one planning run
+_planning_cache: contextvars.ContextVar = contextvars.ContextVar("planning_cache", default=None)
+
+
+def _normalize_query(query: str) -> str:
+    """Cache key for a tool query: case, punctuation and spacing don't matter."""
+    return " ".join(re.sub(r"[^\w./]+", " ", query.lower()).split())
+
+
+class RunBudget:
+    """Wall-clock and token budget of one planning or repair run.
+
+    Tokens are counted by the tracing callback handler on the current tracer,
+    so a private tracer is used when the caller hasn't activated one.
+    """
+
+    def __init__(self, seconds: float, tokens: int, name: str = "planning"):
+        """Start the budget.
+
+        Args:
+            seconds: Wall-clock budget, 0 for none
+            tokens: Prompt plus completion token budget, 0 for none
+            name: Name of the private tracer
+        """
+        self.seconds = seconds
+        self.tokens = tokens
+        self.start = time.monotonic()
+        self.tracer = tracing.current_tracer() or tracing.Tracer(name)
+        self.tokens_at_start = self._tokens()
+
+    def _tokens(self) -> int:
+        return self.tracer.totals["prompt_tokens"] + self.tracer.totals["completion_tokens"]
+
+    def used(self) -> Dict[str, float]:
+        return {
+            "seconds": round(time.monotonic() - self.start, 3),
+            "tokens": self._tokens() - self.tokens_at_start,
+        }
+
+    def exhausted(self) -> Optional[str]:
+        """Name of the exhausted budget ("time" or "tokens"), or None."""
+        used = self.used()
+        if self.seconds and used["seconds"] >= self.seconds:
+            return "time"
+        if self.tokens and used["tokens"] >= self.tokens:
+            return "tokens"
+        return None
 
 
 class PlanningAgent:
     """Agent for planning code changes based on requirements."""
     
-    def __init__(self, index: VectorStoreIndex):
+    def __init__(self, index: VectorStoreIndex, structured_output: Optional[bool] = None, repo_map: Optional[RepoMap] = None):
         """Initialize the planning agent.
         
         Args:
             index: The knowledge index
+            structured_output: Have the agent submit the plan through the
+                schema-validated submit_plan tool instead of converting its
+                free-text answer with a second LLM call. Defaults to the
+                PLAN_STRUCTURED_OUTPUT environment variable (on).
+            repo_map: Precomputed repository overview given to the planner
+                instead of summarizing the codebase on every request
         """
+        from llama_index.core.agent import ReActAgent
+        from llama_index.core.tools import FunctionTool
+        
+        if structured_output is None:
+            structured_output = os.getenv("PLAN_STRUCTURED_OUTPUT", "1") != "0"
+        self.structured_output = structured_output
+        self.max_steps = int(os.getenv("PLAN_MAX_STEPS", "20"))
+        self.time_budget = float(os.getenv("PLAN_TIME_BUDGET", "120"))
+        self.token_budget = int(os.getenv("PLAN_TOKEN_BUDGET", "60000"))
+        self.tool_concurrency = max(1, int(os.getenv("PLAN_TOOL_CONCURRENCY", "4")))
+        self.repo_map_chars = int(os.getenv("PLAN_REPO_MAP_CHARS", "4000"))
+        self.repo_map = repo_map
         self.index = index
         self.query_engine = index.as_query_engine(
+            llm=get_llm(),
             response_mode="tree_summarize",
             verbose=True
         )
         self.tools = [
             FunctionTool.from_defaults(
                 fn=self.search_codebase,
+                async_fn=self.asearch_codebase,
                 name="search_codebase",
                 description="Search the codebase for information about specific code components or patterns"
             ),
+            FunctionTool.from_defaults(
+                fn=self.search_codebase_batch,
+                async_fn=self.asearch_codebase_batch,
+                name="search_codebase_batch",
+                description="Run several codebase searches concurrently. Prefer this over repeated search_codebase calls when you have more than one question"
+            ),
             FunctionTool.from_defaults(
                 fn=self.analyze_dependencies,
+                async_fn=self.aanalyze_dependencies,
                 name="analyze_dependencies",
                 description="Analyze dependencies between components in the codebase"
             ),
@@ -178,27 +569,47 @@ class PlanningAgent:
             #     description="Generate a plan for implementing a change"
             # )
         ]
+        context = PLANNER_CONTEXT
+        if self.structured_output:
+            self.tools.append(FunctionTool.from_defaults(
+                fn=self.submit_plan,
+                name="submit_plan",
+                description="Submit the final implementation plan. Call this exactly once, as the last step, instead of giving a final answer",
+                fn_schema=ImplementationPlan,
+                return_direct=True
+            ))
+            context += STRUCTURED_PLAN_INSTRUCTIONS
         self.agent = ReActAgent.from_tools(
             self.tools,
-            llm=llm,
+            llm=get_llm(),
             verbose=True,
-            context="""You are a Planning Agent
-            Instrucutions:
-            - Generate a plan to develop a code base base on the requirements
-            - Search the codebase to find relevant files using search_codebase tool
-            - If relevant files exist analyze the dependencies between then usig analyze_dependencies tool
-            - With the information generate a plan with the following fields
-                Your plan should include:
-                1. Files that need to be modified or created
-                2. Specific changes needed in each file
-                3. Implementation steps in order
-                4. Potential risks or considerations
-                5. Tests that should be added or modified
-            - You plan should always include the mentioned fields.
-            - Do not deviate from the instructions""",
-            max_iterations=20
+            context=context,
+            max_iterations=self.max_steps
         )
     
+    def submit_plan(self, **plan_fields) -> Dict:
+        """Validate the plan submitted by the agent.
+        
+        Returns:
+            The plan as a dictionary
+        """
+        return ImplementationPlan.from_raw(plan_fields).to_dict()
+    
+    def _submitted_plan(self, plan_response: Any) -> Optional[Dict]:
+        """The plan from a structured-output run, or None if the agent didn't submit one."""
+        for source in reversed(getattr(plan_response, "sources", None) or []):
+            if source.tool_name == "submit_plan" and isinstance(source.raw_output, dict):
+                return source.raw_output
+        # Some models answer with the JSON plan instead of calling the tool
+        try:
+            answer = extract_json(str(plan_response))
+        except ValueError:
+            return None
+        if isinstance(answer, dict) and any(name in answer for name in PLAN_FIELDS):
+            return ImplementationPlan.from_raw(answer).to_dict()
+        return None
+    
+    @traced("planning.search_codebase")
     def search_codebase(self, query: str) -> str:
         """Search the codebase for specific information.
         
@@ -209,9 +620,91 @@ class PlanningAgent:
             Search results as a string
         """
         logger.info(f"Searching codebase for: {query}")
-        response = self.query_engine.query(query)
-        return str(response)
+        return self._memoized("search_codebase", query, lambda: self.query_engine.query(query))
+    
+    @traced("planning.search_codebase")
+    async def asearch_codebase(self, query: str) -> str:
+        """Async version of search_codebase."""
+        logger.info(f"Searching codebase for: {query}")
+        return await self._amemoized("search_codebase", query, lambda: self.query_engine.aquery(query))
+    
+    @traced("planning.search_codebase_batch")
+    def search_codebase_batch(self, queries: List[str]) -> str:
+        """Run several codebase searches concurrently.
+        
+        Args:
+            queries: The search queries
+            
+        Returns:
+            The results of every query, in order
+        """
+        unique = self._unique_queries(queries)
+        if not unique:
+            return "No queries given."
+        with ThreadPoolExecutor(max_workers=min(self.tool_concurrency, len(unique))) as executor:
+            # Copy the context so the searches share the tracer and the tool cache
+            futures = {
+                key: executor.submit(contextvars.copy_context().run, self.search_codebase, query)
+                for key, query in unique.items()
+            }
+            results = {key: future.result() for key, future in futures.items()}
+        return self._batch_result(queries, results)
+    
+    @traced("planning.search_codebase_batch")
+    async def asearch_codebase_batch(self, queries: List[str]) -> str:
+        """Async version of search_codebase_batch."""
+        unique = self._unique_queries(queries)
+        if not unique:
+            return "No queries given."
+        semaphore = asyncio.Semaphore(self.tool_concurrency)
+        
+        async def search(query: str) -> str:
+            async with semaphore:
+                return await self.asearch_codebase(query)
+        
+        outputs = await asyncio.gather(*(search(query) for query in unique.values()))
+        return self._batch_result(queries, dict(zip(unique, outputs)))
     
+    def _unique_queries(self, queries: List[str]) -> Dict[str, str]:
+        if isinstance(queries, str):
+            queries = [queries]
+        unique: Dict[str, str] = {}
+        for query in queries:
+            if query and query.strip():
+                unique.setdefault(_normalize_query(query), query)
+        return unique
+    
+    def _batch_result(self, queries: List[str], results: Dict[str, str]) -> str:
+        if isinstance(queries, str):
+            queries = [queries]
+        return "\n\n".join(
+            f"Query: {query}\nResult: {results[_normalize_query(query)]}"
+            for query in queries if query and query.strip()
+        )
+    
+    def _memoized(self, tool: str, query: str, compute) -> str:
+        """Run a tool query once per planning run; repeats reuse the first result."""
+        cache = _planning_cache.get()
+        if cache is None:
+            return str(compute())
+        key = (tool, _normalize_query(query))
+        record_cache("planning_tools", key in cache)
+        if key not in cache:
+            cache[key] = (query, str(compute()))
+        return cache[key][1]
+    
+    async def _amemoized(self, tool: str, query: str, compute) -> str:
+        """Async version of _memoized; ``compute`` returns an awaitable."""
+        cache = _planning_cache.get()
+        if cache is None:
+            return str(await compute())
+        key = (tool, _normalize_query(query))
+        record_cache("planning_tools", key in cache)
+        if key not in cache:
+            cache[key] = (query, str(await compute()))
+        return cache[key][1]
+    
+    @traced("planning.analyze_dependencies", "component")
     def analyze_dependencies(self, component: str) -> str:
         """Analyze dependencies for a component.
         
@@ -223,8 +716,14 @@ class PlanningAgent:
         """
         logger.info(f"Analyzing dependencies for component: {component}")
         query = f"Identify and list all dependencies of {component} in the codebase. Include both imports and functional dependencies."
-        response = self.query_engine.query(query)
-        return str(response)
+        return self._memoized("analyze_dependencies", component, lambda: self.query_engine.query(query))
+    
+    @traced("planning.analyze_dependencies", "component")
+    async def aanalyze_dependencies(self, component: str) -> str:
+        """Async version of analyze_dependencies."""
+        logger.info(f"Analyzing dependencies for component: {component}")
+        query = f"Identify and list all dependencies of {component} in the codebase. Include both imports and functional dependencies."
+        return await self._amemoized("analyze_dependencies", component, lambda: self.query_engine.aquery(query))
     
     def generate_plan(self, requirement: str) -> Dict:
         """Generate a plan for implementing a change.
@@ -237,7 +736,7 @@ class PlanningAgent:
         """
         logger.info(f"Generating plan for requirement: {requirement}")
         
-        code_structure = self.search_codebase("Summarize the overall structure and architecture of the codebase")
+        code_structure = self._code_structure()
         
         prompt = f"""
         Based on the following requirement and codebase structure, generate a detailed implementation plan:
@@ -256,11 +755,16 @@ class PlanningAgent:
         5. Tests that should be added or modified
         """
         
-        response = llm.complete(prompt)
+        response = get_llm().complete(prompt)
         plan_text = response.text
         return plan_text
     
     def create_implementation_plan(self, requirement: str) -> Dict:
+        """Blocking version of acreate_implementation_plan."""
+        return run_sync(self.acreate_implementation_plan(requirement))
+    
+    @traced("planning")
+    async def acreate_implementation_plan(self, requirement: str) -> Dict:
         """Create a comprehensive implementation plan.
         
         Args:
@@ -271,9 +775,110 @@ class PlanningAgent:
         """
         logger.info(f"Creating implementation plan for: {requirement}")
         
-        plan_question = f"Create a detailed implementation plan for this requirement: {requirement}"
-        plan_response = self.agent.query(plan_question)
-        structure_prompt = f"""
+        plan_question = self._plan_question(requirement)
+        budget = RunBudget(self.time_budget, self.token_budget)
+        cache_token = _planning_cache.set({})
+        try:
+            with budget.tracer.activate(), trace_span("planning.react_agent") as span:
+                plan_response = await self._arun_agent(plan_question, budget, span)
+            
+            if plan_response is None:
+                plan_response = self._research_notes(requirement)
+            elif self.structured_output:
+                plan = self._submitted_plan(plan_response)
+                if plan is not None:
+                    return plan
+                logger.warning("Planner did not submit a structured plan; converting its answer to JSON")
+        finally:
+            _planning_cache.reset(cache_token)
+        
+        try:
+            with trace_span("planning.structure"):
+                structured_response = await get_llm().acomplete(self._structure_prompt(plan_response))
+                plan = self._parse_plan(structured_response.text)
+        except (json.JSONDecodeError, Exception) as e:
+            logger.error(f"Error parsing plan to JSON: {e}")
+            plan = self._raw_plan(plan_response)
+        
+        return plan
+    
+    def _code_structure(self) -> str:
+        if self.repo_map is not None:
+            return self.repo_map.render(self.repo_map_chars)
+        return self.search_codebase("Summarize the overall structure and architecture of the codebase")
+    
+    def _plan_question(self, requirement: str) -> str:
+        question = f"Create a detailed implementation plan for this requirement: {requirement}"
+        if self.repo_map is None:
+            return question
+        return f"{question}\n\nRepository overview (files with sizes and summaries):\n{self.repo_map.render(self.repo_map_chars)}"
+    
+    async def _arun_agent(self, question: str, budget: RunBudget, span: Any) -> Optional[Any]:
+        """Run the ReAct agent one step at a time within the planning budget.
+        
+        When a budget or the step limit runs out, the agent gets one more step
+        in which it is told to finish with what it has.
+        
+        Args:
+            question: The planning question
+            budget: Budget of this planning run
+            span: The planning.react_agent span, if tracing
+            
+        Returns:
+            The agent response, or None if the agent didn't finish
+        """
+        task = self.agent.create_task(question)
+        steps, stop_reason = 0, None
+        try:
+            while stop_reason is None:
+                try:
+                    step_output = await self.agent.arun_step(task.task_id)
+                except ValueError as e:
+                    # The agent's own iteration limit
+                    stop_reason = str(e)
+                    break
+                steps += 1
+                if step_output.is_last:
+                    return self.agent.finalize_response(task.task_id, step_output=step_output)
+                stop_reason = self._stop_reason(budget, steps)
+            
+            logger.warning(f"Planning stopped after {steps} steps ({stop_reason}); asking the agent to finish")
+            try:
+                step_output = await self.agent.arun_step(task.task_id, input=FINISH_PLANNING_MESSAGE)
+                steps += 1
+            except ValueError as e:
+                logger.error(f"Agent could not finish the plan: {e}")
+                return None
+            if step_output.is_last:
+                return self.agent.finalize_response(task.task_id, step_output=step_output)
+            return None
+        finally:
+            self._end_run(task, span, budget, steps, stop_reason)
+    
+    def _stop_reason(self, budget: RunBudget, steps: int) -> Optional[str]:
+        exhausted = budget.exhausted()
+        if exhausted:
+            return f"{exhausted} budget exhausted"
+        if steps >= self.max_steps:
+            return "step limit reached"
+        return None
+    
+    def _end_run(self, task: Any, span: Any, budget: RunBudget, steps: int, stop_reason: Optional[str]):
+        used = budget.used()
+        logger.info(f"Planning took {steps} steps, {used['seconds']}s and {used['tokens']} tokens")
+        if span is not None:
+            span.attributes.update(steps=steps, stop_reason=stop_reason or "finished", tokens=used["tokens"])
+        # Finished tasks stay in the runner's state until deleted
+        self.agent.delete_task(task.task_id)
+    
+    def _research_notes(self, requirement: str) -> str:
+        """Planning input built from the tool results gathered before planning stopped."""
+        cache = _planning_cache.get() or {}
+        findings = "\n\n".join(f"{tool} ({query}):\n{result}" for (tool, _), (query, result) in cache.items())
+        return f"Requirement: {requirement}\n\nCodebase findings:\n{findings or 'None'}"
+    
+    def _structure_prompt(self, plan_response: Any) -> str:
+        return f"""
         Convert the following implementation plan into a structured JSON format:
         {plan_response}
         
@@ -288,41 +893,42 @@ class PlanningAgent:
         Do not add any additional fields to the JSON format.
         The JSON result should be populated with only the specified fields.
         """
-        
-        try:
-            structured_response = llm.complete(structure_prompt)
-            struct_resp = prepare_for_json(structured_response.text)
-            logger.info(struct_resp)
-            plan = json.loads(struct_resp)
-        except (json.JSONDecodeError, Exception) as e:
-            logger.error(f"Error parsing plan to JSON: {e}")
-            plan = {
-                "raw_plan": plan_response,
-                "files_to_modify": [],
-                "files_to_create": [],
-                "implementation_steps": [],
-                "potential_risks": [],
-                "tests": []
-            }
-        
-        return plan
+    
+    def _parse_plan(self, text: str) -> Dict:
+        logger.info(text)
+        return ImplementationPlan.from_raw(extract_json(text)).to_dict()
+    
+    def _raw_plan(self, plan_response: Any) -> Dict:
+        return {
+            "raw_plan": str(plan_response),
+            "files_to_modify": [],
+            "files_to_create": [],
+            "implementation_steps": [],
+            "potential_risks": [],
+            "tests": []
+        }
 
 
 class ChangeExecutor:
     """Component for executing code changes based on plans."""
     
-    def __init__(self, repo_path: str, index: VectorStoreIndex):
+    def __init__(self, repo_path: str, index: VectorStoreIndex, repo_map: Optional[RepoMap] = None):
         """Initialize the change executor.
         
         Args:
             repo_path: Path to the repository
             index: The knowledge index
+            repo_map: Precomputed repository overview used to describe similar files
         """
         self.repo_path = repo_path
         self.index = index
-        self.query_engine = index.as_query_engine()
-        self.code_change_agent = CodeChangeAgent(repo_path, self.query_engine)
+        self.repo_map = repo_map
+        self.query_engine = index.as_query_engine(llm=get_llm())
+        fast_llm = get_fast_llm()
+        analysis_query_engine = index.as_query_engine(llm=fast_llm) if fast_llm is not get_llm() else None
+        self.code_change_agent = CodeChangeAgent(repo_path, self.query_engine, analysis_query_engine)
     
+    @traced("execute_plan")
     def execute_plan(self, plan: Dict) -> Dict:
         """Execute a change plan.
         
@@ -333,26 +939,11 @@ class ChangeExecutor:
             Execution results
         """
         logger.info("Executing implementation plan")
-        results = {
-            "modified_files": [],
-            "created_files": [],
-            "errors": [],
-            "file_changes": {}
-        }
-        for file_path in plan.get("files_to_modify", []):
-            full_path = os.path.join(self.repo_path, file_path)
-            if not os.path.exists(full_path):
-                results["errors"].append(f"File not found: {file_path}")
-                continue
-            
+        results = self.new_results()
+        files_to_modify, files_to_create = self.plan_files(plan, results)
+        for file_path in files_to_modify:
             file_analysis = self.code_change_agent.analyze_file_structure(file_path)
-            
-            file_specific_steps = []
-            for step in plan.get("implementation_steps", []):
-                if file_path in step:
-                    file_specific_steps.append(step)
-            
-            file_change_description = "\n".join(file_specific_steps)
+            file_change_description = self._file_steps(plan, file_path)
             change_points = self.code_change_agent.identify_change_points(
                 file_analysis, 
                 file_change_description
@@ -362,41 +953,139 @@ class ChangeExecutor:
                 change_points,
                 file_change_description
             )
-            with open(full_path, 'w') as f:
-                f.write(changes["modified_content"])
-            
-            print(f"The Only Modification Changes Are: {changes}")
-            results["modified_files"].append(file_path)
-            results["file_changes"][file_path] = changes
-            logger.info(f"Modified file with precise changes: {file_path}")
+            self._record_modification(results, file_path, changes)
         
-        for file_path in plan.get("files_to_create", []):
-            full_path = os.path.join(self.repo_path, file_path)
-            os.makedirs(os.path.dirname(full_path), exist_ok=True)
-            
+        for file_path in files_to_create:
             similar_files = self.code_change_agent.find_similar_files(file_path)
-            
-            file_specific_steps = []
-            for step in plan.get("implementation_steps", []):
-                if file_path in step:
-                    file_specific_steps.append(step)
-            
-            file_creation_description = "\n".join(file_specific_steps)
-            
             new_file = self.code_change_agent.create_new_file(
                 file_path,
-                file_creation_description,
+                self._file_steps(plan, file_path),
                 similar_files
             )
-            
-            with open(full_path, 'w') as f:
-                f.write(new_file["content"])
-            
-            results["created_files"].append(file_path)
-            logger.info(f"Created file: {file_path}")
+            self._record_creation(results, file_path, new_file)
                 
         return results
     
+    @traced("execute_plan")
+    async def aexecute_plan(self, plan: Dict) -> Dict:
+        """Async version of execute_plan.
+        
+        Every file in the plan is handled by its own coroutine, so the model
+        calls for different files are in flight at the same time.
+        """
+        logger.info("Executing implementation plan")
+        results = self.new_results()
+        files_to_modify, files_to_create = self.plan_files(plan, results)
+        await asyncio.gather(
+            *(self.aexecute_file(plan, file_path, results) for file_path in files_to_modify),
+            *(self.aexecute_file(plan, file_path, results, create=True) for file_path in files_to_create)
+        )
+        self.order_results(plan, results)
+        return results
+    
+    async def aexecute_file(self, plan: Dict, file_path: str, results: Dict, create: bool = False):
+        """Generate and write the change for one file of a plan.
+        
+        Args:
+            plan: The implementation plan
+            file_path: File to modify or create, relative to the repository
+            results: Execution results the change is recorded in
+            create: Create the file instead of modifying it
+        """
+        file_change_description = self._file_steps(plan, file_path)
+        if create:
+            similar_files = self.code_change_agent.find_similar_files(file_path)
+            new_file = await self.code_change_agent.acreate_new_file(
+                file_path,
+                file_change_description,
+                similar_files
+            )
+            self._record_creation(results, file_path, new_file)
+            return
+        
+        file_analysis = await self.code_change_agent.aanalyze_file_structure(file_path)
+        change_points = await self.code_change_agent.aidentify_change_points(
+            file_analysis,
+            file_change_description
+        )
+        changes = await self.code_change_agent.agenerate_changes(
+            file_path,
+            change_points,
+            file_change_description
+        )
+        self._record_modification(results, file_path, changes)
+    
+    def new_results(self) -> Dict:
+        return {
+            "modified_files": [],
+            "created_files": [],
+            "errors": [],
+            "file_changes": {}
+        }
+    
+    def plan_files(self, plan: Dict, results: Dict) -> Tuple[List[str], List[str]]:
+        """Files of a plan to modify and to create; missing files are recorded as errors."""
+        workspace = workspace_for(self.repo_path)
+        files_to_modify = []
+        for file_path in plan.get("files_to_modify", []):
+            if not workspace.exists(file_path):
+                results["errors"].append(f"File not found: {file_path}")
+            else:
+                files_to_modify.append(file_path)
+        return files_to_modify, list(plan.get("files_to_create", []))
+    
+    def order_results(self, plan: Dict, results: Dict):
+        """Put files recorded as they completed back into plan order."""
+        order = {file_path: i for i, file_path in enumerate(plan.get("files_to_modify", []) + plan.get("files_to_create", []))}
+        results["modified_files"].sort(key=lambda file_path: order.get(file_path, len(order)))
+        results["created_files"].sort(key=lambda file_path: order.get(file_path, len(order)))
+    
+    def merge_results(self, results: Dict, repair_results: Dict):
+        """Fold the results of a follow-up plan into earlier execution results.
+        
+        A file changed twice keeps its original content, and its diff spans
+        both changes.
+        """
+        for file_path, changes in repair_results["file_changes"].items():
+            previous = results["file_changes"].get(file_path)
+            if previous is not None:
+                original_content = blob_store.get(previous["original_hash"])
+                changes = dict(
+                    changes,
+                    original_hash=previous["original_hash"],
+                    diff=unified_diff(original_content, blob_store.get(changes["modified_hash"]), file_path)
+                )
+            results["file_changes"][file_path] = changes
+        for file_path in repair_results["modified_files"]:
+            if file_path not in results["modified_files"] and file_path not in results["created_files"]:
+                results["modified_files"].append(file_path)
+        results["errors"].extend(repair_results["errors"])
+    
+    def _file_steps(self, plan: Dict, file_path: str) -> str:
+        """Implementation steps of a plan that mention the given file."""
+        file_specific_steps = []
+        for step in plan.get("implementation_steps", []):
+            if file_path in step:
+                file_specific_steps.append(step)
+        return "\n".join(file_specific_steps)
+    
+    def _record_modification(self, results: Dict, file_path: str, changes: Dict):
+        workspace_for(self.repo_path).write(file_path, changes["modified_content"])
+        
+        results["modified_files"].append(file_path)
+        # Results refer to the contents by hash; each content is stored once in the blob store
+        recorded = {key: value for key, value in changes.items() if key not in ("original_content", "modified_content")}
+        recorded["original_hash"] = blob_store.put(changes["original_content"])
+        recorded["modified_hash"] = blob_store.put(changes["modified_content"])
+        results["file_changes"][file_path] = recorded
+        logger.info(f"Modified file with precise changes: {file_path}")
+    
+    def _record_creation(self, results: Dict, file_path: str, new_file: Dict):
+        workspace_for(self.repo_path).write(file_path, new_file["content"])
+        
+        results["created_files"].append(file_path)
+        logger.info(f"Created file: {file_path}")
+    
     def mod_file_gen(self, file_path: str, original_content: str, plan: Dict) -> str:
         """Generate changes for an existing file.
         
@@ -433,7 +1122,7 @@ class ChangeExecutor:
         Return only the file content without any explanations or markdown formatting.
         """
         
-        response = llm.complete(prompt)
+        response = get_llm().complete(prompt)
         new_content = response.text
         new_content = new_content.replace("```python", "").replace("```", "").strip()
         
@@ -472,7 +1161,7 @@ class ChangeExecutor:
         Return only the file content without any explanations or markdown formatting.
         """
         
-        response = llm.complete(prompt)
+        response = get_llm().complete(prompt)
         new_content = response.text
         new_content = new_content.replace("```python", "").replace("```", "").strip()
         
@@ -500,11 +1189,19 @@ class ChangeExecutor:
         Returns:
             Context information about similar files
         """
+        if self.repo_map is not None:
+            similar_files = self.repo_map.describe_files(file_extension)
+            if similar_files:
+                return f"Existing {file_extension} files and what they contain:\n{similar_files}"
         query = f"Find examples of files with {file_extension} extension in the codebase and summarize their structure and patterns."
         response = self.query_engine.query(query)
         return str(response)
 
 
+# "FAILED tests/test_app.py::test_index - AssertionError" in pytest's short summary
+_FAILED_TEST = re.compile(r"^(?:FAILED|ERROR) (\S+\.py(?:::\S+)?)", re.MULTILINE)
+
+
 class TestSandboxRunner:
     """Component for testing code changes in a sandbox environment."""
     
@@ -518,38 +1215,133 @@ class TestSandboxRunner:
         self.repo_path = repo_path
         self.test_command = test_command
     
-    def run_tests(self) -> Dict:
+    def run_tests(self, sandbox_repo_path: Optional[str] = None, test_paths: Optional[List[str]] = None) -> Dict:
+        """Blocking version of arun_tests."""
+        return run_sync(self.arun_tests(sandbox_repo_path, test_paths))
+    
+    @traced("tests.run")
+    async def arun_tests(self, sandbox_repo_path: Optional[str] = None, test_paths: Optional[List[str]] = None) -> Dict:
         """Run tests on the modified codebase.
         
+        The sandbox is built in a worker thread and the test command runs as
+        an asyncio subprocess, so the event loop is never blocked.
+        
+        Args:
+            sandbox_repo_path: Sandbox from prepare_sandbox to run in; the
+                caller keeps ownership of it. By default one is prepared
+                and handed back afterwards.
+            test_paths: Only run these test files or node ids, relative to
+                the repository. By default the whole suite runs.
+        
         Returns:
             Test results
         """
-        import subprocess
-        import tempfile
-        import shutil
-        
         logger.info("Running tests in sandbox environment")
-        with tempfile.TemporaryDirectory() as temp_dir:
-            sandbox_repo_path = os.path.join(temp_dir, "sandbox_repo")
-            shutil.copytree(self.repo_path, sandbox_repo_path)
-            os.chdir(sandbox_repo_path)
-            try:
-                process = subprocess.run(
-                    self.test_command,
-                    shell=True,
-                    capture_output=True,
-                    text=True
-                )
-                success = process.returncode == 0
-                output = process.stdout
-                error = process.stderr
-            except Exception as e:
-                success = False
-                output = ""
-                error = str(e)
-            
-            os.chdir(self.repo_path)
+        owned = sandbox_repo_path is None
+        if owned:
+            sandbox_repo_path = await self.aprepare_sandbox()
+        try:
+            process = await asyncio.create_subprocess_shell(
+                self._test_command(test_paths),
+                cwd=sandbox_repo_path,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await process.communicate()
+            success = process.returncode == 0
+            output = stdout.decode(errors="replace")
+            error = stderr.decode(errors="replace")
+        except Exception as e:
+            success = False
+            output = ""
+            error = str(e)
+        finally:
+            if owned:
+                await asyncio.to_thread(self.cleanup_sandbox, sandbox_repo_path)
+        
+        return self._test_results(success, output, error)
+    
+    def _test_command(self, test_paths: Optional[List[str]] = None) -> str:
+        if not test_paths:
+            return self.test_command
+        return " ".join([self.test_command] + [shlex.quote(test_path) for test_path in test_paths])
+    
+    def failed_tests(self, test_results: Dict) -> List[str]:
+        """Node ids of the failed tests in a pytest run, in report order."""
+        output = test_results.get("output", "") + "\n" + test_results.get("error", "")
+        failed = []
+        for match in _FAILED_TEST.finditer(output):
+            if match.group(1) not in failed:
+                failed.append(match.group(1))
+        return failed
+    
+    def tests_for(self, file_paths: List[str]) -> List[str]:
+        """Existing generated test files of source files, relative to the repository."""
+        workspace = workspace_for(self.repo_path)
+        tests = []
+        for file_path in file_paths:
+            if not self.is_testable(file_path):
+                if os.path.basename(file_path).startswith("test_"):
+                    tests.append(file_path)
+                continue
+            test_file_path = self._test_file_path(file_path)
+            if workspace.exists(test_file_path):
+                tests.append(os.path.relpath(test_file_path, self.repo_path))
+        return tests
+    
+    @traced("tests.sandbox_copy")
+    def prepare_sandbox(self) -> str:
+        """Get a sandbox of the repository with the pending edits applied.
+        
+        Sandboxes come from the sandbox pool: a kept one is refreshed, only
+        copying the files that changed since its last run, else the tree is
+        copied, or linked (see SANDBOX_MODE). The edits of the active
+        workspace are written on top.
+        
+        Returns:
+            Path of the sandbox; hand it back with cleanup_sandbox
+        """
+        sandbox_repo_path = sandbox_pool.acquire(self.repo_path)
+        try:
+            workspace_for(self.repo_path).materialize(sandbox_repo_path)
+        except Exception:
+            sandbox_pool.release(self.repo_path, sandbox_repo_path)
+            raise
+        return sandbox_repo_path
+    
+    async def aprepare_sandbox(self) -> str:
+        """Async version of prepare_sandbox, building the sandbox in a worker thread."""
+        return await asyncio.to_thread(self.prepare_sandbox)
+    
+    @traced("tests.sandbox_sync")
+    def sync_sandbox(self, sandbox_repo_path: str, file_paths: List[str]):
+        """Bring files written after the sandbox was prepared into it.
         
+        Args:
+            sandbox_repo_path: Sandbox from prepare_sandbox
+            file_paths: Changed files, absolute or relative to the repository
+        """
+        workspace = workspace_for(self.repo_path)
+        for file_path in file_paths:
+            rel_path = workspace.rel_path(file_path)
+            source = os.path.join(self.repo_path, rel_path)
+            target = os.path.join(sandbox_repo_path, rel_path)
+            if workspace.is_pending(rel_path):
+                if os.path.lexists(target):
+                    os.remove(target)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with open(target, 'w') as f:
+                    f.write(workspace.read(rel_path))
+            elif os.path.exists(source):
+                link_file(source, target)
+            elif os.path.lexists(target):
+                os.remove(target)
+    
+    def cleanup_sandbox(self, sandbox_repo_path: str):
+        """Hand a sandbox from prepare_sandbox back to the pool, which keeps or removes it."""
+        sandbox_pool.release(self.repo_path, sandbox_repo_path)
+    
+    def _test_results(self, success: bool, output: str, error: str) -> Dict:
         results = {
             "success": success,
             "output": output,
@@ -563,6 +1355,7 @@ class TestSandboxRunner:
         
         return results
     
+    @traced("tests.generate")
     def generate_tests(self, plan: Dict) -> Dict:
         """Generate tests for the implemented changes.
         
@@ -576,34 +1369,15 @@ class TestSandboxRunner:
         results = {
             "generated_tests": []
         }
-        for file_path in plan.get("files_to_modify", []) + plan.get("files_to_create", []):
-            if not file_path.endswith(".py"):
-                continue
-            if "test_" in os.path.basename(file_path):
-                continue
-            
+        for file_path in self._testable_files(plan):
             try:
-                module_name = os.path.splitext(os.path.basename(file_path))[0]
-                test_file_name = f"test_{module_name}.py"
-                
-                file_dir = os.path.dirname(file_path)
-                if "tests" in os.listdir(self.repo_path):
-                    test_dir = os.path.join(self.repo_path)
-                    if file_dir != "":
-                        test_dir = os.path.join(test_dir, os.path.basename(file_dir))
-                        os.makedirs(test_dir, exist_ok=True)
-                else:
-                    test_dir = os.path.join(self.repo_path, file_dir)
-                
-                test_file_path = os.path.join(test_dir, test_file_name)
-                
-                with open(os.path.join(self.repo_path, file_path), 'r') as f:
-                    original_content = f.read()
+                test_file_path = self._test_file_path(file_path)
+                workspace = workspace_for(self.repo_path)
+                original_content = workspace.read(file_path)
                 
                 test_content = self._generate_test_content(file_path, original_content)
                 
-                with open(test_file_path, 'w') as f:
-                    f.write(test_content)
+                workspace.write(test_file_path, test_content)
                 
                 results["generated_tests"].append(test_file_path)
                 logger.info(f"Generated test file: {test_file_path}")
@@ -613,6 +1387,68 @@ class TestSandboxRunner:
         
         return results
     
+    @traced("tests.generate")
+    async def agenerate_tests(self, plan: Dict) -> Dict:
+        """Async version of generate_tests, generating all test files concurrently."""
+        logger.info("Generating tests for implemented changes")
+        results = {
+            "generated_tests": []
+        }
+        
+        test_files = await asyncio.gather(*(self.agenerate_test_file(file_path) for file_path in self._testable_files(plan)))
+        results["generated_tests"] = [test_file for test_file in test_files if test_file]
+        return results
+    
+    async def agenerate_test_file(self, file_path: str) -> Optional[str]:
+        """Generate the test file for one source file from its current content.
+        
+        Args:
+            file_path: Source file, relative to the repository
+            
+        Returns:
+            Path of the written test file, or None if generation failed
+        """
+        try:
+            test_file_path = self._test_file_path(file_path)
+            workspace = workspace_for(self.repo_path)
+            original_content = workspace.read(file_path)
+            
+            test_content = await self._agenerate_test_content(file_path, original_content)
+            
+            workspace.write(test_file_path, test_content)
+            
+            logger.info(f"Generated test file: {test_file_path}")
+            return test_file_path
+        except Exception as e:
+            logger.error(f"Error generating test for {file_path}: {str(e)}")
+            return None
+    
+    def _testable_files(self, plan: Dict) -> List[str]:
+        """Python source files of a plan that should get a generated test."""
+        return [
+            file_path for file_path in plan.get("files_to_modify", []) + plan.get("files_to_create", [])
+            if self.is_testable(file_path)
+        ]
+    
+    def is_testable(self, file_path: str) -> bool:
+        """Whether a source file should get a generated test."""
+        return file_path.endswith(".py") and "test_" not in os.path.basename(file_path)
+    
+    def _test_file_path(self, file_path: str) -> str:
+        """Location of the generated test file for a source file."""
+        module_name = os.path.splitext(os.path.basename(file_path))[0]
+        test_file_name = f"test_{module_name}.py"
+        
+        file_dir = os.path.dirname(file_path)
+        if "tests" in os.listdir(self.repo_path):
+            test_dir = os.path.join(self.repo_path)
+            if file_dir != "":
+                test_dir = os.path.join(test_dir, os.path.basename(file_dir))
+        else:
+            test_dir = os.path.join(self.repo_path, file_dir)
+        
+        return os.path.join(test_dir, test_file_name)
+    
     def _generate_test_content(self, file_path: str, file_content: str) -> str:
         """Generate test content for a file.
         
@@ -623,7 +1459,16 @@ class TestSandboxRunner:
         Returns:
             Test content
         """
-        prompt = f"""
+        response = get_llm().complete(self._test_prompt(file_path, file_content))
+        return self._clean_test_content(response.text)
+    
+    async def _agenerate_test_content(self, file_path: str, file_content: str) -> str:
+        """Async version of _generate_test_content."""
+        response = await get_llm().acomplete(self._test_prompt(file_path, file_content))
+        return self._clean_test_content(response.text)
+    
+    def _test_prompt(self, file_path: str, file_content: str) -> str:
+        return f"""
         Generate pytest test code for the following Python file:
         
         FILE PATH: {file_path}
@@ -637,15 +1482,18 @@ class TestSandboxRunner:
         Include appropriate imports, test functions, assertions, and any necessary mocks.
         Return only the Python test code without any explanations or markdown formatting.
         """
-        
-        response = llm.complete(prompt)
-        test_content = response.text
-        
+    
+    def _clean_test_content(self, test_content: str) -> str:
         logger.info(test_content)
         test_content = test_content.replace("```python", "").replace("```", "").strip()
         return test_content
 
     def analyze_test_failures(self, test_results: Dict) -> Dict:
+        """Blocking version of aanalyze_test_failures."""
+        return run_sync(self.aanalyze_test_failures(test_results))
+    
+    @traced("tests.analyze_failures")
+    async def aanalyze_test_failures(self, test_results: Dict) -> Dict:
         """Analyze test failures and suggest fixes.
         
         Args:
@@ -659,9 +1507,20 @@ class TestSandboxRunner:
         
         logger.info("Analyzing test failures")
         
+        try:
+            response = await get_llm().acomplete(self._failure_prompt(test_results))
+            analysis = extract_json(response.text)
+        except (json.JSONDecodeError, Exception) as e:
+            logger.error(f"Error parsing analysis to JSON: {e}")
+            analysis = self._unparsed_failure_analysis()
+        
+        logger.info(f"Analysis complete: {analysis['summary']}")
+        return analysis
+    
+    def _failure_prompt(self, test_results: Dict) -> str:
         error_output = test_results.get("error", "") + test_results.get("output", "")
         
-        prompt = f"""
+        return f"""
         Analyze the following test failure output and suggest specific fixes:
         
         TEST OUTPUT:
@@ -681,25 +1540,17 @@ class TestSandboxRunner:
         Response should be directly parsable by json function
         Do not add any additional data that might lead to failed json parsing error
         """
-        
-        try:
-            response = llm.complete(prompt)
-            pre_resp = prepare_for_json(response.text)
-            analysis = json.loads(pre_resp)
-        except (json.JSONDecodeError, Exception) as e:
-            logger.error(f"Error parsing analysis to JSON: {e}")
-            analysis = {
-                "summary": "Failed to parse test failures",
-                "root_causes": ["Unknown"],
-                "fixes": [{
-                    "file": "unknown",
-                    "issue": "Error parsing test output",
-                    "fix": "Manual review needed"
-                }]
-            }
-        
-        logger.info(f"Analysis complete: {analysis['summary']}")
-        return analysis
+    
+    def _unparsed_failure_analysis(self) -> Dict:
+        return {
+            "summary": "Failed to parse test failures",
+            "root_causes": ["Unknown"],
+            "fixes": [{
+                "file": "unknown",
+                "issue": "Error parsing test output",
+                "fix": "Manual review needed"
+            }]
+        }
 
 
 class VCSIntegrator:
@@ -709,21 +1560,27 @@ class VCSIntegrator:
         """Initialize the VCS integrator.
         
         Args:
-            repo_path: Path to the repository
+            repo_path: Path to the repository, or to a directory in one;
+                file paths passed to the integrator are relative to it
         """
+        from git import Repo
+        
         self.repo_path = repo_path
         try:
-            self.repo = Repo(repo_path)
+            self.repo = Repo(repo_path, search_parent_directories=True)
             logger.info(f"Successfully initialized git repository at {repo_path}")
         except Exception as e:
             logger.error(f"Failed to initialize git repository: {str(e)}")
             self.repo = None
     
-    def commit_changes(self, message: str) -> bool:
+    @traced("vcs.commit")
+    def commit_changes(self, message: str, files: List[str] = None, branch_name: str = "cursor_branch") -> bool:
         """Commit changes to the repository.
         
         Args:
             message: Commit message
+            files: Paths relative to repo_path to stage; stages all of repo_path if omitted
+            branch_name: Branch to commit on
             
         Returns:
             Success flag
@@ -733,8 +1590,12 @@ class VCSIntegrator:
             return False
         
         try:
-            self.create_branch('cursor_branch')
-            self.repo.git.add(".")
+            if not self.create_branch(branch_name):
+                return False
+            if files:
+                self.repo.git.add("--", *[self._tree_path(file_path) for file_path in files])
+            else:
+                self.repo.git.add("--", self._tree_path("."))
             self.repo.git.commit("-m", message)
             logger.info(f"Successfully committed changes: {message}")
             return True
@@ -742,8 +1603,13 @@ class VCSIntegrator:
             logger.error(f"Failed to commit changes: {str(e)}")
             return False
     
+    def _tree_path(self, file_path: str) -> str:
+        """A path relative to repo_path as git expects it: from the top of the working tree."""
+        prefix = os.path.relpath(os.path.realpath(self.repo_path), os.path.realpath(self.repo.working_tree_dir))
+        return os.path.normpath(os.path.join(prefix, file_path)).replace(os.sep, "/")
+    
     def create_branch(self, branch_name: str) -> bool:
-        """Create a new branch.
+        """Create a new branch, or check it out if it already exists.
         
         Args:
             branch_name: Name of the branch
@@ -756,13 +1622,102 @@ class VCSIntegrator:
             return False
         
         try:
-            self.repo.git.checkout("-b", branch_name)
-            logger.info(f"Successfully created and checked out branch: {branch_name}")
+            if self.repo.active_branch.name == branch_name:
+                return True
+        except TypeError:
+            # Detached HEAD
+            pass
+        
+        try:
+            if branch_name in [head.name for head in self.repo.heads]:
+                self.repo.git.checkout(branch_name)
+                logger.info(f"Successfully checked out existing branch: {branch_name}")
+            else:
+                self.repo.git.checkout("-b", branch_name)
+                logger.info(f"Successfully created and checked out branch: {branch_name}")
             return True
         except Exception as e:
             logger.error(f"Failed to create branch: {str(e)}")
             return False
     
+    @traced("vcs.commit_worktree", "change_id")
+    def commit_in_worktree(self, change_id: str, message: str, contents: Dict[str, Optional[str]],
+                           branch_name: str = None) -> bool:
+        """Commit the files of a change on a branch of its own, without a checkout.
+        
+        The commit is built with plumbing: a temporary index is filled from
+        the branch's tree (HEAD's for a new branch), the changed files are
+        written as blobs and staged into it, and the resulting tree is
+        committed and the branch ref moved. The user's working copy, index
+        and HEAD are untouched, and no files besides the changed ones are
+        written. Callers must hold the repository lock (repo_pool.acquire),
+        since the ref is updated in the shared git directory.
+        
+        Args:
+            change_id: ID of the change
+            message: Commit message
+            contents: New content of each changed file, by path relative to
+                repo_path; None deletes the file
+            branch_name: Branch to commit on; defaults to cursor/<change_id>
+            
+        Returns:
+            Success flag
+        """
+        if not self.repo:
+            logger.error("No git repository initialized")
+            return False
+        if not contents:
+            logger.error(f"No files recorded for change {change_id}")
+            return False
+        
+        import tempfile
+        from io import BytesIO
+        from gitdb import IStream
+        
+        branch_name = branch_name or f"cursor/{change_id}"
+        ref = f"refs/heads/{branch_name}"
+        fd, index_path = tempfile.mkstemp(prefix="cursor-index-", dir=self.repo.git_dir)
+        os.close(fd)
+        os.remove(index_path)
+        try:
+            try:
+                if self.repo.active_branch.name == branch_name:
+                    logger.error(f"Branch {branch_name} is checked out; not committing change {change_id} behind it")
+                    return False
+            except TypeError:
+                # Detached HEAD
+                pass
+            exists = branch_name in [head.name for head in self.repo.heads]
+            parent = self.repo.commit(ref if exists else "HEAD")
+            with self.repo.git.custom_environment(GIT_INDEX_FILE=index_path):
+                self.repo.git.read_tree(parent.hexsha)
+                for file_path, content in contents.items():
+                    file_path = self._tree_path(file_path)
+                    if content is None:
+                        self.repo.git.update_index("--force-remove", "--", file_path)
+                        continue
+                    data = content.encode()
+                    blob = self.repo.odb.store(IStream("blob", len(data), BytesIO(data)))
+                    try:
+                        mode = parent.tree[file_path].mode
+                    except KeyError:
+                        mode = 0o100644
+                    self.repo.git.update_index("--add", "--cacheinfo", f"{mode:o},{blob.hexsha.decode()},{file_path}")
+                tree = self.repo.git.write_tree()
+            commit = self.repo.git.commit_tree(tree, "-p", parent.hexsha, "-m", message)
+            # Fails if the branch moved, or appeared, since it was read
+            self.repo.git.update_ref("-m", f"cursor: commit change {change_id}", ref, commit,
+                                     parent.hexsha if exists else "0" * 40)
+            logger.info(f"Committed change {change_id} on {branch_name} as {commit[:12]}: {message}")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to commit change {change_id} on {branch_name}: {str(e)}")
+            return False
+        finally:
+            if os.path.exists(index_path):
+                os.remove(index_path)
+    
+    @traced("vcs.commit_message")
     def generate_commit_message(self, plan: Dict, results: Dict) -> str:
         """Generate a commit message for the changes.
         
@@ -794,5 +1749,5 @@ class VCSIntegrator:
         Return only the commit message without any explanation.
         """
         
-        response = llm.complete(prompt)
+        response = get_llm().complete(prompt)
         return response.text.strip()
@@ -1,12 +1,23 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 import json
 # from utils import *
 from flask_cors import CORS, cross_origin
 from agents import *
 from masteragent import AgenticAISystem
+from tracing import Tracer
+import metrics
+import time
 import uuid 
 import shutil
-import difflib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from diff_engine import unified_diff
+from repo_pool import repo_pool
+from workspace import EDITS_FILE, OverlayWorkspace
+from index_watcher import IndexWatcher
+from single_flight import SingleFlight
+from responses import JSON_CONTENT_TYPE, encode_body, encode_json
+from blob_store import BlobStore, blob_hashes, blob_store
 
 app = Flask(__name__)
 cors = CORS(app, resources={
@@ -16,6 +27,43 @@ cors = CORS(app, resources={
 })
 # orchestrator = OrchestratorAgent()
 
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    if endpoint == "/metrics":
+        return response
+    metrics.HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=str(response.status_code))
+    if "request_start" in g:
+        metrics.HTTP_LATENCY.observe(time.perf_counter() - g.request_start, endpoint=endpoint)
+    # Endpoints report failures as {"error": ...}; only small, uncompressed bodies are inspected
+    is_error = response.status_code >= 400 or (
+        response.is_json
+        and not response.content_encoding
+        and (response.content_length or 0) < 4096
+        and "error" in (response.get_json(silent=True) or {})
+    )
+    if is_error:
+        metrics.HTTP_ERRORS.inc(endpoint=endpoint)
+    return response
+
+
+def json_response(payload, data=None):
+    """JSON response with the fields the request selects, compressed if the client accepts it"""
+    fields = request.args.get('fields') or (data or {}).get('fields')
+    body, headers = encode_json(payload, fields, request.headers.get('Accept-Encoding'))
+    return Response(body, content_type=JSON_CONTENT_TYPE, headers=headers)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 # @app.route('/chat', methods=['POST'])
 # @cross_origin()
 # def chat_endpoint():
@@ -47,20 +95,48 @@ cors = CORS(app, resources={
 class ChangeStore:
     def __init__(self):
         self.store_dir = r"F:\Cursor-Clone\Backend\pending_changes"
-        self.original_files_dir = r"F:\Cursor-Clone\Backend\original_files"
+        self.workspaces_dir = r"F:\Cursor-Clone\Backend\pending_workspaces"
+        # File contents of the changes and their edits, stored once per distinct content
+        self.blobs = blob_store
+        self._locks = {}
+        self._locks_lock = threading.Lock()
         os.makedirs(r"F:\Cursor-Clone\Backend\pending_changes", exist_ok=True)
     
+    def lock(self, change_id):
+        """Lock serializing the updates and deletion of one change"""
+        with self._locks_lock:
+            return self._locks.setdefault(str(change_id), threading.Lock())
+    
     def save_change(self, change_id, change_data):
         """Save change data to disks"""
         file_path = os.path.join(r"F:\Cursor-Clone\Backend\pending_changes", f"{change_id}.json")
+        # Written aside and swapped in, so readers never see a partly written change
+        temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
         try:
-            with open(file_path, 'w+') as f:
+            with open(temp_path, 'w') as f:
                 json.dump(change_data, f)
+            os.replace(temp_path, file_path)
             return True
         except Exception as e:
             logger.error(f"Error saving change {change_id}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             return False
     
+    def update_change(self, change_id, update):
+        """Apply ``update`` to the stored change and save it, unless the change was deleted meanwhile
+        
+        Returns:
+            The updated change data, or None if the change no longer exists
+        """
+        with self.lock(change_id):
+            change_data = self.get_change(change_id)
+            if change_data is None:
+                return None
+            update(change_data)
+            self.save_change(change_id, change_data)
+            return change_data
+    
     def get_change(self, change_id):
         """Get a pending change by ID"""
         try:
@@ -72,33 +148,193 @@ class ChangeStore:
         except Exception as e:
             logger.error(f"Error loading change {change_id}: {e}")
             return None
-    def backup_original_files(self, repo_path):
-        """Backup original files before making changes"""
-        backup_dir = self.original_files_dir
-        os.makedirs(backup_dir, exist_ok=True)
-        
-        backed_up_files = []
-        for file_path in os.listdir(repo_path):
-            if '.git' not in file_path:
-                full_path = os.path.join(repo_path, file_path)
-                if os.path.exists(full_path):
-                    backup_file_dir = os.path.dirname(os.path.join(backup_dir, file_path))
-                    os.makedirs(backup_file_dir, exist_ok=True)
-                    shutil.copy2(full_path, os.path.join(backup_dir, file_path))
-                    backed_up_files.append(file_path)
-        
-        return backed_up_files
+    def delete_change(self, change_id):
+        """Remove a pending change and its edits"""
+        file_path = os.path.join(r"F:\Cursor-Clone\Backend\pending_changes", f"{change_id}.json")
+        with self.lock(change_id):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            shutil.rmtree(self.workspace_dir(change_id), ignore_errors=True)
+        with self._locks_lock:
+            self._locks.pop(str(change_id), None)
+        self.collect_blobs()
     
-    def get_original_file_content(self, file_path):
-        """Get original content of a backed up file"""
-        backup_file_path = os.path.join(self.original_files_dir, file_path)
-        if os.path.exists(backup_file_path):
-            with open(backup_file_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        return None
+    def collect_blobs(self):
+        """Remove the blobs no stored change or pending edit refers to"""
+        referenced = set()
+        for filename in os.listdir(self.store_dir):
+            if filename.endswith('.json'):
+                referenced.update(blob_hashes(self.get_change(filename[:-len('.json')])))
+        if os.path.isdir(self.workspaces_dir):
+            for change_id in os.listdir(self.workspaces_dir):
+                edits_path = os.path.join(self.workspace_dir(change_id), EDITS_FILE)
+                if os.path.exists(edits_path):
+                    with open(edits_path, 'r') as f:
+                        referenced.update(json.load(f).values())
+        return self.blobs.collect(referenced)
+    
+    def workspace_dir(self, change_id):
+        """Directory holding the pending edits of a change"""
+        return os.path.join(self.workspaces_dir, str(change_id))
+    
+    def new_workspace(self, change_id, repo_path):
+        """Empty overlay for the edits of a new change"""
+        shutil.rmtree(self.workspace_dir(change_id), ignore_errors=True)
+        return OverlayWorkspace(repo_path, self.workspace_dir(change_id), self.blobs)
+    
+    def open_workspace(self, change_id, repo_path):
+        """Overlay with the pending edits of a change; empty once they are applied"""
+        return OverlayWorkspace(repo_path, self.workspace_dir(change_id), self.blobs)
         
 change_store = ChangeStore()
 
+# 'branch' stages the whole tree on cursor_branch, 'files' stages only the
+# recorded files, 'worktree' commits each change on a branch of its own with
+# git plumbing, leaving the working copy untouched.
+VCS_COMMIT_MODE = os.environ.get("VCS_COMMIT_MODE", "branch")
+
+
+commit_message_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="commit-message")
+pending_commit_messages = {}
+
+
+def generate_commit_message_for(change_id):
+    """Generate and persist the commit message of a stored change"""
+    change_data = change_store.get_change(change_id)
+    if not change_data:
+        return None
+    results = change_data['results']
+    vcs = repo_pool.get(change_data['repo_path'])
+    commit_message = vcs.generate_commit_message(results.get('plan', {}), results.get('changes', {}))
+    # Re-read under the change's lock: the change may have been rejected during the LLM call
+    if change_store.update_change(change_id, lambda stored: stored.update(commit_message=commit_message)) is None:
+        logger.info(f"Change {change_id} was deleted while its commit message was generated")
+    return commit_message
+
+
+def schedule_commit_message(change_id):
+    """Start generating the commit message of a change in the background"""
+    future = commit_message_executor.submit(generate_commit_message_for, str(change_id))
+    pending_commit_messages[str(change_id)] = future
+    future.add_done_callback(lambda _: pending_commit_messages.pop(str(change_id), None))
+
+
+def get_commit_message(change_id, change_data):
+    """Commit message of a change, waiting for the background generation if needed"""
+    metrics.record_cache("commit_message", bool(change_data.get('commit_message')))
+    if change_data.get('commit_message'):
+        return change_data['commit_message']
+    future = pending_commit_messages.get(change_id)
+    if future is not None:
+        try:
+            commit_message = future.result()
+            if commit_message:
+                return commit_message
+        except Exception as e:
+            logger.error(f"Background commit message generation failed for {change_id}: {e}")
+    # The background job may have finished between loading the change and now
+    stored = change_store.get_change(change_id)
+    if stored and stored.get('commit_message'):
+        return stored['commit_message']
+    return generate_commit_message_for(change_id)
+
+
+def changed_files(change_data):
+    """Paths relative to repo_path recorded for a change, including generated tests"""
+    repo_path = change_data['repo_path']
+    results = change_data['results']
+    changes = results.get('changes') or {}
+    files = list(changes.get('modified_files', [])) + list(changes.get('created_files', []))
+    for test_path in (results.get('tests') or {}).get('generated_tests', []):
+        files.append(os.path.relpath(test_path, repo_path))
+    return list(dict.fromkeys(files))
+
+# With INDEX_WATCH=1 the agent system of each repository is kept and a
+# background watcher re-indexes changed files, so requests do no index work
+index_watcher = IndexWatcher() if os.environ.get("INDEX_WATCH", "0") == "1" else None
+systems = {}
+systems_lock = threading.Lock()
+system_locks = {}
+
+
+def create_system(data):
+    """Build the agent system for a /chatv1 request"""
+    if index_watcher is None or not data.get('index_path'):
+        return AgenticAISystem(repo_path=data['repo_path'], index_path=data.get('index_path'))
+    repo_path = os.path.abspath(data['repo_path'])
+    with systems_lock:
+        lock = system_locks.setdefault(repo_path, threading.Lock())
+    # Concurrent first requests for a repository wait for one index build
+    with lock:
+        system = systems.get(repo_path)
+        if system is None:
+            system = AgenticAISystem(repo_path=data['repo_path'], index_path=data['index_path'])
+            index_watcher.register(system)
+            index_watcher.start()
+            systems[repo_path] = system
+    if os.path.abspath(system.index_path) != os.path.abspath(data['index_path']):
+        return AgenticAISystem(repo_path=data['repo_path'], index_path=data['index_path'])
+    return system.fork()
+
+
+def new_change_id(data):
+    """ID of the change a /chatv1 request produces, unique per run"""
+    repo_path = os.path.realpath(data['repo_path'])
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{repo_path}\0{time.time_ns()}\0{data['prompt']}"))
+
+
+# Identical /chatv1 requests that arrive while one is running (double-clicks,
+# client retries) share its run and its change instead of starting their own
+chat_flights = SingleFlight("chat_single_flight")
+
+
+def repo_head(repo_path):
+    """Commit HEAD points at, or None outside git and before the first commit
+
+    Only the ref files are read, so the repository lock and the pooled
+    cat-file processes aren't needed; non-repositories are cached by the pool.
+    """
+    from git import SymbolicReference
+    vcs = repo_pool.get(repo_path)
+    if vcs.repo is None:
+        return None
+    try:
+        return SymbolicReference.dereference_recursive(vcs.repo, "HEAD")
+    except ValueError:
+        return None
+
+
+def chat_key(data):
+    """Key under which concurrent duplicates of a /chatv1 request are coalesced"""
+    return (os.path.realpath(data['repo_path']), repo_head(data['repo_path']), data['prompt'])
+
+
+def record_change(data, results, change_id):
+    """Store the results of a /chatv1 run as a pending change"""
+    results['change_id'] = change_id
+    change_store.save_change(change_id, {
+        'repo_path': data['repo_path'],
+        'index_path': data.get('index_path'),
+        'requirement': data['prompt'],
+        'branch_name': data.get('branch_name'),
+        'results': results
+    })
+    schedule_commit_message(change_id)
+    return results
+
+
+def process_chat(data):
+    """Run the agent system on a /chatv1 request and store the change it proposes"""
+    tracer = Tracer("chatv1")
+    change_id = new_change_id(data)
+    # Edits stay in the change's overlay until /accept_changes
+    workspace = change_store.new_workspace(change_id, data['repo_path'])
+    with tracer.activate(), workspace.activate():
+        cursor = create_system(data)
+        results = cursor.process_requirement(requirement=data['prompt'], tracer=tracer)
+    return record_change(data, results, change_id)
+
+
 @app.route('/chatv1',methods=['GET','POST'])
 @cross_origin()
 def chat_endpoint_v2():
@@ -106,25 +342,7 @@ def chat_endpoint_v2():
     if not data or 'repo_path' not in data or 'prompt' not in data:
         return jsonify({"error": "Missing required fields: 'repo_path' and 'prompt'"})
     try:
-        if 'index_path' in data:
-            cursor = AgenticAISystem(repo_path=data['repo_path'],index_path=data['index_path'])
-        cursor = AgenticAISystem(repo_path=data['repo_path'])
-        backed_up_files = change_store.backup_original_files(data['repo_path'])
-        results = cursor.process_requirement(requirement=data['prompt'])
-
-        namespace = uuid.NAMESPACE_DNS
-        name_uuid_sha1 = uuid.uuid5(namespace, f"{data['prompt']}")
-        results['change_id'] = str(name_uuid_sha1)
-        results['backed_up_files'] = backed_up_files
-        change_store.save_change(name_uuid_sha1, {
-            'repo_path': data['repo_path'],
-            'index_path': data.get('index_path'),
-            'requirement': data['prompt'],
-            'branch_name': data.get('branch_name'),
-            'results': results,
-            'backed_up_files': backed_up_files
-        })
-        return jsonify(results)
+        return json_response(chat_flights.do(chat_key(data), lambda: process_chat(data)), data)
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
         return jsonify({"error": f"Failed to process request: {str(e)}"})
@@ -143,20 +361,41 @@ def accept_changes():
         
         if not change_data:
             return jsonify({"error": f"Change ID {change_id} not found"})
-        vcs = VCSIntegrator(
-            repo_path=change_data['repo_path']
-        )
-        results = change_data['results']
-        plan = results.get('plan', {})
-        changes = results.get('changes', {})
-        commit_message = data.get('commit_message')
-        if not commit_message:
-            commit_message = vcs.generate_commit_message(plan, changes)
-        commit_success = vcs.commit_changes(commit_message)
+        commit_message = data.get('commit_message') or get_commit_message(change_id, change_data)
+        mode = data.get('mode', VCS_COMMIT_MODE)
+        files = changed_files(change_data)
+        branch_name = data.get('branch_name') or change_data.get('branch_name')
+        workspace = change_store.open_workspace(change_id, change_data['repo_path'])
+        if mode == 'worktree':
+            # Committed straight from the overlay; the edits never reach the working copy
+            contents = {file_path: workspace.read(file_path) if workspace.exists(file_path) else None for file_path in files}
+            with repo_pool.acquire(change_data['repo_path']) as vcs:
+                commit_success = vcs.commit_in_worktree(change_id, commit_message, contents, branch_name)
+            if commit_success:
+                workspace.discard()
+        else:
+            # Checked and applied under the repository lock, so concurrent accepts can't interleave
+            with repo_pool.acquire(change_data['repo_path']) as vcs:
+                conflicts = workspace.conflicts()
+                if conflicts:
+                    return jsonify({
+                        "error": f"Files changed in the repository since change {change_id} was made; reject it and run the prompt again",
+                        "change_id": change_id,
+                        "conflicts": conflicts
+                    }), 409
+                with trace_span("apply_workspace"):
+                    applied = workspace.apply()
+                if index_watcher is not None:
+                    index_watcher.notify(change_data['repo_path'], applied)
+                if mode == 'files':
+                    commit_success = vcs.commit_changes(commit_message, files=files, branch_name=branch_name or 'cursor_branch')
+                else:
+                    commit_success = vcs.commit_changes(commit_message)
         vcs_results = {
             "change_id": change_id,
             "commit_success": commit_success,
-            "commit_message": commit_message
+            "commit_message": commit_message,
+            "mode": mode
         }
         
         return jsonify(vcs_results)
@@ -165,6 +404,27 @@ def accept_changes():
         return jsonify({"error": f"Failed to accept changes: {str(e)}"})
 
 
+@app.route('/reject_changes', methods=['POST'])
+@cross_origin()
+def reject_changes():
+    data = request.json
+    if not data or 'change_id' not in data:
+        return jsonify({"error": "Missing required field: 'change_id'"})
+    change_id = data['change_id']
+    if not change_store.get_change(change_id):
+        return jsonify({"error": f"Change ID {change_id} not found"})
+    try:
+        future = pending_commit_messages.get(str(change_id))
+        if future is not None:
+            future.cancel()
+        # The edits never left the overlay, so there is nothing to restore
+        change_store.delete_change(change_id)
+        return jsonify({"change_id": change_id, "rejected": True})
+    except Exception as e:
+        logger.error(f"Error rejecting changes: {str(e)}")
+        return jsonify({"error": f"Failed to reject changes: {str(e)}"})
+
+
 @app.route('/pending_changes', methods=['GET'])
 @cross_origin()
 def list_pending_changes():
@@ -183,7 +443,7 @@ def list_pending_changes():
                         "test_success": change_data["results"].get("test_results", {}).get("success", False)
                     })
         
-        return jsonify({"pending_changes": pending_changes})
+        return json_response({"pending_changes": pending_changes})
     except Exception as e:
         logger.error(f"Error listing pending changes: {str(e)}")
         return jsonify({"error": f"Failed to list pending changes: {str(e)}"})
@@ -202,61 +462,97 @@ def get_file_changes():
         return jsonify({"error": f"Change ID {change_id} not found"})
     
     repo_path = change_data['repo_path']
+    summary_only = bool(data.get('summary_only', False))
+    # Without hydrate the contents are left out; clients fetch them from /blobs/<hash>.
+    # The hashes are computed, not stored: the run stored every version it recorded
+    hydrate = bool(data.get('hydrate', True))
     results = change_data['results']
     changes = results.get('changes', {})
     
     file_changes = {}
+    workspace = change_store.open_workspace(change_id, repo_path)
     
     # Get changes for modified files
     modified_files = changes.get('modified_files', [])
     for file_path in modified_files:
-        # Get original content
-        original_content = change_store.get_original_file_content(file_path)
+        # Pending edits are diffed against the repository; accepted ones against the recorded original
+        if workspace.is_pending(file_path):
+            original_content = workspace.original(file_path)
+        else:
+            recorded = changes.get('file_changes', {}).get(file_path, {})
+            # Changes stored before contents moved to the blob store carry them inline
+            original_content = change_store.blobs.get(recorded.get('original_hash')) or recorded.get('original_content')
         
         # Get current content
-        current_file_path = os.path.join(repo_path, file_path)
         current_content = None
-        if os.path.exists(current_file_path):
-            with open(current_file_path, 'r', encoding='utf-8') as f:
-                current_content = f.read()
+        if workspace.exists(file_path):
+            current_content = workspace.read(file_path)
         
         # Generate diff
         if original_content and current_content:
-            original_lines = original_content.splitlines()
-            current_lines = current_content.splitlines()
-            diff = list(difflib.unified_diff(
-                original_lines, 
-                current_lines,
-                fromfile=f'a/{file_path}',
-                tofile=f'b/{file_path}',
-                lineterm=''
-            ))
+            diff = unified_diff(original_content, current_content, file_path, summary_only=summary_only)
             
             file_changes[file_path] = {
-                'original': original_content,
-                'current': current_content,
-                'diff': '\n'.join(diff)
+                'original_hash': BlobStore.hash(original_content),
+                'current_hash': BlobStore.hash(current_content),
+                'diff': diff
             }
+            if hydrate:
+                file_changes[file_path].update(original=original_content, current=current_content)
     
     # Get content for created files
     created_files = changes.get('created_files', [])
     for file_path in created_files:
-        current_file_path = os.path.join(repo_path, file_path)
-        if os.path.exists(current_file_path):
-            with open(current_file_path, 'r', encoding='utf-8') as f:
-                current_content = f.read()
+        if workspace.exists(file_path):
+            current_content = workspace.read(file_path)
                 
             file_changes[file_path] = {
-                'original': None,
-                'current': current_content,
+                'original_hash': None,
+                'current_hash': BlobStore.hash(current_content),
                 'diff': f'New file: {file_path}\n\n{current_content}'
             }
+            if hydrate:
+                file_changes[file_path].update(original=None, current=current_content)
     
-    return jsonify({
+    return json_response({
         "change_id": change_id,
         "file_changes": file_changes
-    })
+    }, data)
+
+@app.route('/blobs/<blob_hash>', methods=['GET'])
+@cross_origin()
+def get_blob(blob_hash):
+    """Content of a file version referred to by hash in change results"""
+    content = change_store.blobs.get_bytes(blob_hash)
+    if content is None:
+        return jsonify({"error": f"Blob {blob_hash} not found"}), 404
+    etag = f'"{blob_hash}"'
+    # Blobs never change, so clients and proxies may cache them for good
+    cache_headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get('If-None-Match') == etag:
+        return Response(status=304, headers=cache_headers)
+    body, headers = encode_body(content, request.headers.get('Accept-Encoding'))
+    return Response(body, content_type="text/plain; charset=utf-8", headers=dict(headers, **cache_headers))
+
+def start_warm_up():
+    """Build the agent backends in a background thread so the first request doesn't pay for it"""
+    if os.environ.get("WARM_UP", "1") != "1":
+        return
+
+    def run():
+        try:
+            warm_up()
+        except Exception as e:
+            logger.error(f"Warm-up failed: {e}")
+
+    threading.Thread(target=run, name="warm-up", daemon=True).start()
+
 
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port)
\ No newline at end of file
+    if os.environ.get("SERVER_MODE", "wsgi") == "asgi":
+        import uvicorn
+        uvicorn.run("asgi:app", host='0.0.0.0', port=port)
+    else:
+        start_warm_up()
+        app.run(host='0.0.0.0', port=port)
\ No newline at end of file
@@ -0,0 +1,77 @@
+# ASGI entry point: /chatv1 runs on the event loop with the async agent
+# pipeline, every other route is served by the Flask app.
+# Run with `uvicorn asgi:app` or `SERVER_MODE=asgi python app.py`.
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Mount, Route
+
+import metrics
+from responses import JSON_CONTENT_TYPE, encode_json
+from tracing import Tracer
+from app import (app as flask_app, change_store, chat_flights, chat_key, create_system, new_change_id,
+                 record_change, start_warm_up, logger)
+
+
+async def chat_endpoint_async(request):
+    start = time.perf_counter()
+    response = await run_chat(request)
+    # Requests on this route bypass the Flask hooks, so record them here
+    metrics.HTTP_REQUESTS.inc(endpoint="/chatv1", method=request.method, status=str(response.status_code))
+    metrics.HTTP_LATENCY.observe(time.perf_counter() - start, endpoint="/chatv1")
+    return response
+
+
+async def run_chat(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or 'repo_path' not in data or 'prompt' not in data:
+        metrics.HTTP_ERRORS.inc(endpoint="/chatv1")
+        return JSONResponse({"error": "Missing required fields: 'repo_path' and 'prompt'"})
+    try:
+        key = await asyncio.to_thread(chat_key, data)
+        results = await chat_flights.ado(key, lambda: aprocess_chat(data))
+        fields = request.query_params.get('fields') or data.get('fields')
+        body, headers = await asyncio.to_thread(encode_json, results, fields, request.headers.get('accept-encoding'))
+        return Response(body, media_type=JSON_CONTENT_TYPE, headers=headers)
+    except Exception as e:
+        logger.error(f"Error processing request: {str(e)}")
+        metrics.HTTP_ERRORS.inc(endpoint="/chatv1")
+        return JSONResponse({"error": f"Failed to process request: {str(e)}"})
+
+
+async def aprocess_chat(data):
+    # The index build is disk/CPU bound, keep it off the event loop
+    tracer = Tracer("chatv1")
+    change_id = new_change_id(data)
+    workspace = await asyncio.to_thread(change_store.new_workspace, change_id, data['repo_path'])
+    with tracer.activate(), workspace.activate():
+        cursor = await asyncio.to_thread(create_system, data)
+        results = await cursor.aprocess_requirement(requirement=data['prompt'], tracer=tracer)
+    return await asyncio.to_thread(record_change, data, results, change_id)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    start_warm_up()
+    yield
+
+
+app = Starlette(
+    lifespan=lifespan,
+    routes=[
+        Route('/chatv1', chat_endpoint_async, methods=['GET', 'POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+    ],
+)
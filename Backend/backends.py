@@ -0,0 +1,336 @@
+import os
+import re
+import json
+import math
+import hashlib
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from llama_index.core.base.llms.types import (
+    CompletionResponse,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.bridge.pydantic import Field
+from llama_index.core.embeddings import BaseEmbedding
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.llms.custom import CustomLLM
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKENDS: Dict[str, Callable[[], Any]] = {}
+EMBED_BACKENDS: Dict[str, Callable[[], Any]] = {}
+
+DEFAULT_LLM_BACKEND = "gemini"
+DEFAULT_EMBED_BACKEND = "gemini"
+
+
+def register_llm_backend(name: str):
+    """Register a factory that builds an LLM for the given backend name."""
+    def decorator(factory: Callable[[], Any]):
+        LLM_BACKENDS[name] = factory
+        return factory
+    return decorator
+
+
+def register_embed_backend(name: str):
+    """Register a factory that builds an embedding model for the given backend name."""
+    def decorator(factory: Callable[[], Any]):
+        EMBED_BACKENDS[name] = factory
+        return factory
+    return decorator
+
+
+def llm_backend_name(role: Optional[str] = None) -> str:
+    """Resolve the configured LLM backend.
+
+    ``LLM_BACKEND_<ROLE>`` (e.g. ``LLM_BACKEND_FAST``) overrides ``LLM_BACKEND``
+    for that role.
+
+    Args:
+        role: Optional role of the LLM (e.g. "fast")
+
+    Returns:
+        The backend name
+    """
+    if role:
+        role_backend = os.getenv(f"LLM_BACKEND_{role.upper()}")
+        if role_backend:
+            return role_backend
+    return os.getenv("LLM_BACKEND", DEFAULT_LLM_BACKEND)
+
+
+def create_llm(backend: Optional[str] = None, role: Optional[str] = None) -> Any:
+    """Build an LLM from the registry.
+
+    Args:
+        backend: Backend name; resolved from the environment if omitted
+        role: Optional role used to pick a role-specific backend
+
+    Returns:
+        The LLM instance
+    """
+    name = backend or llm_backend_name(role)
+    if name not in LLM_BACKENDS:
+        raise ValueError(f"Unknown LLM backend '{name}'. Available: {sorted(LLM_BACKENDS)}")
+    logger.info(f"Using LLM backend: {name}" + (f" (role: {role})" if role else ""))
+    return LLM_BACKENDS[name]()
+
+
+def create_embed_model(backend: Optional[str] = None) -> Any:
+    """Build an embedding model from the registry.
+
+    Args:
+        backend: Backend name; defaults to the EMBED_BACKEND environment variable
+
+    Returns:
+        The embedding model instance
+    """
+    name = backend or os.getenv("EMBED_BACKEND", DEFAULT_EMBED_BACKEND)
+    if name not in EMBED_BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{name}'. Available: {sorted(EMBED_BACKENDS)}")
+    logger.info(f"Using embedding backend: {name}")
+    return EMBED_BACKENDS[name]()
+
+
+def _google_api_key() -> str:
+    api_key = os.getenv("GOOGLE_API_KEY")
+    if not api_key:
+        raise ValueError("GOOGLE_API_KEY environment variable not set (required by the gemini backends)")
+    import google.generativeai as genai
+    genai.configure(api_key=api_key)
+    return api_key
+
+
+@register_llm_backend("gemini")
+def _gemini_llm():
+    from llama_index.llms.gemini import Gemini
+    return Gemini(
+        model_name=os.getenv("GEMINI_MODEL", "gemini-2.0-flash"),
+        api_key=_google_api_key(),
+        temperature=0.2
+    )
+
+
+@register_llm_backend("openai_like")
+def _openai_like_llm():
+    # Any OpenAI-compatible server: llama.cpp server, vLLM, LM Studio, Ollama, ...
+    from llama_index.llms.openai_like import OpenAILike
+    return OpenAILike(
+        model=os.getenv("LOCAL_LLM_MODEL", "local-model"),
+        api_base=os.getenv("LOCAL_LLM_API_BASE", "http://localhost:8000/v1"),
+        api_key=os.getenv("LOCAL_LLM_API_KEY", "not-needed"),
+        is_chat_model=os.getenv("LOCAL_LLM_CHAT", "1") == "1",
+        context_window=int(os.getenv("LOCAL_LLM_CONTEXT_WINDOW", "8192")),
+        temperature=0.2
+    )
+
+
+@register_llm_backend("fake")
+def _fake_llm():
+    return FakeLLM()
+
+
+@register_llm_backend("recorded")
+def _recorded_llm():
+    return RecordedLLM.from_file(os.getenv("LLM_RECORDING_PATH", "llm_recording.jsonl"))
+
+
+@register_llm_backend("recording")
+def _recording_llm():
+    # Wraps a real backend and appends every prompt/response pair for later replay
+    return RecordingLLM(
+        inner=create_llm(os.getenv("LLM_RECORD_BACKEND", DEFAULT_LLM_BACKEND)),
+        path=os.getenv("LLM_RECORDING_PATH", "llm_recording.jsonl")
+    )
+
+
+@register_embed_backend("gemini")
+def _gemini_embedding():
+    from llama_index.embeddings.gemini import GeminiEmbedding
+    return GeminiEmbedding(
+        model_name=os.getenv("GEMINI_EMBED_MODEL", "models/embedding-001"),
+        api_key=_google_api_key(),
+    )
+
+
+@register_embed_backend("huggingface")
+def _huggingface_embedding():
+    # Local sentence-transformer style model, e.g. BAAI/bge-small-en-v1.5
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+    return HuggingFaceEmbedding(
+        model_name=os.getenv("LOCAL_EMBED_MODEL", "BAAI/bge-small-en-v1.5"),
+        device=os.getenv("LOCAL_EMBED_DEVICE") or None
+    )
+
+
+@register_embed_backend("fake")
+def _fake_embedding():
+    return FakeEmbedding(embed_dim=int(os.getenv("FAKE_EMBED_DIM", "256")))
+
+
+REACT_ANSWER = "Thought: I can answer without using any more tools.\nAnswer: {answer}"
+
+
+class FakeLLM(CustomLLM):
+    """Deterministic offline LLM.
+
+    Returns the response of the first key in ``responses`` that occurs in the
+    prompt, otherwise ``default_response``. Prompts from a ReAct agent get the
+    response wrapped in a final-answer step so agents terminate immediately.
+    """
+
+    responses: Dict[str, str] = Field(default_factory=dict, description="Prompt substring to response map.")
+    default_response: str = Field(default="No changes required.", description="Response when nothing matches.")
+    context_window: int = Field(default=32768)
+    num_output: int = Field(default=1024)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(
+            context_window=self.context_window,
+            num_output=self.num_output,
+            model_name="fake"
+        )
+
+    def respond(self, prompt: str) -> str:
+        for key, response in self.responses.items():
+            if key in prompt:
+                text = response
+                break
+        else:
+            text = self.default_response
+        if "Thought:" in prompt and "Answer:" in prompt and not text.startswith("Thought:"):
+            text = REACT_ANSWER.format(answer=text)
+        return text
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        return CompletionResponse(text=self.respond(prompt))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        text = self.respond(prompt)
+
+        def gen() -> CompletionResponseGen:
+            yield CompletionResponse(text=text, delta=text)
+
+        return gen()
+
+
+def prompt_key(prompt: str) -> str:
+    """Key of a prompt in an LLM recording."""
+    return hashlib.sha256(prompt.encode()).hexdigest()
+
+
+class RecordedLLM(FakeLLM):
+    """Offline LLM replaying responses captured by RecordingLLM.
+
+    Prompts that were not recorded fall back to the FakeLLM behaviour.
+    """
+
+    recording: Dict[str, str] = Field(default_factory=dict, description="Prompt key to recorded response map.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RecordedLLM"
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs: Any) -> "RecordedLLM":
+        """Load a JSON-lines recording with 'prompt_key' and 'response' fields."""
+        recording = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        recording[entry["prompt_key"]] = entry["response"]
+        else:
+            logger.warning(f"LLM recording {path} not found, replaying nothing")
+        return cls(recording=recording, **kwargs)
+
+    def respond(self, prompt: str) -> str:
+        recorded = self.recording.get(prompt_key(prompt))
+        if recorded is not None:
+            return recorded
+        return super().respond(prompt)
+
+
+class RecordingLLM(CustomLLM):
+    """Pass-through LLM that appends every prompt and response to a JSON-lines file."""
+
+    inner: Any = Field(description="The LLM that answers the prompts.")
+    path: str = Field(description="Recording file.")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RecordingLLM"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return self.inner.metadata
+
+    def _record(self, prompt: str, response: str):
+        entry = {"prompt_key": prompt_key(prompt), "prompt": prompt[:500], "response": response}
+        with _recording_lock, open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        response = self.inner.complete(prompt, formatted=formatted, **kwargs)
+        self._record(prompt, response.text)
+        return response
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        response = self.complete(prompt, formatted=formatted, **kwargs)
+
+        def gen() -> CompletionResponseGen:
+            yield CompletionResponse(text=response.text, delta=response.text)
+
+        return gen()
+
+
+_recording_lock = threading.Lock()
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class FakeEmbedding(BaseEmbedding):
+    """Deterministic offline embedding using signed feature hashing of word tokens.
+
+    Texts that share identifiers get similar vectors, so retrieval behaves
+    plausibly without a model.
+    """
+
+    embed_dim: int = Field(default=256, gt=0)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.embed_dim
+        for token in _TOKEN_PATTERN.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.embed_dim
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+        return [value / norm for value in vector]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._embed(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed(text)
+
+    def _get_text_embeddings(self, texts: Sequence[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
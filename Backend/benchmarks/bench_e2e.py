@@ -0,0 +1,303 @@
+# Offline end-to-end benchmark of AgenticAISystem.
+#
+# Runs ingestion, index build, retrieval, execute_plan, sandbox setup and a
+# full process_requirement against synthetic repositories, using the
+# deterministic FakeEmbedding and a FakeLLM with canned responses (or a
+# RecordedLLM replaying a capture made with LLM_BACKEND=recording).
+# Usage (from the Backend directory):
+#
+#   python benchmarks/bench_e2e.py --files 1000 10000 --output baseline.json
+#   python benchmarks/bench_e2e.py --files 1000 --compare baseline.json
+#
+# With several --files sizes each one runs in a subprocess of its own, so
+# peak_rss_mb is the peak of that size rather than of the largest so far.
+# The synthetic repository is committed to git, and every edit goes through
+# an overlay as it does in the server, so the repository stays untouched.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("EMBED_BACKEND", "fake")
+os.environ.setdefault("WARM_UP", "0")
+
+# Canned answers for the prompts the pipeline sends, matched by substring
+FAKE_RESPONSES = {
+    "Convert the following implementation plan": json.dumps({
+        "files_to_modify": ["pkg_0/module_0.py"],
+        "files_to_create": ["pkg_0/bench_new.py"],
+        "implementation_steps": [
+            "Add a benchmark_helper function to pkg_0/module_0.py",
+            "Create pkg_0/bench_new.py exposing run_benchmark",
+        ],
+        "potential_risks": ["None"],
+        "tests": ["Test benchmark_helper"],
+    }),
+    "identify the exact locations": "Add the new function after line 3.",
+    "Generate the exact code": "def benchmark_helper():\n    return 42",
+    "Generate new code to add after the imports": "BENCHMARK = True",
+    "Create a new file at": "def run_benchmark():\n    return 'ok'\n",
+    "Generate pytest test code": "def test_placeholder():\n    assert True\n",
+    "Analyze the following test failure output": json.dumps({
+        "summary": "benchmark", "root_causes": [], "fixes": []
+    }),
+    "Generate a clear and descriptive git commit message": "Add benchmark helper",
+}
+
+BENCH_PLAN = json.loads(FAKE_RESPONSES["Convert the following implementation plan"])
+
+# The planner submits its plan through the submit_plan tool in one ReAct step
+FAKE_RESPONSES = {
+    "Create a detailed implementation plan for this requirement": (
+        "Thought: I have enough information to submit the plan.\n"
+        "Action: submit_plan\n"
+        f"Action Input: {json.dumps(BENCH_PLAN)}"
+    ),
+    **FAKE_RESPONSES,
+}
+
+QUERIES = [
+    "Where is the configuration loaded?",
+    "Which class handles user sessions?",
+    "How are records serialized to JSON?",
+    "Find the retry logic for network calls",
+    "Where are request handlers registered?",
+]
+
+
+def generate_repo(path: str, num_files: int, functions_per_file: int, seed: int = 0) -> int:
+    """Write a synthetic Python repository.
+
+    Args:
+        path: Directory to create the repository in
+        num_files: Number of Python modules
+        functions_per_file: Functions (and methods) per module
+        seed: Random seed, so the same arguments produce the same repository
+
+    Returns:
+        Total size of the repository in bytes
+    """
+    rng = random.Random(seed)
+    words = ["config", "session", "record", "network", "handler", "cache", "user", "token",
+             "request", "response", "parser", "retry", "index", "vector", "store", "loader"]
+    total_bytes = 0
+    for i in range(num_files):
+        package = os.path.join(path, f"pkg_{i // 100}")
+        os.makedirs(package, exist_ok=True)
+        lines = ["import os", "import json", "from typing import Dict, List", ""]
+        class_name = f"{rng.choice(words).title()}{rng.choice(words).title()}{i}"
+        lines.append(f"class {class_name}:")
+        lines.append(f'    """Handles {rng.choice(words)} and {rng.choice(words)} logic."""')
+        for j in range(functions_per_file):
+            a, b = rng.choice(words), rng.choice(words)
+            lines += [
+                f"    def {a}_{b}_{j}(self, {a}: Dict, {b}: List) -> Dict:",
+                f'        """Combine {a} with {b}."""',
+                f"        result = dict({a})",
+                f"        result['{b}'] = [item for item in {b} if item]",
+                f"        return result",
+                "",
+            ]
+        for j in range(functions_per_file):
+            a = rng.choice(words)
+            lines += [
+                f"def load_{a}_{j}(path: str) -> Dict:",
+                f"    with open(os.path.join(path, '{a}.json')) as f:",
+                f"        return json.load(f)",
+                "",
+            ]
+        content = "\n".join(lines) + "\n"
+        with open(os.path.join(package, f"module_{i}.py"), "w") as f:
+            f.write(content)
+        total_bytes += len(content)
+    return total_bytes
+
+
+def commit_repo(path: str):
+    """Make the synthetic repository a git repository with everything committed."""
+    env = dict(os.environ, GIT_AUTHOR_NAME="bench", GIT_AUTHOR_EMAIL="bench@example.com",
+               GIT_COMMITTER_NAME="bench", GIT_COMMITTER_EMAIL="bench@example.com")
+    for command in (["init", "-q"], ["add", "-A"], ["commit", "-q", "-m", "Synthetic repository"]):
+        subprocess.run(["git", *command], cwd=path, env=env, check=True)
+
+
+def repo_status(path: str) -> str:
+    """Porcelain git status of a repository; empty when nothing changed."""
+    return subprocess.run(["git", "status", "--porcelain"], cwd=path, capture_output=True, text=True, check=True).stdout
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is the high-water mark of the whole process, so each size runs
+    # in a process of its own. It is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def run(num_files: int, functions_per_file: int, retrieval_queries: int) -> dict:
+    """Benchmark one repository size.
+
+    Returns:
+        Timings and throughput for every stage
+    """
+    from agents import CodebaseIngestor, KnowledgeBuilder, ChangeExecutor, TestSandboxRunner
+    from masteragent import AgenticAISystem
+    from tracing import Tracer
+    from workspace import OverlayWorkspace
+
+    result = {"files": num_files}
+    with tempfile.TemporaryDirectory(prefix="cursor_bench_") as temp_dir:
+        repo_path = os.path.join(temp_dir, "repo")
+        result["repo_bytes"] = generate_repo(repo_path, num_files, functions_per_file)
+        commit_repo(repo_path)
+
+        start = time.perf_counter()
+        nodes = CodebaseIngestor(repo_path).ingest()
+        ingest_s = time.perf_counter() - start
+        result["ingest_s"] = ingest_s
+        result["nodes"] = len(nodes)
+        result["ingest_files_per_s"] = num_files / ingest_s
+        result["ingest_nodes_per_s"] = len(nodes) / ingest_s
+
+        start = time.perf_counter()
+        index = KnowledgeBuilder().build_index(nodes)
+        result["index_build_s"] = time.perf_counter() - start
+
+        retriever = index.as_retriever(similarity_top_k=5)
+        latencies = []
+        for i in range(retrieval_queries):
+            start = time.perf_counter()
+            retriever.retrieve(QUERIES[i % len(QUERIES)])
+            latencies.append((time.perf_counter() - start) * 1e3)
+        result["retrieval_p50_ms"] = percentile(latencies, 50)
+        result["retrieval_p99_ms"] = percentile(latencies, 99)
+
+        with OverlayWorkspace(repo_path).activate():
+            start = time.perf_counter()
+            ChangeExecutor(repo_path, index).execute_plan(BENCH_PLAN)
+            result["execute_plan_s"] = time.perf_counter() - start
+
+            # The sandbox gets the edits written on top, as in a run
+            tracer = Tracer("bench_sandbox")
+            with tracer.activate():
+                TestSandboxRunner(repo_path, test_command="true").run_tests()
+        sandbox = tracer.summary()["stages"].get("tests.sandbox_copy", {})
+        result["sandbox_setup_s"] = sandbox.get("total_ms", 0) / 1e3
+        result["sandbox_bytes_copied"] = sandbox.get("bytes_copied", 0)
+
+        # AgenticAISystem.__init__ rebuilds the index; only the requirement run is timed
+        system = AgenticAISystem(repo_path)
+        system.test_runner.test_command = "true"
+        with OverlayWorkspace(repo_path).activate():
+            start = time.perf_counter()
+            run_results = system.process_requirement("Add a benchmark helper")
+            result["process_requirement_s"] = time.perf_counter() - start
+        result["process_requirement_stages_ms"] = {
+            name: stage["total_ms"] for name, stage in run_results["metrics"]["stages"].items()
+        }
+        changed = repo_status(repo_path)
+        if changed:
+            raise RuntimeError(f"The benchmark changed the repository:\n{changed}")
+
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_in_subprocess(num_files: int, args: argparse.Namespace) -> dict:
+    """Benchmark one repository size in a fresh interpreter, so its peak RSS is its own."""
+    with tempfile.TemporaryDirectory(prefix="cursor_bench_") as temp_dir:
+        output = os.path.join(temp_dir, "result.json")
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__),
+            "--files", str(num_files),
+            "--functions-per-file", str(args.functions_per_file),
+            "--retrieval-queries", str(args.retrieval_queries),
+            "--output", output,
+        ], check=True)
+        with open(output) as f:
+            return json.load(f)["results"][0]
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> bool:
+    """Print timing regressions against a baseline.
+
+    Returns:
+        True if no timing regressed by more than the tolerance
+    """
+    with open(baseline_path) as f:
+        baseline = {entry["files"]: entry for entry in json.load(f)["results"]}
+
+    ok = True
+    for entry in results:
+        previous = baseline.get(entry["files"])
+        if previous is None:
+            continue
+        for key, value in entry.items():
+            if not key.endswith(("_s", "_ms")) or not isinstance(value, (int, float)):
+                continue
+            before = previous.get(key)
+            if not before:
+                continue
+            ratio = value / before
+            status = "REGRESSION" if ratio > 1 + tolerance else "ok"
+            ok = ok and status == "ok"
+            print(f"{entry['files']:>7} files  {key:<24} {before:10.3f} -> {value:10.3f}  x{ratio:5.2f}  {status}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark")
+    parser.add_argument("--files", type=int, nargs="+", default=[1000])
+    parser.add_argument("--functions-per-file", type=int, default=5)
+    parser.add_argument("--retrieval-queries", type=int, default=200)
+    parser.add_argument("--output", help="Write the results as a JSON baseline")
+    parser.add_argument("--compare", help="Baseline JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    if len(args.files) > 1:
+        # The child prints its own results
+        results = [run_in_subprocess(num_files, args) for num_files in args.files]
+    else:
+        from agents import configure_models
+        from backends import FakeLLM, RecordedLLM, create_embed_model
+
+        if os.environ["LLM_BACKEND"] == "recorded":
+            llm = RecordedLLM.from_file(os.getenv("LLM_RECORDING_PATH", "llm_recording.jsonl"), responses=FAKE_RESPONSES)
+        else:
+            llm = FakeLLM(responses=FAKE_RESPONSES)
+        configure_models(llm=llm, embed_model=create_embed_model())
+
+        entry = run(args.files[0], args.functions_per_file, args.retrieval_queries)
+        print(json.dumps(entry, indent=2))
+        results = [entry]
+
+    report = {
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "cpu_count": os.cpu_count(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare and not compare(results, args.compare, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Import-time benchmark for the backend modules.
+#
+# Every sample runs in a fresh interpreter so module caches don't hide the
+# cost. Usage (from the Backend directory):
+#
+#   python benchmarks/bench_import.py --runs 5 --output import_baseline.json
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SNIPPET = """
+import time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+{after}
+done = time.perf_counter()
+print(imported - start, done - imported)
+"""
+
+
+def measure(module: str, warm_up: bool, runs: int) -> dict:
+    """Measure the import time (and optionally warm-up time) of a module.
+
+    Args:
+        module: Module to import
+        warm_up: Also time agents.warm_up() after the import
+        runs: Number of fresh interpreters to sample
+
+    Returns:
+        Median and max timings in seconds
+    """
+    after = "import agents; agents.warm_up()" if warm_up else "pass"
+    code = SNIPPET.format(module=module, after=after)
+    import_times, warm_up_times = [], []
+    for _ in range(runs):
+        process = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=BACKEND_DIR,
+            capture_output=True,
+            text=True
+        )
+        if process.returncode != 0:
+            raise RuntimeError(f"Importing {module} failed:\n{process.stderr}")
+        import_time, warm_up_time = map(float, process.stdout.split()[-2:])
+        import_times.append(import_time)
+        warm_up_times.append(warm_up_time)
+
+    result = {
+        "import_median_s": statistics.median(import_times),
+        "import_max_s": max(import_times),
+    }
+    if warm_up:
+        result["warm_up_median_s"] = statistics.median(warm_up_times)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure backend import time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modules", nargs="+", default=["agents", "masteragent", "app"])
+    parser.add_argument("--warm-up", action="store_true", help="Also time agents.warm_up()")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = {module: measure(module, args.warm_up, args.runs) for module in args.modules}
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
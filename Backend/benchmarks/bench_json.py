@@ -0,0 +1,206 @@
+# Benchmark and fuzz the tolerant JSON extractor used on LLM responses.
+#
+# Compares json_extract.extract_json with the previous three-regex
+# prepare_for_json on a corpus of model responses (the bundled sample, or a
+# capture made with LLM_BACKEND=recording), checks that parse time grows
+# linearly with response size, and fuzzes the extractor with corrupted and
+# truncated JSON. Usage (from the Backend directory):
+#
+#   python benchmarks/bench_json.py
+#   python benchmarks/bench_json.py --corpus llm_recording.jsonl --fuzz 20000
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from json_extract import extract_json  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "json_responses.jsonl")
+
+
+def legacy_prepare_for_json(s: str) -> str:
+    """The regex-based prepare_for_json this extractor replaced, kept for comparison."""
+    s = re.sub(r'```json\s*|\s*```', '', s)
+    s = re.sub(r',\s*(?=[}\]])', '', s)
+
+    def esc_newlines(m):
+        inner = m.group(1).replace('\n', r'\n')
+        return f'"{inner}"'
+    s = re.sub(r'"([^"]*?)"', esc_newlines, s, flags=re.DOTALL)
+    return s
+
+
+def legacy_extract(text: str):
+    return json.loads(legacy_prepare_for_json(text))
+
+
+def load_corpus(path: str) -> list:
+    """Responses from a JSON-lines file with a "response" field that contain JSON."""
+    with open(path) as f:
+        entries = [json.loads(line) for line in f if line.strip()]
+    return [entry["response"] for entry in entries if "{" in entry["response"] or "[" in entry["response"]]
+
+
+def time_parser(parse, texts: list, repeat: int):
+    """Parse every text ``repeat`` times.
+
+    Returns:
+        Number of texts parsed successfully and mean microseconds per text
+    """
+    parsed = 0
+    for text in texts:
+        try:
+            parse(text)
+            parsed += 1
+        except ValueError:
+            pass
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            try:
+                parse(text)
+            except ValueError:
+                pass
+    elapsed = time.perf_counter() - start
+    return parsed, elapsed / (repeat * len(texts)) * 1e6
+
+
+def bench_corpus(texts: list, repeat: int):
+    print(f"Corpus: {len(texts)} responses")
+    for name, parse in (("legacy", legacy_extract), ("extract_json", extract_json)):
+        parsed, per_text_us = time_parser(parse, texts, repeat)
+        print(f"  {name:<14} parsed {parsed:>4}/{len(texts)}  {per_text_us:10.1f} us/response")
+
+
+def scaling_response(size: int) -> str:
+    """A fenced plan of roughly ``size`` bytes whose steps contain code with quotes and newlines."""
+    step = 'Replace print("done") with:\n    logger.info("done")\n'
+    steps = [step] * max(1, size // (len(step) + 8))
+    body = json.dumps({"files_to_modify": ["app.py"], "implementation_steps": steps}, indent=2)
+    # Raw newlines inside strings, as models often emit them
+    body = body.replace("\\n", "\n")
+    return "```json\n" + body[:-2] + ",\n}\n```"
+
+
+def bench_scaling(sizes: list):
+    print("Scaling (time per response; linear parsing doubles with size)")
+    for size in sizes:
+        text = scaling_response(size)
+        row = f"  {len(text):>9} bytes"
+        for name, parse in (("legacy", legacy_extract), ("extract_json", extract_json)):
+            start = time.perf_counter()
+            try:
+                parse(text)
+                status = "ok"
+            except ValueError:
+                status = "fail"
+            row += f"  {name} {(time.perf_counter() - start) * 1e3:9.2f} ms ({status})"
+        print(row)
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    kind = rng.randrange(7 if depth < 3 else 4)
+    if kind == 0:
+        return rng.randint(-1000, 1000)
+    if kind == 1:
+        return rng.choice([True, False, None, 1.5, -0.25])
+    if kind in (2, 3):
+        pieces = ['word', ' ', '"quoted"', '\n', '\t', '\\d+', 'line: 1', ', ', '}', ']', "it's", 'é']
+        return "".join(rng.choice(pieces) for _ in range(rng.randint(0, 8)))
+    if kind in (4, 5):
+        return {f"key_{i}": random_value(rng, depth + 1) for i in range(rng.randint(0, 4))}
+    return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+
+
+def sloppy_dumps(rng: random.Random, value, raw_controls: bool, trailing_commas: bool) -> str:
+    """Serialize like a model might: trailing commas and raw newlines/tabs in strings."""
+    if isinstance(value, dict):
+        items = [json.dumps(key) + ": " + sloppy_dumps(rng, item, raw_controls, trailing_commas) for key, item in value.items()]
+        comma = "," if trailing_commas and items and rng.random() < 0.5 else ""
+        return "{" + ",\n".join(items) + comma + "\n}"
+    if isinstance(value, list):
+        items = [sloppy_dumps(rng, item, raw_controls, trailing_commas) for item in value]
+        comma = "," if trailing_commas and items and rng.random() < 0.5 else ""
+        return "[" + ", ".join(items) + comma + "]"
+    if isinstance(value, str) and raw_controls:
+        return '"' + "".join(char if char in "\n\t" else json.dumps(char)[1:-1] for char in value) + '"'
+    return json.dumps(value)
+
+
+def corrupt(rng: random.Random, value) -> str:
+    """Render a value with the non-destructive mistakes models make; it must still be recoverable."""
+    text = sloppy_dumps(rng, value, raw_controls=rng.random() < 0.5, trailing_commas=rng.random() < 0.5)
+    if rng.random() < 0.5:
+        text = "```json\n" + text + "\n```"
+    if rng.random() < 0.5:
+        text = "Here is the result:\n" + text + "\nHope this helps."
+    return text
+
+
+def fuzz(iterations: int, seed: int) -> int:
+    """Check extractor properties on random documents.
+
+    - Valid JSON parses to the same value.
+    - Trailing commas, raw control characters, fences and prose still parse
+      to the same value.
+    - Any truncation either parses to the same container type or raises
+      ValueError, never anything else.
+
+    Returns:
+        Number of property violations
+    """
+    rng = random.Random(seed)
+    failures = 0
+    for i in range(iterations):
+        value = {"plan": random_value(rng)} if rng.random() < 0.8 else [random_value(rng)]
+        text = json.dumps(value, indent=rng.choice([None, 2]))
+        cases = [("valid", text), ("corrupted", corrupt(rng, value))]
+        for label, candidate in cases:
+            try:
+                parsed = extract_json(candidate)
+            except Exception as e:
+                parsed = e
+            if parsed != value:
+                failures += 1
+                if failures <= 5:
+                    print(f"  [{label}] iteration {i}: {candidate!r} -> {parsed!r}")
+        cut = rng.randrange(1, len(text) + 1)
+        try:
+            parsed = extract_json(text[:cut])
+        except ValueError:
+            continue
+        except Exception as e:
+            parsed = e
+        if not isinstance(parsed, type(value)):
+            failures += 1
+            if failures <= 5:
+                print(f"  [truncated] iteration {i}: {text[:cut]!r} -> {parsed!r}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and fuzz the LLM JSON extractor")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSON-lines file with a \"response\" field per line")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4_000, 16_000, 64_000, 256_000, 1_024_000])
+    parser.add_argument("--fuzz", type=int, default=5000, help="Fuzz iterations (0 to skip)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    bench_corpus(load_corpus(args.corpus), args.repeat)
+    bench_scaling(args.sizes)
+    if args.fuzz:
+        failures = fuzz(args.fuzz, args.seed)
+        print(f"Fuzz: {args.fuzz} documents, {failures} property violations")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
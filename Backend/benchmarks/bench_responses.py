@@ -0,0 +1,82 @@
+# Benchmark the size and encoding time of /chatv1 and /get_file_changes bodies.
+#
+# Builds a synthetic agent result with full original and modified contents
+# and a diff per file, and compares the previous jsonify body (standard
+# library json) with responses.encode_json: identity, gzip and, when
+# installed, brotli, with and without a summary ``fields`` projection.
+# The serializer is orjson when it is installed. Usage (from the Backend
+# directory):
+#
+#   python benchmarks/bench_responses.py
+#   python benchmarks/bench_responses.py --files 20 --lines 2000 --repeat 20
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import responses  # noqa: E402
+from diff_engine import unified_diff  # noqa: E402
+
+SUMMARY_FIELDS = "change_id,requirement,plan.summary,changes.modified_files,changes.created_files,test_results.success"
+
+
+def synthetic_results(files: int, lines: int, seed: int) -> dict:
+    """An agent result modifying a few lines in each of ``files`` source files."""
+    rng = random.Random(seed)
+    file_changes = {}
+    for i in range(files):
+        original = [f"def function_{i}_{n}(value):\n    return value * {rng.randint(0, 999)}\n" for n in range(lines // 2)]
+        modified = list(original)
+        for n in rng.sample(range(len(modified)), max(1, len(modified) // 50)):
+            modified[n] = modified[n].replace("return value", "return value + 1")
+        path = f"package/module_{i}.py"
+        original, modified = "".join(original), "".join(modified)
+        file_changes[path] = {
+            "original_content": original,
+            "modified_content": modified,
+            "diff": unified_diff(original, modified, path),
+        }
+    return {
+        "change_id": "00000000-0000-0000-0000-000000000000",
+        "requirement": "Add one to every returned value",
+        "plan": {"summary": "Adjust return values", "files_to_modify": list(file_changes)},
+        "changes": {"modified_files": list(file_changes), "created_files": [], "file_changes": file_changes},
+        "test_results": {"success": True, "output": "ok"},
+    }
+
+
+def bench(name: str, encode, repeat: int, baseline: int):
+    body = encode()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encode()
+    elapsed_ms = (time.perf_counter() - start) / repeat * 1000
+    print(f"  {name:<24} {len(body):>12,} bytes  {baseline / len(body):7.1f}x smaller  {elapsed_ms:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark agent result response bodies")
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--lines", type=int, default=1000, help="Lines per file")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = synthetic_results(args.files, args.lines, args.seed)
+    baseline = len(json.dumps(results).encode())
+    print(f"{args.files} files of {args.lines} lines, serializer: {'orjson' if responses.orjson else 'json'}")
+    bench("jsonify (before)", lambda: json.dumps(results).encode(), args.repeat, baseline)
+    encodings = [None, "gzip"] + (["br"] if responses.brotli else [])
+    for fields in (None, SUMMARY_FIELDS):
+        for encoding in encodings:
+            name = f"{encoding or 'identity'}{' + fields' if fields else ''}"
+            bench(name, lambda: responses.encode_json(results, fields, encoding)[0], args.repeat, baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+# Benchmark recall@k against memory for the vector store representations.
+#
+# Builds a synthetic clustered corpus shaped like code embeddings, computes
+# the exact top-k by brute force and compares:
+#
+# - python floats: lists of floats, as SimpleVectorStore keeps them
+# - float32: a dense numpy matrix
+# - int8 / pq: quantized_store.QuantizedVectors, with and without exact
+#   re-ranking of the top candidates from the memory-mapped vectors
+#
+# Memory is the resident size of each representation; the memory-mapped
+# float32 file used for re-ranking is on disk and not counted. Usage (from
+# the Backend directory):
+#
+#   python benchmarks/bench_vector_store.py
+#   python benchmarks/bench_vector_store.py --vectors 100000 --dim 768 --k 10 --rerank 0 8
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from quantized_store import QuantizedVectors  # noqa: E402
+
+
+def synthetic_corpus(count: int, dim: int, queries: int, seed: int):
+    """Unit vectors scattered around a few hundred topics, and queries near them."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(max(8, count // 100), dim)).astype(np.float32)
+    vectors = centers[rng.integers(len(centers), size=count)] + 0.6 * rng.normal(size=(count, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    picks = vectors[rng.integers(count, size=queries)]
+    query_vectors = picks + 0.3 * rng.normal(size=picks.shape).astype(np.float32) / np.sqrt(dim)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return vectors, query_vectors
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ vectors.T
+    return np.argsort(-scores, axis=1)[:, :k]
+
+
+def python_list_bytes(vectors: np.ndarray, sample: int = 1000) -> float:
+    """Bytes per vector of a list of Python floats, measured on a sample."""
+    sample = vectors[:sample]
+    tracemalloc.start()
+    lists = [row.tolist() for row in sample]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del lists
+    return size / len(sample)
+
+
+def recall(found: list, truth: np.ndarray) -> float:
+    hits = sum(len(set(ids) & set(expected)) for ids, expected in zip(found, truth))
+    return hits / truth.size
+
+
+def bench_quantized(mode: str, rerank: int, vectors: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int):
+    store = QuantizedVectors(mode, rerank=rerank)
+    start = time.perf_counter()
+    for offset in range(0, len(vectors), 10000):
+        chunk = vectors[offset:offset + 10000]
+        store.add([str(i) for i in range(offset, offset + len(chunk))], chunk)
+    # Warm-up query trains the PQ codebooks
+    store.search(queries[0], k)
+    build_s = time.perf_counter() - start
+    start = time.perf_counter()
+    found = [[int(i) for i in store.search(query, k)[0]] for query in queries]
+    query_ms = (time.perf_counter() - start) / len(queries) * 1e3
+    return recall(found, truth), store.nbytes() / len(vectors), query_ms, build_s
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall@k versus memory of the vector store representations")
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=768)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank", type=int, nargs="+", default=[0, 4, 16], help="Re-ranked candidates per result")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    vectors, queries = synthetic_corpus(args.vectors, args.dim, args.queries, args.seed)
+    truth = exact_top_k(vectors, queries, args.k)
+    print(f"{args.vectors} vectors x {args.dim} dims, {args.queries} queries, recall@{args.k}")
+    print(f"  {'store':<16} {'recall':>7} {'bytes/vector':>13} {'x smaller':>10} {'query ms':>9} {'build s':>8}")
+
+    baseline = python_list_bytes(vectors)
+    print(f"  {'python floats':<16} {1.0:7.3f} {baseline:13.0f} {1.0:10.1f} {'':>9} {'':>8}")
+    start = time.perf_counter()
+    for query in queries:
+        np.argpartition(-(vectors @ query), args.k)[:args.k]
+    query_ms = (time.perf_counter() - start) / len(queries) * 1e3
+    dense = vectors.nbytes / len(vectors)
+    print(f"  {'float32':<16} {1.0:7.3f} {dense:13.0f} {baseline / dense:10.1f} {query_ms:9.2f} {'':>8}")
+
+    for mode in ("int8", "pq"):
+        for rerank in args.rerank:
+            name = f"{mode} rerank={rerank}"
+            found_recall, per_vector, query_ms, build_s = bench_quantized(mode, rerank, vectors, queries, truth, args.k)
+            print(f"  {name:<16} {found_recall:7.3f} {per_vector:13.0f} {baseline / per_vector:10.1f} {query_ms:9.2f} {build_s:8.2f}")
+
+
+if __name__ == "__main__":
+    main()
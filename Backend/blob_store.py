@@ -0,0 +1,135 @@
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Where file contents of pending changes are stored, once per distinct content
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "pending_blobs"))
+
+# Unreferenced blobs younger than this are kept: runs still in progress write
+# their blobs before the change that references them is saved
+BLOB_MIN_AGE = 3600
+
+_HASH_RE = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobStore:
+    """Content-addressed store of file contents.
+
+    Each content is written once under its SHA-256, so the original and
+    modified versions of a file are stored once however many results,
+    pending changes and overlays refer to them. Blobs are immutable;
+    unreferenced ones are removed by collect.
+    """
+
+    def __init__(self, root: str):
+        """Initialize the store.
+
+        Args:
+            root: Directory holding the blobs, created on the first write
+        """
+        self.root = root
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def hash(content: str) -> str:
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    @staticmethod
+    def is_hash(value: Any) -> bool:
+        return isinstance(value, str) and bool(_HASH_RE.match(value))
+
+    def path(self, blob_hash: str) -> str:
+        if not self.is_hash(blob_hash):
+            raise ValueError(f"Not a blob hash: {blob_hash!r}")
+        return os.path.join(self.root, blob_hash[:2], blob_hash[2:])
+
+    def put(self, content: str) -> str:
+        """Store a content, or mark it as just stored if it is stored already.
+
+        Returns:
+            Hash the content can be read back with
+        """
+        blob_hash = self.hash(content)
+        path = self.path(blob_hash)
+        try:
+            # Refreshed so collect counts the blob's age from its latest use
+            os.utime(path)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as f:
+                f.write(content.encode())
+            os.replace(temp_path, path)
+        return blob_hash
+
+    def get(self, blob_hash: Optional[str]) -> Optional[str]:
+        """Content of a blob, or None if there is no such blob."""
+        data = self.get_bytes(blob_hash)
+        return None if data is None else data.decode()
+
+    def get_bytes(self, blob_hash: Optional[str]) -> Optional[bytes]:
+        if not self.is_hash(blob_hash):
+            return None
+        try:
+            with open(self.path(blob_hash), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, blob_hash: Optional[str]) -> bool:
+        return self.is_hash(blob_hash) and os.path.exists(self.path(blob_hash))
+
+    def collect(self, referenced: Set[str], min_age: float = BLOB_MIN_AGE) -> int:
+        """Remove the blobs nothing refers to any more.
+
+        Args:
+            referenced: Hashes still in use
+            min_age: Seconds a blob is kept after it was last stored, referenced or not
+
+        Returns:
+            Number of blobs removed
+        """
+        removed = 0
+        cutoff = time.time() - min_age
+        with self._lock:
+            if not os.path.isdir(self.root):
+                return 0
+            for prefix in os.listdir(self.root):
+                directory = os.path.join(self.root, prefix)
+                if not os.path.isdir(directory):
+                    continue
+                for name in os.listdir(directory):
+                    path = os.path.join(directory, name)
+                    if prefix + name in referenced:
+                        continue
+                    try:
+                        if os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                            removed += 1
+                    except FileNotFoundError:
+                        continue
+        if removed:
+            logger.info(f"Removed {removed} unreferenced blobs from {self.root}")
+        return removed
+
+
+def blob_hashes(value: Any) -> Iterable[str]:
+    """Hashes a result refers to: the values of its ``*_hash`` keys, at any depth."""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if isinstance(key, str) and key.endswith("_hash") and BlobStore.is_hash(item):
+                yield item
+            else:
+                yield from blob_hashes(item)
+    elif isinstance(value, list):
+        for item in value:
+            yield from blob_hashes(item)
+
+
+blob_store = BlobStore(BLOB_STORE_DIR)
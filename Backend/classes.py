@@ -70,4 +70,60 @@
         
 #     def process(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
 #         """Process inputs and return outputs"""
-#         raise NotImplementedError("Each agent must implement its own process method")
\ No newline at end of file
+#         raise NotImplementedError("Each agent must implement its own process method")
+
+
+from typing import Any, Dict, List
+
+from pydantic import BaseModel, Field
+
+
+class ImplementationPlan(BaseModel):
+    """Implementation plan produced by the PlanningAgent and consumed by the ChangeExecutor."""
+
+    files_to_modify: List[str] = Field(default_factory=list, description="Paths of existing files that need to be modified")
+    files_to_create: List[str] = Field(default_factory=list, description="Paths of new files that need to be created")
+    implementation_steps: List[str] = Field(default_factory=list, description="Implementation steps in order, each naming the file it changes")
+    potential_risks: List[str] = Field(default_factory=list, description="Potential risks or considerations")
+    tests: List[str] = Field(default_factory=list, description="Tests that should be added or modified")
+
+    @classmethod
+    def from_raw(cls, data: Any) -> "ImplementationPlan":
+        """Build a plan from loosely shaped model output.
+
+        Single values and nulls are coerced to lists, non-string items to
+        strings, and unknown keys are dropped.
+
+        Args:
+            data: Parsed model output
+
+        Returns:
+            The validated plan
+
+        Raises:
+            ValueError: If the data is not an object
+        """
+        if not isinstance(data, dict):
+            raise ValueError(f"Expected a plan object, got {type(data).__name__}")
+        fields = {}
+        for name in PLAN_FIELDS:
+            value = data.get(name)
+            if value is None:
+                value = []
+            elif not isinstance(value, list):
+                value = [value]
+            fields[name] = [_plan_item(item) for item in value if item not in (None, "")]
+        return cls(**fields)
+
+    def to_dict(self) -> Dict[str, List[str]]:
+        return {name: list(getattr(self, name)) for name in PLAN_FIELDS}
+
+
+PLAN_FIELDS = ("files_to_modify", "files_to_create", "implementation_steps", "potential_risks", "tests")
+
+
+def _plan_item(item: Any) -> str:
+    if isinstance(item, dict):
+        # e.g. {"file": "app.py", "change": "..."}; keep every value so file paths still match
+        return " ".join(str(value) for value in item.values())
+    return str(item)
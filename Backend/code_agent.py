@@ -1,25 +1,33 @@
 import os
 import json
+import asyncio
 import logging
-import difflib
 from typing import Dict, List, Optional, Any, Tuple
 import re
 
+from diff_engine import unified_diff
+from tracing import traced
+from workspace import workspace_for
+
 logger = logging.getLogger(__name__)
 
 class CodeChangeAgent:
     """Agent responsible for generating precise code changes rather than complete file rewrites."""
     
-    def __init__(self, repo_path: str, query_engine: Any):
+    def __init__(self, repo_path: str, query_engine: Any, analysis_query_engine: Any = None):
         """Initialize the code change agent.
         
         Args:
             repo_path: Path to the repository
             query_engine: Query engine for searching the codebase
+            analysis_query_engine: Optional (cheaper) query engine for file structure
+                and change point analysis; defaults to query_engine
         """
         self.repo_path = repo_path
         self.query_engine = query_engine
+        self.analysis_query_engine = analysis_query_engine or query_engine
     
+    @traced("code_change.analyze_structure", "file_path")
     def analyze_file_structure(self, file_path: str) -> Dict:
         """Analyze the structure of a file to understand its components.
         
@@ -29,14 +37,29 @@ class CodeChangeAgent:
         Returns:
             A dictionary containing the file structure analysis
         """
-        full_path = os.path.join(self.repo_path, file_path)
-        if not os.path.exists(full_path):
+        workspace = workspace_for(self.repo_path)
+        if not workspace.exists(file_path):
             return {"error": f"File not found: {file_path}"}
             
-        with open(full_path, 'r') as f:
-            content = f.read()
+        content = workspace.read(file_path)
+        
+        response = self.analysis_query_engine.query(self._structure_query(file_path))
+        return self._structure_analysis(file_path, content, response)
+    
+    @traced("code_change.analyze_structure", "file_path")
+    async def aanalyze_file_structure(self, file_path: str) -> Dict:
+        """Async version of analyze_file_structure."""
+        workspace = workspace_for(self.repo_path)
+        if not workspace.exists(file_path):
+            return {"error": f"File not found: {file_path}"}
             
-        query = f"""
+        content = workspace.read(file_path)
+        
+        response = await self.analysis_query_engine.aquery(self._structure_query(file_path))
+        return self._structure_analysis(file_path, content, response)
+    
+    def _structure_query(self, file_path: str) -> str:
+        return f"""
         Analyze the structure of this file {file_path} and identify:
         1. Major sections or blocks of code
         2. Class and function definitions
@@ -45,9 +68,8 @@ class CodeChangeAgent:
         
         Format the analysis to identify the line numbers and positions of key elements.
         """
-        
-        response = self.query_engine.query(query)
-        
+    
+    def _structure_analysis(self, file_path: str, content: str, response: Any) -> Dict:
         # Identify import section lines
         import_lines = []
         lines = content.split('\n')
@@ -81,6 +103,7 @@ class CodeChangeAgent:
             "analysis": str(response)
         }
     
+    @traced("code_change.change_points")
     def identify_change_points(self, file_analysis: Dict, change_description: str) -> List[Dict]:
         """Identify specific points in the file where changes should be made.
         
@@ -91,7 +114,20 @@ class CodeChangeAgent:
         Returns:
             A list of change points with locations and change types
         """
-        query = f"""
+        response = self.analysis_query_engine.query(self._change_points_query(file_analysis, change_description))
+        
+        # Parse the response for change points
+        change_points = self._parse_change_points(str(response), file_analysis)
+        return change_points
+    
+    @traced("code_change.change_points")
+    async def aidentify_change_points(self, file_analysis: Dict, change_description: str) -> List[Dict]:
+        """Async version of identify_change_points."""
+        response = await self.analysis_query_engine.aquery(self._change_points_query(file_analysis, change_description))
+        return self._parse_change_points(str(response), file_analysis)
+    
+    def _change_points_query(self, file_analysis: Dict, change_description: str) -> str:
+        return f"""
         Based on this file analysis and the required changes, identify the exact locations
         where changes should be made. For each change point, specify:
         1. The line number or range to modify
@@ -104,12 +140,6 @@ class CodeChangeAgent:
         
         Return the information in a concise format focusing on precise locations.
         """
-        
-        response = self.query_engine.query(query)
-        
-        # Parse the response for change points
-        change_points = self._parse_change_points(str(response), file_analysis)
-        return change_points
     
     def _parse_change_points(self, response_text: str, file_analysis: Dict) -> List[Dict]:
         """Parse the response to extract structured change points.
@@ -181,6 +211,7 @@ class CodeChangeAgent:
         
         return change_points
     
+    @traced("code_change.generate", "file_path")
     def generate_changes(self, file_path: str, change_points: List[Dict], change_description: str) -> Dict:
         """Generate specific code changes for the identified change points.
         
@@ -192,22 +223,40 @@ class CodeChangeAgent:
         Returns:
             A dictionary containing the original and modified content
         """
-        full_path = os.path.join(self.repo_path, file_path)
-        with open(full_path, 'r') as f:
-            original_content = f.read()
+        original_content = workspace_for(self.repo_path).read(file_path)
         
         lines = original_content.split('\n')
-        modified_lines = lines.copy()
-        
+        responses = []
         for point in change_points:
-            change_type = point["type"]
-            start_line = point["start_line"]
-            end_line = point["end_line"]
-            
-            # Get appropriate context for this change point
-            context = '\n'.join(lines[max(0, start_line-5):min(len(lines), end_line+5)])
-            the_file = '\n'.join(lines[start_line:end_line+1])
-            prompt = f"""
+            prompt = self._change_prompt(file_path, lines, point, change_description)
+            responses.append(self.query_engine.query(prompt))
+        
+        return self._apply_changes(file_path, original_content, change_points, responses)
+    
+    @traced("code_change.generate", "file_path")
+    async def agenerate_changes(self, file_path: str, change_points: List[Dict], change_description: str) -> Dict:
+        """Async version of generate_changes.
+        
+        Prompts only depend on the original content, so the snippets for all
+        change points are requested concurrently and applied in order afterwards.
+        """
+        original_content = workspace_for(self.repo_path).read(file_path)
+        
+        lines = original_content.split('\n')
+        prompts = [self._change_prompt(file_path, lines, point, change_description) for point in change_points]
+        responses = await asyncio.gather(*(self.query_engine.aquery(prompt) for prompt in prompts))
+        
+        return self._apply_changes(file_path, original_content, change_points, responses)
+    
+    def _change_prompt(self, file_path: str, lines: List[str], point: Dict, change_description: str) -> str:
+        change_type = point["type"]
+        start_line = point["start_line"]
+        end_line = point["end_line"]
+        
+        # Get appropriate context for this change point
+        context = '\n'.join(lines[max(0, start_line-5):min(len(lines), end_line+5)])
+        the_file = '\n'.join(lines[start_line:end_line+1])
+        prompt = f"""
             Generate the exact code to {change_type} for this change point in file {file_path}.
             
             Change requirement: {change_description}
@@ -222,9 +271,9 @@ class CodeChangeAgent:
             Only return the new code snippet that should replace or be inserted at this location.
             Follow the instructions stricly.
             No explanations or markdown formatting, just the exact code to use."""
-            the_file = '\n'.join([lines[i] for i in range(start_line-3, start_line+1)])
-            if change_type == "add_after_imports":
-                prompt = f"""
+        the_file = '\n'.join([lines[i] for i in range(start_line-3, start_line+1)])
+        if change_type == "add_after_imports":
+            prompt = f"""
                 Generate new code to add after the imports section in file {file_path}.
                 
                 Change requirement: {change_description}
@@ -237,8 +286,15 @@ class CodeChangeAgent:
                 Only return the new code to insert, no explanations or formatting.
                 Do not create the whole file again
                 """
-            
-            response = self.query_engine.query(prompt)
+        return prompt
+    
+    def _apply_changes(self, file_path: str, original_content: str, change_points: List[Dict], responses: List[Any]) -> Dict:
+        modified_lines = original_content.split('\n')
+        
+        for point, response in zip(change_points, responses):
+            change_type = point["type"]
+            start_line = point["start_line"]
+            end_line = point["end_line"]
             new_code = str(response).strip()
             
             # Remove any markdown code blocks
@@ -255,22 +311,17 @@ class CodeChangeAgent:
         modified_content = '\n'.join(modified_lines)
         
         # Generate diff
-        diff = list(difflib.unified_diff(
-            original_content.splitlines(),
-            modified_content.splitlines(),
-            fromfile=f'a/{file_path}',
-            tofile=f'b/{file_path}',
-            lineterm=''
-        ))
+        diff = unified_diff(original_content, modified_content, file_path)
         
         return {
             "file_path": file_path,
             "original_content": original_content,
             "modified_content": modified_content,
-            "diff": '\n'.join(diff),
+            "diff": diff,
             "change_points": change_points
         }
     
+    @traced("code_change.create_file", "file_path")
     def create_new_file(self, file_path: str, change_description: str, similar_files: List[str] = None) -> Dict:
         """Generate content for a new file.
         
@@ -282,20 +333,29 @@ class CodeChangeAgent:
         Returns:
             A dictionary containing the generated content
         """
+        response = self.query_engine.query(self._new_file_prompt(file_path, change_description, similar_files))
+        return self._new_file_result(file_path, response)
+    
+    @traced("code_change.create_file", "file_path")
+    async def acreate_new_file(self, file_path: str, change_description: str, similar_files: List[str] = None) -> Dict:
+        """Async version of create_new_file."""
+        response = await self.query_engine.aquery(self._new_file_prompt(file_path, change_description, similar_files))
+        return self._new_file_result(file_path, response)
+    
+    def _new_file_prompt(self, file_path: str, change_description: str, similar_files: List[str] = None) -> str:
         similar_file_contents = []
         
         if similar_files:
+            workspace = workspace_for(self.repo_path)
             for sim_file in similar_files[:2]:  # Limit to 2 files for context
-                full_path = os.path.join(self.repo_path, sim_file)
-                if os.path.exists(full_path):
-                    with open(full_path, 'r') as f:
-                        similar_file_contents.append((sim_file, f.read()))
+                if workspace.exists(sim_file):
+                    similar_file_contents.append((sim_file, workspace.read(sim_file)))
         
         similar_files_context = ""
         for sim_file, content in similar_file_contents:
             similar_files_context += f"\nSimilar file: {sim_file}\n```\n{content[:1000]}...\n```\n"
         
-        prompt = f"""
+        return f"""
         Create a new file at {file_path} based on this requirement:
         
         {change_description}
@@ -304,8 +364,8 @@ class CodeChangeAgent:
         
         Return only the complete file content without any explanations or markdown formatting.
         """
-        
-        response = self.query_engine.query(prompt)
+    
+    def _new_file_result(self, file_path: str, response: Any) -> Dict:
         new_content = str(response)
         
         # Remove any markdown code blocks
@@ -0,0 +1,201 @@
+import os
+import shutil
+import logging
+import difflib
+import tempfile
+import subprocess
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Inputs larger than this (in bytes, either side) are diffed with git's
+# linear-space histogram/Myers implementation instead of difflib.
+DIFF_FAST_THRESHOLD = int(os.getenv("DIFF_FAST_THRESHOLD", str(256 * 1024)))
+# Inputs larger than this only get a summary (line counts) instead of hunks.
+DIFF_SUMMARY_THRESHOLD = int(os.getenv("DIFF_SUMMARY_THRESHOLD", str(8 * 1024 * 1024)))
+DIFF_ALGORITHM = os.getenv("DIFF_ALGORITHM", "histogram")
+
+
+class DiffEngine:
+    """Unified diff generator that picks an algorithm based on input size."""
+
+    def __init__(
+        self,
+        fast_threshold: int = DIFF_FAST_THRESHOLD,
+        summary_threshold: int = DIFF_SUMMARY_THRESHOLD,
+        algorithm: str = DIFF_ALGORITHM,
+        context_lines: int = 3
+    ):
+        """Initialize the diff engine.
+
+        Args:
+            fast_threshold: Size in bytes above which git's diff is used
+            summary_threshold: Size in bytes above which only a summary is produced
+            algorithm: git diff algorithm (histogram, patience, myers, minimal)
+            context_lines: Number of context lines around each hunk
+        """
+        self.fast_threshold = fast_threshold
+        self.summary_threshold = summary_threshold
+        self.algorithm = algorithm
+        self.context_lines = context_lines
+        self.git_executable = shutil.which("git")
+
+    def unified_diff(self, original: str, modified: str, file_path: str, summary_only: bool = False) -> str:
+        """Generate a unified diff between two versions of a file.
+
+        Args:
+            original: Original file content
+            modified: Modified file content
+            file_path: Path of the file, used in the diff headers
+            summary_only: Only report line counts, never hunks
+
+        Returns:
+            The diff as a string (empty if the contents are identical)
+        """
+        original = original or ""
+        modified = modified or ""
+        if original == modified:
+            return ""
+
+        size = max(len(original), len(modified))
+        if summary_only or size > self.summary_threshold:
+            return self.summarize(original, modified, file_path)
+
+        if size > self.fast_threshold and self.git_executable:
+            diff = self._git_diff(original, modified, file_path)
+            if diff is not None:
+                return diff
+            logger.warning(f"git diff failed for {file_path}, falling back to difflib")
+
+        return self._difflib_diff(original, modified, file_path)
+
+    def summarize(self, original: str, modified: str, file_path: str) -> str:
+        """Summarize the difference between two versions without producing hunks.
+
+        Args:
+            original: Original file content
+            modified: Modified file content
+            file_path: Path of the file, used in the diff headers
+
+        Returns:
+            A diff-style header followed by added/removed line counts
+        """
+        counts = None
+        if self.git_executable:
+            counts = self._git_numstat(original, modified)
+        if counts is None:
+            counts = self._trimmed_counts(original, modified)
+        added, removed = counts
+
+        return '\n'.join([
+            f'--- a/{file_path}',
+            f'+++ b/{file_path}',
+            f'@@ summary: +{added} -{removed} lines '
+            f'({len(original)} -> {len(modified)} bytes), diff omitted for large file @@'
+        ])
+
+    def _headers(self, file_path: str) -> list:
+        return [f'--- a/{file_path}', f'+++ b/{file_path}']
+
+    def _difflib_diff(self, original: str, modified: str, file_path: str) -> str:
+        # Lines keep their newline, so a change to the last one's is a change, as in git
+        diff = difflib.unified_diff(
+            _lines(original),
+            _lines(modified),
+            fromfile=f'a/{file_path}',
+            tofile=f'b/{file_path}',
+            n=self.context_lines,
+            lineterm=''
+        )
+        output = []
+        for i, line in enumerate(diff):
+            if i < 2 or line.startswith('@@'):
+                output.append(line)
+            elif line.endswith('\n'):
+                output.append(line[:-1])
+            else:
+                output += [line, '\\ No newline at end of file']
+        return '\n'.join(output)
+
+    def _run_git_diff(self, original: str, modified: str, extra_args: list) -> Optional[str]:
+        """Run ``git diff --no-index`` over two temporary files.
+
+        Returns:
+            git's stdout, or None if git failed
+        """
+        with tempfile.TemporaryDirectory(prefix="cursor_diff_") as temp_dir:
+            old_path = os.path.join(temp_dir, "old")
+            new_path = os.path.join(temp_dir, "new")
+            with open(old_path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+                f.write(original)
+            with open(new_path, 'w', encoding='utf-8', errors='surrogateescape') as f:
+                f.write(modified)
+
+            command = [
+                self.git_executable, "diff", "--no-index", "--no-color",
+                "--no-ext-diff", "--no-textconv", f"--diff-algorithm={self.algorithm}",
+                *extra_args, "--", old_path, new_path
+            ]
+            try:
+                process = subprocess.run(command, capture_output=True, cwd=temp_dir)
+            except OSError as e:
+                logger.error(f"Failed to run git diff: {e}")
+                return None
+
+        # git diff --no-index exits with 1 when the files differ
+        if process.returncode not in (0, 1):
+            logger.error(f"git diff exited with {process.returncode}: {process.stderr.decode(errors='replace')}")
+            return None
+        return process.stdout.decode('utf-8', errors='replace')
+
+    def _git_diff(self, original: str, modified: str, file_path: str) -> Optional[str]:
+        output = self._run_git_diff(original, modified, [f"-U{self.context_lines}"])
+        if output is None:
+            return None
+
+        lines = output.rstrip('\n').split('\n')
+        hunk_start = next((i for i, line in enumerate(lines) if line.startswith('@@')), None)
+        if hunk_start is None:
+            # Binary content or whitespace-only changes git refuses to render
+            return self.summarize(original, modified, file_path)
+        return '\n'.join(self._headers(file_path) + lines[hunk_start:])
+
+    def _git_numstat(self, original: str, modified: str) -> Optional[Tuple[int, int]]:
+        output = self._run_git_diff(original, modified, ["--numstat"])
+        if not output:
+            return None
+        fields = output.split('\t')
+        if len(fields) < 2 or not fields[0].isdigit() or not fields[1].isdigit():
+            return None
+        return int(fields[0]), int(fields[1])
+
+    def _trimmed_counts(self, original: str, modified: str) -> Tuple[int, int]:
+        """Upper bound of added/removed lines after trimming the common prefix and suffix."""
+        original_lines = original.splitlines()
+        modified_lines = modified.splitlines()
+        limit = min(len(original_lines), len(modified_lines))
+
+        prefix = 0
+        while prefix < limit and original_lines[prefix] == modified_lines[prefix]:
+            prefix += 1
+        suffix = 0
+        while (suffix < limit - prefix
+               and original_lines[-1 - suffix] == modified_lines[-1 - suffix]):
+            suffix += 1
+
+        return len(modified_lines) - prefix - suffix, len(original_lines) - prefix - suffix
+
+
+def _lines(text: str) -> list:
+    """Lines split at newlines only, as git splits them, each keeping its newline."""
+    lines = [line + '\n' for line in text.split('\n')]
+    lines[-1] = lines[-1][:-1]
+    return lines if lines[-1] else lines[:-1]
+
+
+diff_engine = DiffEngine()
+
+
+def unified_diff(original: str, modified: str, file_path: str, summary_only: bool = False) -> str:
+    """Generate a unified diff with the shared default engine."""
+    return diff_engine.unified_diff(original, modified, file_path, summary_only=summary_only)
@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import random
+import hashlib
+import threading
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import metrics
+from tracing import trace_span
+
+logger = logging.getLogger(__name__)
+
+# Fragments of the errors providers raise when a quota is exceeded
+_THROTTLE_MARKERS = ("429", "rate limit", "ratelimit", "quota", "resource exhausted", "resource_exhausted", "too many requests")
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    """Whether an embedding error means the provider is rate limiting us."""
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    if status == 429:
+        return True
+    message = f"{type(error).__name__} {error}".lower()
+    return any(marker in message for marker in _THROTTLE_MARKERS)
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly four characters per token for code and English
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at a per-minute rate."""
+
+    def __init__(self, per_minute: float):
+        """Initialize a full bucket.
+
+        Args:
+            per_minute: Refill rate, 0 for unlimited; also the bucket capacity
+        """
+        self.rate = per_minute / 60.0
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount: float = 1):
+        """Wait until ``amount`` tokens are available and take them.
+
+        Requests larger than the capacity wait for a full bucket.
+        """
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock, so they are served in order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveLimit:
+    """Concurrency limit that halves on throttling and grows back by one as batches succeed."""
+
+    def __init__(self, limit: int):
+        self.max_limit = limit
+        self.limit = limit
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, throttled: bool):
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self.limit < self.max_limit and self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._condition.notify_all()
+
+
+class EmbeddingCheckpoint:
+    """Append-only log of embedded batches, so an interrupted index build can resume.
+
+    Each completed batch is one JSON line of content-hash keys and vectors,
+    flushed and fsynced before the batch counts as done. Keys hash the
+    embedded text together with the model name, so node ids can change
+    between runs and a different model starts from scratch. A line torn by
+    a crash is cut off on load.
+    """
+
+    def __init__(self, path: str, model_name: str = ""):
+        """Initialize the checkpoint.
+
+        Args:
+            path: JSON-lines file, created on the first append
+            model_name: Name of the embedding model the vectors come from
+        """
+        self.path = path
+        self.model_name = model_name
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> str:
+        return hashlib.blake2b(f"{self.model_name}\0{text}".encode(), digest_size=16).hexdigest()
+
+    def load(self) -> Dict[str, List[float]]:
+        """Vectors of all committed batches by key."""
+        embeddings: Dict[str, List[float]] = {}
+        if not os.path.exists(self.path):
+            return embeddings
+        good_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    batch = json.loads(line)
+                except ValueError:
+                    break
+                embeddings.update(zip(batch["keys"], batch["embeddings"]))
+                good_size += len(line)
+        if good_size < os.path.getsize(self.path):
+            logger.warning(f"Dropping a partially written batch from {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_size)
+        return embeddings
+
+    def append(self, keys: List[str], embeddings: List[List[float]]):
+        """Durably record one embedded batch."""
+        line = json.dumps({"keys": keys, "embeddings": embeddings}) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class EmbeddingPipeline:
+    """Embeds nodes in concurrent batches within the provider's rate limits.
+
+    Batches are sent from worker threads, so blocking embedding clients
+    still overlap. Requests and tokens per minute are metered by token
+    buckets; a throttling error halves the number of batches in flight and
+    the batch is retried after an exponential backoff with jitter.
+    """
+
+    def __init__(self, embed_model: Any, batch_size: Optional[int] = None, concurrency: Optional[int] = None,
+                 requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 max_retries: Optional[int] = None, progress: Optional[Callable[[int, int], None]] = None,
+                 checkpoint: Optional[EmbeddingCheckpoint] = None):
+        """Initialize the pipeline.
+
+        Args:
+            embed_model: llama_index embedding model
+            batch_size: Texts per request. Defaults to EMBED_BATCH_SIZE or the
+                model's embed_batch_size.
+            concurrency: Batches in flight at most. Defaults to
+                EMBED_CONCURRENCY (4).
+            requests_per_minute: Request quota, 0 for none. Defaults to
+                EMBED_REQUESTS_PER_MINUTE.
+            tokens_per_minute: Token quota, 0 for none. Defaults to
+                EMBED_TOKENS_PER_MINUTE.
+            max_retries: Attempts per batch after the first. Defaults to
+                EMBED_MAX_RETRIES (6).
+            progress: Called with (embedded nodes, total nodes) after each batch
+            checkpoint: Log to resume from and to record completed batches in
+        """
+        self.embed_model = embed_model
+        if batch_size is None:
+            batch_size = int(os.getenv("EMBED_BATCH_SIZE", "0")) or getattr(embed_model, "embed_batch_size", 10)
+        if concurrency is None:
+            concurrency = int(os.getenv("EMBED_CONCURRENCY", "4"))
+        if requests_per_minute is None:
+            requests_per_minute = float(os.getenv("EMBED_REQUESTS_PER_MINUTE", "0"))
+        if tokens_per_minute is None:
+            tokens_per_minute = float(os.getenv("EMBED_TOKENS_PER_MINUTE", "0"))
+        if max_retries is None:
+            max_retries = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.progress = progress
+        self.checkpoint = checkpoint
+        self.base_delay = 1.0
+        self.max_delay = 60.0
+
+    def embed_nodes(self, nodes: List) -> Dict:
+        """Set ``embedding`` on every node that doesn't have one yet.
+
+        Args:
+            nodes: llama_index nodes
+
+        Returns:
+            Throughput statistics
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.aembed_nodes(nodes))
+        # Called from async code: run on a private loop in another thread
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            return pool.submit(context.run, asyncio.run, self.aembed_nodes(nodes)).result()
+
+    async def aembed_nodes(self, nodes: List) -> Dict:
+        """Async version of embed_nodes."""
+        from llama_index.core.schema import MetadataMode
+
+        pending = [node for node in nodes if node.embedding is None]
+        texts = [node.get_content(metadata_mode=MetadataMode.EMBED) for node in pending]
+        resumed = 0
+        if self.checkpoint is not None:
+            stored = await asyncio.to_thread(self.checkpoint.load)
+            keys = [self.checkpoint.key(text) for text in texts]
+            for node, key in zip(pending, keys):
+                node.embedding = stored.get(key)
+            resumed = sum(node.embedding is not None for node in pending)
+            keys = [key for node, key in zip(pending, keys) if node.embedding is None]
+            texts = [text for node, text in zip(pending, texts) if node.embedding is None]
+            pending = [node for node in pending if node.embedding is None]
+            if resumed:
+                logger.info(f"Resuming index build: {resumed} embeddings restored from {self.checkpoint.path}")
+        batches = [range(start, min(start + self.batch_size, len(pending))) for start in range(0, len(pending), self.batch_size)]
+        stats = {"nodes": len(pending), "resumed": resumed, "batches": len(batches), "tokens": 0, "retries": 0, "throttled": 0}
+        requests = TokenBucket(self.requests_per_minute)
+        tokens = TokenBucket(self.tokens_per_minute)
+        limit = AdaptiveLimit(self.concurrency)
+        done = 0
+        start = time.perf_counter()
+
+        async def embed_batch(batch: range):
+            nonlocal done
+            batch_texts = [texts[i] for i in batch]
+            batch_tokens = sum(estimate_tokens(text) for text in batch_texts)
+            for attempt in range(self.max_retries + 1):
+                await limit.acquire()
+                throttled = False
+                try:
+                    await requests.acquire()
+                    await tokens.acquire(batch_tokens)
+                    embeddings = await asyncio.to_thread(self.embed_model.get_text_embedding_batch, batch_texts)
+                    break
+                except Exception as e:
+                    throttled = is_throttle_error(e)
+                    if attempt == self.max_retries:
+                        raise
+                    reason = "throttled" if throttled else "error"
+                    stats["retries"] += 1
+                    stats["throttled"] += throttled
+                    metrics.EMBEDDING_RETRIES.inc(reason=reason)
+                    delay = min(self.max_delay, self.base_delay * 2 ** attempt) * random.uniform(0.5, 1.0)
+                    logger.warning(f"Embedding batch {reason} ({e}); retrying in {delay:.1f}s")
+                finally:
+                    await limit.release(throttled)
+                await asyncio.sleep(delay)
+            if self.checkpoint is not None:
+                await asyncio.to_thread(self.checkpoint.append, [keys[i] for i in batch], embeddings)
+            for i, embedding in zip(batch, embeddings):
+                pending[i].embedding = embedding
+            stats["tokens"] += batch_tokens
+            done += len(batch_texts)
+            if self.progress is not None:
+                self.progress(done, len(pending))
+
+        with trace_span("build_index.embed", nodes=len(pending), batch_size=self.batch_size) as span:
+            tasks = [asyncio.ensure_future(embed_batch(batch)) for batch in batches]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                raise
+            seconds = time.perf_counter() - start
+            stats["seconds"] = round(seconds, 3)
+            stats["nodes_per_s"] = round(len(pending) / seconds, 1) if seconds else 0.0
+            stats["tokens_per_s"] = round(stats["tokens"] / seconds, 1) if seconds else 0.0
+            if span is not None:
+                span.attributes.update(stats)
+        logger.info(
+            f"Embedded {stats['nodes']} nodes in {stats['batches']} batches in {stats['seconds']}s "
+            f"({stats['nodes_per_s']} nodes/s, {stats['tokens_per_s']} tokens/s, {stats['retries']} retries)"
+        )
+        return stats
@@ -0,0 +1,275 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from agents import CodebaseIngestor, get_embed_model
+from metrics import record_cache
+from repo_map import DEFAULT_EXCLUDE_DIRS
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# "worktree" reads files off disk, "git" enumerates them with git and caches by blob SHA
+INGEST_SOURCE = os.getenv("INGEST_SOURCE", "worktree")
+
+# Metadata that varies with the revision rather than the content, kept out of the embedded text
+_UNEMBEDDED_METADATA = ["blob_sha", "rev"]
+# Paths passed to one git hash-object call
+_HASH_BATCH = 500
+
+
+def create_ingestor(repo_path: str, rev: Optional[str] = None) -> CodebaseIngestor:
+    """The ingestor INGEST_SOURCE selects; git ingestion whenever a revision is given."""
+    if rev or INGEST_SOURCE == "git":
+        return GitIngestor(repo_path, rev=rev)
+    return CodebaseIngestor(repo_path)
+
+
+class BlobCache:
+    """Append-only log of the chunks and embeddings of ingested blobs.
+
+    Keys combine the embedding model, the file path (it is part of the
+    embedded text) and the blob SHA, so one cache serves every revision of
+    the repository. Each line holds the chunks of one blob; a line torn by
+    a crash is cut off on load.
+    """
+
+    def __init__(self, path: str, model_name: str = ""):
+        """Initialize the cache.
+
+        Args:
+            path: JSON-lines file, created on the first append
+            model_name: Name of the embedding model the vectors come from
+        """
+        self.path = path
+        self.model_name = model_name
+        self._lock = threading.Lock()
+
+    def key(self, rel_path: str, blob_sha: str) -> str:
+        return hashlib.blake2b(f"{self.model_name}\0{rel_path}\0{blob_sha}".encode(), digest_size=16).hexdigest()
+
+    def load(self) -> Dict[str, List[Dict]]:
+        """Chunks of every cached blob by key."""
+        blobs: Dict[str, List[Dict]] = {}
+        if not os.path.exists(self.path):
+            return blobs
+        good_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete line")
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                blobs[entry["key"]] = entry["chunks"]
+                good_size += len(line)
+        if good_size < os.path.getsize(self.path):
+            logger.warning(f"Dropping a partially written blob from {self.path}")
+            with open(self.path, "r+b") as f:
+                f.truncate(good_size)
+        return blobs
+
+    def append(self, entries: Dict[str, List[Dict]]):
+        """Durably record the chunks of some blobs."""
+        if not entries:
+            return
+        lines = "".join(json.dumps({"key": key, "chunks": chunks}) + "\n" for key, chunks in entries.items())
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+
+
+class GitIngestor(CodebaseIngestor):
+    """Ingests the files git knows about, using blob SHAs as content hashes.
+
+    A revision is listed with ``git ls-tree`` and read from the object
+    database, so any branch or commit can be indexed without checking it
+    out. Without a revision the working tree is listed with
+    ``git ls-files`` (untracked files that aren't ignored included), and
+    files that differ from the index are hashed with ``git hash-object``.
+    Blobs ingested before, by any revision, are rebuilt from the blob cache
+    with their embeddings, so indexing another branch only reads, splits
+    and embeds the blobs that differ.
+    """
+
+    def __init__(self, repo_path: str, rev: Optional[str] = None, cache_path: Optional[str] = None):
+        """Initialize the git ingestor.
+
+        Args:
+            repo_path: Path to the repository to ingest
+            rev: Commit, branch or tag to index; the working tree by default
+            cache_path: Blob cache file. Defaults to cursor-index/blobs.jsonl
+                in the repository's git directory.
+        """
+        from git import Repo
+
+        self.repo_path = repo_path
+        self.rev = rev
+        self.repo = Repo(repo_path)
+        self.code_splitter = self.create_code_splitter()
+        if cache_path is None:
+            cache_path = os.path.join(self.repo.git_dir, "cursor-index", "blobs.jsonl")
+        self.cache = BlobCache(cache_path, getattr(get_embed_model(), "model_name", "") or "")
+        self._cached: Optional[Dict[str, List[Dict]]] = None
+        # Doc id -> cache key of blobs ingested but not yet recorded
+        self._uncached: Dict[str, str] = {}
+        self.stats: Dict[str, int] = {}
+
+    @traced("ingest")
+    def ingest(self, exclude_dirs: List[str] = None) -> List:
+        """Ingest every file of the revision or working tree.
+
+        Args:
+            exclude_dirs: Directory names to exclude
+
+        Returns:
+            List of document nodes; those of cached blobs carry their embeddings
+        """
+        exclude_dirs = set(exclude_dirs or DEFAULT_EXCLUDE_DIRS)
+        blobs = {path: sha for path, sha in self.list_blobs().items()
+                 if not any(part in exclude_dirs for part in path.split("/")[:-1])}
+        logger.info(f"Found {len(blobs)} files in {self.rev or 'the working tree'} of {self.repo_path}")
+        return self._nodes(blobs)
+
+    @traced("ingest_files")
+    def ingest_files(self, paths: List[str]) -> List:
+        blobs = self.list_blobs(paths)
+        return self._nodes(blobs)
+
+    def list_blobs(self, paths: Optional[List[str]] = None) -> Dict[str, str]:
+        """Blob SHA of every regular file, by path relative to the repository.
+
+        Args:
+            paths: Only list these paths; files they don't name are left out
+        """
+        if paths is not None and not paths:
+            return {}
+        pathspec = ["--", *paths] if paths else []
+        if self.rev:
+            output = self.repo.git.ls_tree("-r", "-z", "--full-tree", self.rev, *pathspec)
+            blobs = {}
+            for entry in filter(None, output.split("\0")):
+                info, path = entry.split("\t", 1)
+                mode, kind, sha = info.split()
+                # Symlinks and submodules have no content to index
+                if kind == "blob" and mode != "120000":
+                    blobs[path] = sha
+            return blobs
+
+        blobs = {}
+        for entry in filter(None, self.repo.git.ls_files("-s", "-z", *pathspec).split("\0")):
+            info, path = entry.split("\t", 1)
+            mode, sha, _ = info.split()
+            if mode not in ("120000", "160000"):
+                blobs[path] = sha
+        for path in filter(None, self.repo.git.ls_files("-d", "-z", *pathspec).split("\0")):
+            blobs.pop(path, None)
+        changed = filter(None, self.repo.git.ls_files("-m", "-o", "--exclude-standard", "-z", *pathspec).split("\0"))
+        changed = [path for path in changed if os.path.isfile(os.path.join(self.repo_path, path))
+                   and not os.path.islink(os.path.join(self.repo_path, path))]
+        for start in range(0, len(changed), _HASH_BATCH):
+            batch = changed[start:start + _HASH_BATCH]
+            blobs.update(zip(batch, self.repo.git.hash_object("--", *batch).split()))
+        return blobs
+
+    def record(self, nodes: List):
+        """Add the blobs ingested since the last record to the cache, with their embeddings.
+
+        Args:
+            nodes: Embedded nodes, e.g. those passed to build_index
+        """
+        chunks: Dict[str, List[Dict]] = {}
+        for node in nodes:
+            key = self._uncached.get(node.ref_doc_id)
+            if key is None or node.embedding is None:
+                continue
+            chunks.setdefault(key, []).append({
+                "text": node.text,
+                "start_char_idx": node.start_char_idx,
+                "end_char_idx": node.end_char_idx,
+                "embedding": node.embedding,
+            })
+        self.cache.append(chunks)
+        if self._cached is not None:
+            self._cached.update(chunks)
+        self._uncached.clear()
+        logger.info(f"Cached the chunks of {len(chunks)} blobs in {self.cache.path}")
+
+    def _nodes(self, blobs: Dict[str, str]) -> List:
+        """Nodes of the blobs, rebuilt from the cache where possible and split otherwise."""
+        from llama_index.core import Document
+
+        if self._cached is None:
+            self._cached = self.cache.load()
+        nodes, docs = [], []
+        hits = 0
+        for path, sha in sorted(blobs.items()):
+            key = self.cache.key(path, sha)
+            doc_id = self.doc_id(path)
+            metadata = self._metadata(path, sha)
+            chunks = self._cached.get(key)
+            record_cache("git_blobs", chunks is not None)
+            if chunks is not None:
+                hits += 1
+                nodes.extend(self._cached_node(doc_id, metadata, chunk) for chunk in chunks)
+                continue
+            text = self._read(path, sha)
+            if text is None:
+                continue
+            self._uncached[doc_id] = key
+            docs.append(Document(
+                text=text,
+                id_=doc_id,
+                metadata=metadata,
+                excluded_embed_metadata_keys=list(_UNEMBEDDED_METADATA),
+                excluded_llm_metadata_keys=list(_UNEMBEDDED_METADATA),
+            ))
+        nodes.extend(self.code_splitter.get_nodes_from_documents(docs))
+        self.stats = {"blobs": len(blobs), "cached_blobs": hits, "read_blobs": len(docs)}
+        logger.info(f"Reused {hits} cached blobs and read {len(docs)} of {len(blobs)}; {len(nodes)} nodes")
+        return nodes
+
+    def _read(self, path: str, sha: str) -> Optional[str]:
+        """Text of a blob, or None for binary files."""
+        if self.rev:
+            data = self.repo.odb.stream(bytes.fromhex(sha)).read()
+        else:
+            try:
+                with open(os.path.join(self.repo_path, path), "rb") as f:
+                    data = f.read()
+            except OSError:
+                return None
+        if b"\0" in data[:8192]:
+            return None
+        return data.decode("utf-8", errors="ignore")
+
+    def _metadata(self, path: str, sha: str) -> Dict[str, Any]:
+        metadata = {
+            "file_path": os.path.join(self.repo_path, *path.split("/")),
+            "file_name": os.path.basename(path),
+            "blob_sha": sha,
+        }
+        if self.rev:
+            metadata["rev"] = self.rev
+        return metadata
+
+    def _cached_node(self, doc_id: str, metadata: Dict[str, Any], chunk: Dict) -> Any:
+        from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+        return TextNode(
+            text=chunk["text"],
+            metadata=dict(metadata),
+            excluded_embed_metadata_keys=list(_UNEMBEDDED_METADATA),
+            excluded_llm_metadata_keys=list(_UNEMBEDDED_METADATA),
+            start_char_idx=chunk["start_char_idx"],
+            end_char_idx=chunk["end_char_idx"],
+            embedding=chunk["embedding"],
+            relationships={NodeRelationship.SOURCE: RelatedNodeInfo(node_id=doc_id)},
+        )
@@ -0,0 +1,267 @@
+import os
+import time
+import atexit
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import metrics
+from repo_map import DEFAULT_EXCLUDE_DIRS
+from tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+class IndexWatcher:
+    """Background service keeping the indexes of registered repositories fresh.
+
+    Changed paths come from watchdog (inotify, FSEvents, ...) when it is
+    installed, and from polling file sizes and modification times
+    otherwise. They are collected until a repository has been quiet for the
+    debounce interval, then handed to the system's update_index in one
+    batch, so requests never re-index. With a shared index only the
+    process holding a repository's watch lock re-indexes it; the others
+    pick the published segment up through reload_index. Private indexes
+    are updated in memory and saved at most once per persist interval, and
+    when the watcher stops.
+    """
+
+    def __init__(self, debounce: Optional[float] = None, poll_interval: Optional[float] = None,
+                 persist_interval: Optional[float] = None):
+        """Initialize the watcher.
+
+        Args:
+            debounce: Seconds without changes before a batch is re-indexed.
+                Defaults to INDEX_WATCH_DEBOUNCE (2).
+            poll_interval: Seconds between scans when polling. Defaults to
+                INDEX_WATCH_POLL_INTERVAL (2).
+            persist_interval: Seconds an updated private index may go unsaved.
+                Defaults to INDEX_PERSIST_INTERVAL (30).
+        """
+        if debounce is None:
+            debounce = float(os.getenv("INDEX_WATCH_DEBOUNCE", "2"))
+        if poll_interval is None:
+            poll_interval = float(os.getenv("INDEX_WATCH_POLL_INTERVAL", "2"))
+        if persist_interval is None:
+            persist_interval = float(os.getenv("INDEX_PERSIST_INTERVAL", "30"))
+        self.debounce = debounce
+        self.poll_interval = poll_interval
+        self.persist_interval = persist_interval
+        self._systems: Dict[str, Any] = {}
+        self._snapshots: Dict[str, Dict[str, Tuple[int, int]]] = {}
+        self._watch_locks: Dict[str, Any] = {}
+        self._pending: Dict[str, Set[str]] = {}
+        self._last_change: Dict[str, float] = {}
+        # When each repository's index was first updated without being saved
+        self._unsaved: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._observer = None
+        # Saves the indexes left unsaved when the server exits
+        atexit.register(self.stop)
+
+    def register(self, system: Any):
+        """Watch the repository of an AgenticAISystem and keep its index fresh."""
+        if not system.index_path:
+            raise ValueError("Watching a repository needs an index_path to update")
+        repo_path = os.path.abspath(system.repo_path)
+        with self._lock:
+            self._systems[repo_path] = system
+        system.watched = True
+        if self._observer is not None:
+            self._schedule(repo_path)
+        else:
+            self._snapshots[repo_path] = self._scan(repo_path)
+        logger.info(f"Watching {repo_path} for changes")
+
+    def unregister(self, repo_path: str):
+        repo_path = os.path.abspath(repo_path)
+        with self._lock:
+            system = self._systems.pop(repo_path, None)
+            self._pending.pop(repo_path, None)
+        self._snapshots.pop(repo_path, None)
+        if system is not None:
+            self._persist(repo_path, system)
+        lock = self._watch_locks.pop(repo_path, None)
+        if lock is not None:
+            lock.close()
+        if system is not None:
+            system.watched = False
+
+    def notify(self, repo_path: str, paths: Iterable[str]):
+        """Queue changed files of a watched repository, e.g. ones the server just wrote.
+
+        Args:
+            repo_path: Path to the repository
+            paths: Absolute paths or paths relative to the repository
+        """
+        repo_path = os.path.abspath(repo_path)
+        rel_paths = {self._relative(repo_path, path) for path in paths}
+        rel_paths = {path for path in rel_paths if self._included(path)}
+        if not rel_paths:
+            return
+        with self._lock:
+            if repo_path not in self._systems:
+                return
+            self._pending.setdefault(repo_path, set()).update(rel_paths)
+            self._last_change[repo_path] = time.monotonic()
+        self._wake.set()
+
+    def start(self):
+        """Start watching in a daemon thread."""
+        if self._thread is not None:
+            return
+        try:
+            from watchdog.observers import Observer
+        except ImportError:
+            logger.info(f"watchdog is not installed; polling for changes every {self.poll_interval}s")
+        else:
+            self._observer = Observer()
+            for repo_path in list(self._systems):
+                self._schedule(repo_path)
+            self._observer.start()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="index-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for repo_path, system in list(self._systems.items()):
+            self._persist(repo_path, system)
+
+    def _run(self):
+        next_poll = time.monotonic()
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if self._observer is None and now >= next_poll:
+                for repo_path in list(self._systems):
+                    self._poll(repo_path)
+                next_poll = now + self.poll_interval
+            for repo_path in self._due(time.monotonic()):
+                self._update(repo_path)
+            for repo_path in [path for path, since in self._unsaved.items() if time.monotonic() - since >= self.persist_interval]:
+                self._persist(repo_path, self._systems.get(repo_path))
+            self._follow_segments()
+            self._wake.wait(timeout=min(self.debounce, self.poll_interval) / 2 or 0.1)
+            self._wake.clear()
+
+    def _due(self, now: float) -> List[str]:
+        """Repositories with pending changes that have been quiet for the debounce interval."""
+        with self._lock:
+            return [repo_path for repo_path, paths in self._pending.items()
+                    if paths and now - self._last_change[repo_path] >= self.debounce]
+
+    def _update(self, repo_path: str):
+        with self._lock:
+            system = self._systems.get(repo_path)
+            paths = sorted(self._pending.pop(repo_path, set()))
+        if system is None or not paths:
+            return
+        if not self._is_leader(repo_path, system):
+            # Another process re-indexes this shared index
+            return
+        start = time.perf_counter()
+        try:
+            with Tracer("index_update").activate():
+                system.update_index(paths)
+        except Exception as e:
+            logger.error(f"Re-indexing {len(paths)} changed files in {repo_path} failed, retrying: {e}")
+            metrics.INDEX_UPDATES.inc(outcome="error")
+            self.notify(repo_path, paths)
+            return
+        metrics.INDEX_UPDATES.inc(outcome="ok")
+        if getattr(system, "index_unsaved", False):
+            self._unsaved.setdefault(repo_path, time.monotonic())
+        logger.info(f"Re-indexed {len(paths)} changed files in {repo_path} in {time.perf_counter() - start:.2f}s")
+
+    def _persist(self, repo_path: str, system: Any):
+        """Save the index of a repository if updates left it unsaved."""
+        since = self._unsaved.pop(repo_path, None)
+        if system is None or since is None:
+            return
+        try:
+            system.persist_index()
+        except Exception as e:
+            logger.error(f"Saving the updated index of {repo_path} failed, retrying: {e}")
+            self._unsaved[repo_path] = time.monotonic()
+
+    def _follow_segments(self):
+        """Move systems on shared indexes onto segments other processes published."""
+        for repo_path, system in list(self._systems.items()):
+            if system.segments is None:
+                continue
+            try:
+                system.reload_index()
+            except Exception as e:
+                logger.error(f"Attaching to the new index segment of {repo_path} failed: {e}")
+
+    def _is_leader(self, repo_path: str, system: Any) -> bool:
+        """Whether this process re-indexes the repository; always true for private indexes."""
+        if system.segments is None:
+            return True
+        if repo_path not in self._watch_locks:
+            lock = system.segments.try_watch_lock()
+            if lock is None:
+                return False
+            self._watch_locks[repo_path] = lock
+        return True
+
+    def _poll(self, repo_path: str):
+        previous = self._snapshots.get(repo_path, {})
+        current = self._scan(repo_path)
+        self._snapshots[repo_path] = current
+        changed = [path for path, stat in current.items() if previous.get(path) != stat]
+        changed += [path for path in previous if path not in current]
+        if changed:
+            self.notify(repo_path, changed)
+
+    def _scan(self, repo_path: str) -> Dict[str, Tuple[int, int]]:
+        """Size and modification time of every indexed file."""
+        snapshot = {}
+        for root, dirs, files in os.walk(repo_path):
+            dirs[:] = [d for d in dirs if d not in DEFAULT_EXCLUDE_DIRS and not d.startswith(".")]
+            for name in files:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[self._relative(repo_path, path)] = (stat.st_size, stat.st_mtime_ns)
+        return snapshot
+
+    def _schedule(self, repo_path: str):
+        from watchdog.events import FileSystemEventHandler
+
+        watcher = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                paths = [event.src_path] + ([event.dest_path] if getattr(event, "dest_path", None) else [])
+                watcher.notify(repo_path, paths)
+
+        self._observer.schedule(Handler(), repo_path, recursive=True)
+
+    def _relative(self, repo_path: str, path: str) -> str:
+        if os.path.isabs(path):
+            path = os.path.relpath(path, repo_path)
+        return os.path.normpath(path).replace(os.sep, "/")
+
+    def _included(self, rel_path: str) -> bool:
+        parts = rel_path.split("/")
+        if parts[0] == os.pardir:
+            return False
+        return not any(part.startswith(".") or part in DEFAULT_EXCLUDE_DIRS for part in parts)
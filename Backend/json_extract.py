@@ -0,0 +1,273 @@
+import re
+import json
+from typing import Any, List
+
+# Characters that may legally follow a backslash inside a JSON string
+_VALID_ESCAPES = set('"\\/bfnrtu')
+# Characters after which a quote inside a string is taken to close it
+_STRING_TERMINATORS = set(',}]:')
+_WHITESPACE = set(' \t\r\n')
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t', '\b': '\\b', '\f': '\\f'}
+_LITERALS = {'True': 'true', 'False': 'false', 'None': 'null', 'true': 'true', 'false': 'false', 'null': 'null'}
+_JSON_LITERALS = {'true', 'false', 'null'}
+_NUMBER_TAILS = {'-', '+', '.'}
+_VALUE_STARTS = set('"\'{[')
+_CLOSERS = {'{': '}', '[': ']'}
+# Runs copied verbatim: ordinary string content, and whitespace between tokens
+_STRING_RUN = re.compile(r'[^"\'\\\x00-\x1f]+')
+_WHITESPACE_RUN = re.compile(r'[ \t\r\n]+')
+# A number as models write it: JSON, or with a bare "." or "e" ("1.", ".5", "1e")
+_NUMBER = re.compile(r'[-+]?(\d*)(\.\d*)?([eE][-+]?\d*)?')
+# A quoted object key and its colon, e.g. the next member after a missing comma
+_KEY_AHEAD = re.compile(r'"(?:[^"\\\n]|\\.)*"\s*:')
+# An object, or an array whose first element looks like JSON (not "[DOC 3]" prose)
+_CONTAINER_START = re.compile(r'\{|\[\s*[\[{"\'\-\d\]tfnTFN]')
+
+
+def _find_start(text: str) -> int:
+    """Position of the first JSON container, preferring one inside a code fence."""
+    fence = text.find('```')
+    search_from = 0
+    if fence != -1:
+        line_end = text.find('\n', fence)
+        search_from = line_end + 1 if line_end != -1 else fence + 3
+    for start in (search_from, 0):
+        match = _CONTAINER_START.search(text, start)
+        if match:
+            return match.start()
+    return -1
+
+
+def repair_json(text: str) -> str:
+    """Extract and repair the first JSON value in an LLM response in a single pass.
+
+    Handles prose and code fences around the JSON, trailing commas, raw
+    newlines/control characters and stray quotes inside strings, invalid
+    backslash escapes, single-quoted strings, Python literals (True, False,
+    None) and truncated output, which is closed at the last complete token.
+
+    Args:
+        text: Raw model output
+
+    Returns:
+        A JSON document (not guaranteed valid if the input is beyond repair)
+
+    Raises:
+        ValueError: If the text contains no JSON object or array
+    """
+    start = _find_start(text)
+    if start == -1:
+        raise ValueError("No JSON object or array found in response")
+
+    out: List[str] = []
+    stack: List[str] = []
+    # Per open container: True while an object expects a key next
+    expect_key: List[bool] = []
+    # Output position of the last object key, and whether it still lacks a value
+    key_start = 0
+    pending_key = False
+    quote = ''
+    length = len(text)
+    i = start
+
+    while i < length:
+        char = text[i]
+
+        if quote:
+            run = _STRING_RUN.match(text, i)
+            if run:
+                out.append(run.group())
+                i = run.end()
+                continue
+            if char == '\\':
+                following = text[i + 1] if i + 1 < length else ''
+                if following and following in _VALID_ESCAPES:
+                    out.append('\\' + following)
+                    i += 2
+                    continue
+                if following == "'":
+                    out.append("'")
+                    i += 2
+                    continue
+                # Invalid escape such as \d in a regex: keep the backslash literally
+                out.append('\\\\')
+                i += 1
+                continue
+            if char == quote:
+                j = i + 1
+                while j < length and text[j] in _WHITESPACE:
+                    j += 1
+                # A quote on the next line, or a key and colon, starts a new member with a missing comma
+                missing_comma = j < length and text[j] == '"' and (
+                    '\n' in text[i + 1:j] or (stack and stack[-1] == '}' and _KEY_AHEAD.match(text, j)))
+                if j >= length or text[j] in _STRING_TERMINATORS or missing_comma:
+                    out.append('"')
+                    quote = ''
+                    if stack and stack[-1] == '}' and expect_key[-1]:
+                        pending_key = True
+                        expect_key[-1] = False
+                    i += 1
+                    continue
+                out.append('\\"')
+                i += 1
+                continue
+            if char == '"':
+                # Double quote inside a single-quoted string
+                out.append('\\"')
+            elif char < ' ':
+                out.append(_CONTROL_ESCAPES.get(char) or '\\u%04x' % ord(char))
+            else:
+                out.append(char)
+            i += 1
+            continue
+
+        if char in _WHITESPACE:
+            run = _WHITESPACE_RUN.match(text, i)
+            out.append(run.group())
+            i = run.end()
+            continue
+        if char in _VALUE_STARTS and _ends_value(out):
+            # Missing comma between members
+            out.append(',')
+            if stack[-1] == '}':
+                expect_key[-1] = True
+        if char == '"' or char == "'":
+            if stack[-1] == '}' and expect_key[-1]:
+                key_start = len(out)
+            else:
+                pending_key = False
+            quote = char
+            out.append('"')
+        elif char == '{' or char == '[':
+            stack.append(_CLOSERS[char])
+            expect_key.append(char == '{')
+            pending_key = False
+            out.append(char)
+        elif char == '}' or char == ']':
+            if stack:
+                _strip_trailing_comma(out)
+                out.append(stack.pop())
+                expect_key.pop()
+                if not stack:
+                    break
+        elif char == ',':
+            _strip_trailing_comma(out)
+            out.append(',')
+            if stack and stack[-1] == '}':
+                expect_key[-1] = True
+        elif char == ':':
+            out.append(':')
+        elif char.isalpha() or char == '_':
+            j = i
+            while j < length and (text[j].isalnum() or text[j] == '_'):
+                j += 1
+            word = text[i:j]
+            out.append(_LITERALS.get(word, word))
+            pending_key = False
+            i = j
+            continue
+        elif char.isdigit() or char in '-+.':
+            number = _NUMBER.match(text, i)
+            j = number.end()
+            if j == i:
+                out.append(char)
+                i += 1
+                continue
+            if _ends_value(out):
+                # Missing comma between numbers
+                out.append(',')
+                if stack[-1] == '}':
+                    expect_key[-1] = True
+            if j >= length:
+                # Truncated: _close_truncated drops a dangling sign, point or exponent
+                out.extend(text[i:j])
+            else:
+                out.append(_normalize_number(number))
+            pending_key = False
+            i = j
+            continue
+        else:
+            out.append(char)
+        i += 1
+
+    if stack:
+        if quote and stack[-1] == '}' and expect_key[-1]:
+            pending_key = True
+        _close_truncated(out, stack, quote, key_start, pending_key)
+    return ''.join(out)
+
+
+def _normalize_number(number: re.Match) -> str:
+    """A number token as valid JSON: "1." -> "1.0", ".5" -> "0.5", "1e" -> "1", "007" -> "7"."""
+    sign = '-' if number.group().startswith('-') else ''
+    integer, fraction, exponent = number.group(1), number.group(2) or '', number.group(3) or ''
+    if not integer and len(fraction) < 2:
+        # A lone sign or point is no number; leave it for the parser to reject
+        return number.group()
+    if len(fraction) == 1:
+        fraction = '.0'
+    if exponent.rstrip('+-') in ('e', 'E'):
+        exponent = ''
+    return sign + (integer.lstrip('0') or '0') + fraction + exponent
+
+
+def _ends_value(out: List[str]) -> bool:
+    """Whether the output ends with a complete value (ignoring whitespace)."""
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j < 0:
+        return False
+    last = out[j]
+    return last in _JSON_LITERALS or last[-1] in '"}]' or last[-1].isdigit()
+
+
+def _strip_trailing_comma(out: List[str]):
+    """Drop a comma (and whitespace after it) at the end of the output."""
+    j = len(out) - 1
+    while j >= 0 and out[j].isspace():
+        j -= 1
+    if j >= 0 and out[j] == ',':
+        del out[j:]
+
+
+def _close_truncated(out: List[str], stack: List[str], quote: str, key_start: int, pending_key: bool):
+    """Close a document that ended mid-way so it parses up to its last complete token.
+
+    An object key whose value never started (or was cut inside a number or
+    literal) is dropped rather than given a made-up value.
+    """
+    if pending_key:
+        del out[key_start:]
+    elif quote:
+        out.append('"')
+    else:
+        # Drop a partial literal or the dangling sign/exponent of a partial number
+        while out and (out[-1].isspace() or out[-1] in _NUMBER_TAILS
+                       or (out[-1].isalpha() and out[-1] not in _JSON_LITERALS)):
+            out.pop()
+        if out and out[-1] == ':':
+            del out[key_start:]
+    _strip_trailing_comma(out)
+    out.extend(reversed(stack))
+
+
+def extract_json(text: str) -> Any:
+    """Parse the first JSON value in an LLM response, repairing it if needed.
+
+    Args:
+        text: Raw model output
+
+    Returns:
+        The parsed JSON value
+
+    Raises:
+        ValueError: If no JSON can be recovered (json.JSONDecodeError is a ValueError)
+    """
+    # Fast path for well-formed output; fenced or prose-wrapped text can't be valid JSON
+    if text.lstrip()[:1] in ('{', '['):
+        try:
+            return json.loads(text)
+        except ValueError:
+            pass
+    return json.loads(repair_json(text))
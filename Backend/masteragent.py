@@ -1,41 +1,143 @@
+import copy
+from typing import Iterable
 from agents import *
+from tracing import Tracer, traced
+from pipeline import PipelinedOrchestrator
+from repair import RepairLoop
+from git_ingest import create_ingestor
+import metrics
+
+# "pipelined" overlaps planning, edits, test generation and sandbox prep;
+# "sequential" runs them one after another
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "pipelined")
+
+# "private" loads the index into each process; "shared" attaches read-only to
+# the live segment of index_path, building it first if nobody has yet
+INDEX_MODE = os.getenv("INDEX_MODE", "private")
 
 
 class AgenticAISystem:
     """Main agentic AI system for codebase modifications."""
     
-    def __init__(self, repo_path: str, index_path: str = None):
+    def __init__(self, repo_path: str, index_path: str = None, rev: str = None):
         """Initialize the agentic AI system.
         
         Args:
             repo_path: Path to the repository
             index_path: Optional path to load an existing index
+            rev: Commit or branch to index from git instead of the working tree
         """
         self.repo_path = repo_path
-        self.ingestor = CodebaseIngestor(repo_path)
-        self.knowledge_builder = KnowledgeBuilder()
-        if index_path and os.path.exists(index_path):
-            self.index = self.knowledge_builder.load_index(index_path)
-        else:
-            logger.info("Index not found or not provided. Building new index.")
-            nodes = self.ingestor.ingest()
-            self.index = self.knowledge_builder.build_index(nodes)
-            if index_path:
-                self.knowledge_builder.save_index(self.index, index_path)
-        self.planning_agent = PlanningAgent(self.index)
-        self.change_executor = ChangeExecutor(repo_path, self.index)
-        self.test_runner = TestSandboxRunner(repo_path)
-    
-    def process_requirement(self, requirement: str) -> Dict:
+        self.build_tracer = Tracer("index_build")
+        self.segments = None
+        self.segment = None
+        # Set by the IndexWatcher, which then keeps the index and repo map fresh
+        self.watched = False
+        # Whether a private index has updates that persist_index hasn't saved yet
+        self.index_unsaved = False
+        self._index_size: Optional[List[int]] = None
+        self._update_lock = threading.Lock()
+        with self.build_tracer.activate():
+            self.ingestor = create_ingestor(repo_path, rev)
+            self.knowledge_builder = KnowledgeBuilder()
+            if index_path and INDEX_MODE == "shared":
+                self.index = self._attach_shared_index(index_path)
+            elif index_path and os.path.exists(index_path):
+                self.index = self.knowledge_builder.load_index(index_path)
+            else:
+                logger.info("Index not found or not provided. Building new index.")
+                nodes = self.ingestor.ingest()
+                checkpoint_path = KnowledgeBuilder.checkpoint_path(index_path) if index_path else None
+                self.index = self.knowledge_builder.build_index(nodes, checkpoint_path=checkpoint_path)
+                self.ingestor.record(nodes)
+                if index_path:
+                    self.knowledge_builder.save_index(self.index, index_path)
+            self.index_path = index_path
+            self.repo_map = RepoMap.load(repo_path, index_path) if index_path else RepoMap(repo_path)
+            self.refresh_repo_map()
+        self._record_index_size()
+        self._init_agents()
+    
+    def _init_agents(self):
+        self.planning_agent = PlanningAgent(self.index, repo_map=self.repo_map)
+        self.change_executor = ChangeExecutor(self.repo_path, self.index, repo_map=self.repo_map)
+        self.test_runner = TestSandboxRunner(self.repo_path)
+        self.repair_loop = RepairLoop(self.change_executor, self.test_runner)
+    
+    def _attach_shared_index(self, index_path: str) -> Any:
+        """Attach to the live shared segment, building and publishing it if there is none."""
+        from shared_index import IndexSegments
+        self.segments = IndexSegments(index_path)
+        if self.segments.current() is None:
+            with self.segments.build_lock():
+                # Another worker may have published while we waited for the lock
+                if self.segments.current() is None:
+                    logger.info("No shared index segment yet. Building one.")
+                    nodes = self.ingestor.ingest()
+                    checkpoint_path = KnowledgeBuilder.checkpoint_path(index_path)
+                    index = self.knowledge_builder.build_index(nodes, checkpoint_path=checkpoint_path)
+                    self.ingestor.record(nodes)
+                    self.knowledge_builder.publish_index(index, index_path)
+        with self.segments.reading():
+            segment = self.segments.current()
+            index = self.knowledge_builder.attach_index(index_path, segment)
+            self._attached(segment)
+        return index
+    
+    def _attached(self, segment: str):
+        """Switch to a segment attached inside segments.reading, taking its size from its manifest."""
+        # Counted by the builder, so the mapped texts aren't paged in
+        manifest = self.segments.manifest(segment)
+        self.segment = segment
+        self._index_size = [manifest["nodes"], manifest["bytes"]]
+    
+    def reload_index(self) -> bool:
+        """Switch to the live shared segment if a builder has published a newer one.
+        
+        Runs already in progress keep the agents of the previous segment.
+        
+        Returns:
+            Whether the index changed
+        """
+        if self.segments is None:
+            return False
+        with self.segments.reading():
+            current = self.segments.current()
+            if current is None or current == self.segment:
+                return False
+            self.index = self.knowledge_builder.attach_index(self.index_path, current)
+            self._attached(current)
+        self._record_index_size()
+        self._init_agents()
+        return True
+    
+    def process_requirement(self, requirement: str, tracer: Tracer = None) -> Dict:
+        """Blocking version of aprocess_requirement.
+        
+        Args:
+            requirement: The change requirement
+            tracer: Optional tracer to record the run into
+            
+        Returns:
+            Processing results, with per-stage timings under 'metrics'
+        
+        Raises:
+            RuntimeError: When called from a running event loop; await
+                aprocess_requirement there instead
+        """
+        return run_sync(self.aprocess_requirement(requirement, tracer))
+    
+    async def aprocess_requirement(self, requirement: str, tracer: Tracer = None) -> Dict:
         """Process a code change requirement.
         
         Args:
             requirement: The change requirement
-            branch_name: Optional branch name to create
+            tracer: Optional tracer to record the run into
             
         Returns:
-            Processing results
+            Processing results, with per-stage timings under 'metrics'
         """
+        tracer = tracer or Tracer("process_requirement")
         results = {
             "requirement": requirement,
             "plan": None,
@@ -44,17 +146,143 @@ class AgenticAISystem:
             "test_results": None,
         }
         logger.info(f"Processing requirement: {requirement}")
-        plan = self.planning_agent.create_implementation_plan(requirement)
-        results["plan"] = plan
-        changes = self.change_executor.execute_plan(plan)
-        results["changes"] = changes
-        tests = self.test_runner.generate_tests(plan)
-        results["tests"] = tests
-        test_results = self.test_runner.run_tests()
-        results["test_results"] = test_results
-        if not results["test_results"].get("success", False):
-            analysis = self.test_runner.analyze_test_failures(test_results)
-            new_reqs = f"Requirements:{requirement}\nError Analysis: {analysis}"
-            results['analysis'] = f" Faild with following analysis {analysis} !! DO NOT COMMIT !!"
-        
-        return results
\ No newline at end of file
+        with metrics.AGENT_RUNS_IN_FLIGHT.track_inprogress(), tracer.activate(), tracer.span("process_requirement"):
+            if not self.watched:
+                await asyncio.to_thread(self.refresh_repo_map)
+            if PIPELINE_MODE == "pipelined":
+                pipeline_summary = await PipelinedOrchestrator(self).arun(requirement, results)
+            else:
+                pipeline_summary = None
+                plan = await self.planning_agent.acreate_implementation_plan(requirement)
+                results["plan"] = plan
+                changes = await self.change_executor.aexecute_plan(plan)
+                results["changes"] = changes
+                tests = await self.test_runner.agenerate_tests(plan)
+                results["tests"] = tests
+                sandbox_repo_path = await self.test_runner.aprepare_sandbox()
+                try:
+                    test_results = await self.test_runner.arun_tests(sandbox_repo_path)
+                    results["test_results"] = test_results
+                    analysis = await self.repair_loop.arun(results, sandbox_repo_path)
+                finally:
+                    await asyncio.to_thread(self.test_runner.cleanup_sandbox, sandbox_repo_path)
+                if analysis is not None:
+                    results['analysis'] = f" Faild with following analysis {analysis} !! DO NOT COMMIT !!"
+        
+        results["metrics"] = self._metrics(tracer)
+        if pipeline_summary:
+            results["metrics"]["pipeline"] = pipeline_summary
+        return results
+    
+    def fork(self) -> "AgenticAISystem":
+        """A system for one request sharing this one's index and repo map, with agents of its own."""
+        system = copy.copy(self)
+        system._init_agents()
+        return system
+    
+    @traced("update_index")
+    def update_index(self, paths: List[str]) -> Dict:
+        """Re-index changed files and switch to the updated index and repo map.
+        
+        Only the nodes of the changed files are embedded. The update is made
+        on a copy, so runs in progress keep a consistent index: a private
+        index is copied in memory (its maps, not its nodes or vectors) and
+        left for persist_index to save, a shared index is published as a new
+        segment.
+        
+        Args:
+            paths: Changed, added or deleted files, relative to the repository
+            
+        Returns:
+            Number of files and new nodes
+        """
+        if not self.index_path:
+            raise ValueError("Incremental index updates need an index_path")
+        with self._update_lock:
+            doc_ids = sorted({self.ingestor.doc_id(path) for path in paths})
+            repo_map = self.repo_map.copy()
+            if repo_map.refresh(doc_ids):
+                repo_map.save(self.index_path)
+            self.repo_map = repo_map
+            nodes = self.ingestor.ingest_files(doc_ids)
+            if self.segments is not None:
+                with self.segments.build_lock():
+                    index = self.knowledge_builder.open_index(self.index_path, self.segments.current())
+                    self.knowledge_builder.update_index(index, nodes, doc_ids)
+                    self.ingestor.record(nodes)
+                    self.knowledge_builder.publish_index(index, self.index_path)
+                if not self.reload_index():
+                    self._init_agents()
+            else:
+                index = self.knowledge_builder.copy_index(self.index, doc_ids)
+                removed = self._nodes_size(index.docstore.get_nodes(
+                    [node_id for doc_id in doc_ids for node_id in getattr(index.docstore.get_ref_doc_info(doc_id), "node_ids", [])]
+                ))
+                self.knowledge_builder.update_index(index, nodes, doc_ids)
+                self.ingestor.record(nodes)
+                self.index = index
+                self.index_unsaved = True
+                self._record_index_size(removed, self._nodes_size(nodes))
+                self._init_agents()
+        return {"files": len(doc_ids), "nodes": len(nodes)}
+    
+    def persist_index(self) -> bool:
+        """Save a private index that update_index changed since it was last saved.
+        
+        Returns:
+            Whether the index was saved
+        """
+        with self._update_lock:
+            if not self.index_unsaved:
+                return False
+            self.knowledge_builder.save_index(self.index, self.index_path)
+            self.index_unsaved = False
+            return True
+    
+    def refresh_repo_map(self, paths: List[str] = None) -> List[str]:
+        """Update the repo map for files changed since it was built, persisting it with the index.
+        
+        Args:
+            paths: Only check these files; by default the whole tree is scanned
+            
+        Returns:
+            Relative paths that changed
+        """
+        changed = self.repo_map.refresh(paths)
+        if changed and self.index_path:
+            self.repo_map.save(self.index_path)
+        return changed
+    
+    def _record_index_size(self, removed: Tuple[int, int] = None, added: Tuple[int, int] = None):
+        """Publish the node count and text size of the index as gauges.
+        
+        A shared segment's sizes come from its manifest. A private index is
+        counted once; after that the sizes of the nodes an update removed
+        and added are applied to the count.
+        """
+        if self.segment is None:
+            if self._index_size is None or removed is None:
+                self._index_size = list(self._nodes_size(self.index.docstore.docs.values()))
+            else:
+                self._index_size = [size - old + new for size, old, new in zip(self._index_size, removed, added)]
+        metrics.INDEX_NODES.set(self._index_size[0], repo=self.repo_path)
+        metrics.INDEX_BYTES.set(self._index_size[1], repo=self.repo_path)
+    
+    @staticmethod
+    def _nodes_size(nodes: Iterable) -> Tuple[int, int]:
+        """Number of nodes and bytes of their text."""
+        count = size = 0
+        for node in nodes:
+            count += 1
+            size += len(node.get_content().encode())
+        return count, size
+    
+    def _metrics(self, tracer: Tracer) -> Dict:
+        """Summarize a run, exporting it as OTLP/JSON when TRACE_EXPORT_DIR is set."""
+        export_dir = os.getenv("TRACE_EXPORT_DIR")
+        if export_dir:
+            os.makedirs(export_dir, exist_ok=True)
+            tracer.export(os.path.join(export_dir, f"{tracer.trace_id}.json"))
+        summary = tracer.summary()
+        summary["index_build"] = self.build_tracer.summary()["totals"]
+        return summary
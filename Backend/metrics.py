@@ -0,0 +1,290 @@
+import math
+import time
+import threading
+import weakref
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Prometheus text exposition format version served by /metrics
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class _ShardedMetric(_Metric):
+    """Metric whose hot path writes only to a per-thread shard.
+
+    Updates never take a lock; the lock is only taken when a thread writes
+    for the first time and when the shards are merged for rendering. Shards
+    of finished threads are folded into a base shard so they don't pile up
+    under a thread-per-request server.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[weakref.ref, Dict]] = []
+        self._base: Dict = {}
+
+    def _shard(self) -> Dict:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = {}
+            self._local.shard = shard
+            with self._lock:
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+        return shard
+
+    def _merge(self, target: Dict, source: Dict):
+        raise NotImplementedError
+
+    def _collect(self) -> Dict:
+        with self._lock:
+            alive = []
+            for thread_ref, shard in self._shards:
+                thread = thread_ref()
+                if thread is None or not thread.is_alive():
+                    self._merge(self._base, shard)
+                else:
+                    alive.append((thread_ref, shard))
+            self._shards = alive
+            merged: Dict = {}
+            self._merge(merged, self._base)
+            for _, shard in alive:
+                # Copy first: the owning thread may add keys while we iterate
+                self._merge(merged, dict(shard))
+        return merged
+
+
+class Counter(_ShardedMetric):
+    """Monotonically increasing counter."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        shard = self._shard()
+        key = self._key(labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def _merge(self, target: Dict, source: Dict):
+        for key, value in source.items():
+            target[key] = target.get(key, 0) + value
+
+    def value(self, **labels: str) -> float:
+        return self._collect().get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+            for key, value in sorted(self._collect().items())
+        ]
+
+
+class Histogram(_ShardedMetric):
+    """Histogram with cumulative buckets, a sum and a count."""
+
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: str):
+        shard = self._shard()
+        key = self._key(labels)
+        state = shard.get(key)
+        if state is None:
+            # Per-bucket counts, then sum and count
+            state = [0] * (len(self.buckets) + 2)
+            shard[key] = state
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[i] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        """Observe the duration of a block in seconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _merge(self, target: Dict, source: Dict):
+        for key, state in source.items():
+            merged = target.setdefault(key, [0] * len(state))
+            for i, value in enumerate(list(state)):
+                merged[i] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, state in sorted(self._collect().items()):
+            cumulative = 0
+            for i, bound in enumerate(self.buckets):
+                cumulative += state[i]
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{labels} {state[-1]}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value that can go up and down.
+
+    Gauges are set rather than accumulated, so they can't be sharded per
+    thread; updates take a short lock.
+    """
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: str):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track_inprogress(self, **labels: str) -> Iterator[None]:
+        """Increment the gauge for the duration of a block."""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Registry:
+    """Collection of metrics rendered together in Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str) -> Optional[_Metric]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+# Metrics shared across the backend
+HTTP_REQUESTS = counter("http_requests_total", "HTTP requests by endpoint, method and status.", ("endpoint", "method", "status"))
+HTTP_ERRORS = counter("http_request_errors_total", "HTTP requests that returned an error.", ("endpoint",))
+HTTP_LATENCY = histogram("http_request_duration_seconds", "HTTP request latency.", ("endpoint",))
+
+AGENT_RUNS_IN_FLIGHT = gauge("agent_runs_in_flight", "Agent pipeline runs currently in progress.")
+AGENT_STAGE_LATENCY = histogram("agent_stage_duration_seconds", "Duration of agent pipeline stages.", ("stage",))
+
+LLM_CALLS = counter("llm_calls_total", "LLM calls made by the agents.")
+LLM_TOKENS = counter("llm_tokens_total", "LLM tokens by kind (prompt, completion).", ("kind",))
+LLM_LATENCY = histogram("llm_call_duration_seconds", "LLM call latency.")
+EMBEDDING_CALLS = counter("embedding_calls_total", "Embedding batches sent to the embedding model.")
+EMBEDDING_RETRIES = counter("embedding_retries_total", "Embedding batches retried, by reason (throttled, error).", ("reason",))
+RETRIEVAL_LATENCY = histogram("retrieval_duration_seconds", "Vector retrieval latency.",
+                              buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5))
+
+INDEX_NODES = gauge("index_nodes", "Nodes in the knowledge index of a repository.", ("repo",))
+INDEX_BYTES = gauge("index_bytes", "Text bytes in the knowledge index of a repository.", ("repo",))
+INDEX_UPDATES = counter("index_updates_total", "Background re-indexing of changed files by outcome (ok, error).", ("outcome",))
+
+CACHE_REQUESTS = counter("cache_requests_total", "Cache lookups by cache and result (hit, miss).", ("cache", "result"))
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup; the hit rate is hits / (hits + misses)."""
+    CACHE_REQUESTS.inc(cache=cache, result="hit" if hit else "miss")
@@ -0,0 +1,207 @@
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List
+
+from tracing import trace_span
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGraph:
+    """Async DAG scheduler.
+
+    Each task starts as soon as the tasks it depends on have finished and
+    receives their results as arguments. Tasks can be added while the graph
+    is running, e.g. per-file tasks once the plan is known.
+    """
+
+    def __init__(self):
+        """Initialize an empty graph."""
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.deps: Dict[str, List[str]] = {}
+        self.timings: Dict[str, Dict[str, float]] = {}
+        self._start = time.perf_counter()
+
+    def add(self, name: str, fn: Callable[..., Awaitable[Any]], deps: List[str] = (), stage: str = None, **attributes: Any) -> asyncio.Task:
+        """Schedule a task.
+
+        Args:
+            name: Unique task name
+            fn: Coroutine function called with the results of ``deps``
+            deps: Names of tasks that must finish first
+            stage: Span name under "pipeline.", defaults to the task name
+            attributes: Span attributes
+
+        Returns:
+            The asyncio task
+        """
+        if name in self._tasks:
+            raise ValueError(f"Task {name} is already scheduled")
+        missing = [dep for dep in deps if dep not in self._tasks]
+        if missing:
+            raise ValueError(f"Task {name} depends on unknown tasks {missing}")
+        self.deps[name] = list(deps)
+        dep_tasks = [self._tasks[dep] for dep in deps]
+
+        async def run():
+            dep_results = [await task for task in dep_tasks]
+            start = time.perf_counter()
+            try:
+                with trace_span(f"pipeline.{stage or name}", **attributes):
+                    return await fn(*dep_results)
+            finally:
+                self.timings[name] = {
+                    "start_ms": round((start - self._start) * 1e3, 3),
+                    "end_ms": round((time.perf_counter() - self._start) * 1e3, 3),
+                }
+
+        task = asyncio.ensure_future(run())
+        self._tasks[name] = task
+        return task
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tasks
+
+    async def result(self, name: str) -> Any:
+        return await self._tasks[name]
+
+    async def join(self):
+        """Wait for every scheduled task, cancelling the rest if one fails."""
+        try:
+            while not all(task.done() for task in self._tasks.values()):
+                # Tasks may schedule more tasks while we wait
+                await asyncio.gather(*self._tasks.values())
+        except BaseException:
+            await self.cancel()
+            raise
+
+    async def cancel(self):
+        pending = [task for task in self._tasks.values() if not task.done()]
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def critical_path(self) -> List[str]:
+        """Chain of tasks that determined the total latency, first to last."""
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda task: self.timings[task]["end_ms"])
+        path = [name]
+        while True:
+            deps = [dep for dep in self.deps.get(name, []) if dep in self.timings]
+            if not deps:
+                break
+            name = max(deps, key=lambda dep: self.timings[dep]["end_ms"])
+            path.append(name)
+        return list(reversed(path))
+
+    def summary(self) -> Dict:
+        return {
+            "tasks": dict(self.timings),
+            "critical_path": self.critical_path(),
+        }
+
+
+class PipelinedOrchestrator:
+    """Runs process_requirement as a DAG instead of sequential stages.
+
+    The sandbox snapshot is copied while the planner runs. Each file edit
+    starts once the plan is known, and the test for a file is generated as
+    soon as that file's edit is written. Tests run when the sandbox, all
+    edits and all generated tests are done; files written since the
+    snapshot are synced into the sandbox first. Latency approaches the
+    critical path (planning, the slowest edit and its test) instead of the
+    sum of the stages. Failing tests are handed to the system's RepairLoop
+    while the sandbox still exists.
+    """
+
+    def __init__(self, system: Any):
+        """Initialize the orchestrator.
+
+        Args:
+            system: The AgenticAISystem whose agents run the stages
+        """
+        self.system = system
+
+    async def arun(self, requirement: str, results: Dict) -> Dict:
+        """Run the pipeline for one requirement.
+
+        Args:
+            requirement: The change requirement
+            results: Result dictionary to fill (plan, changes, tests, ...)
+
+        Returns:
+            Task timings and the critical path
+        """
+        planner = self.system.planning_agent
+        executor = self.system.change_executor
+        test_runner = self.system.test_runner
+
+        graph = TaskGraph()
+        changes = executor.new_results()
+        generated_tests: List[str] = []
+        # The copy runs in a worker thread that can't be cancelled, so it is
+        # shielded and always awaited to clean the sandbox up
+        sandbox_future = asyncio.ensure_future(test_runner.aprepare_sandbox())
+
+        async def prepare_sandbox():
+            return await asyncio.shield(sandbox_future)
+
+        async def plan_stage():
+            return await planner.acreate_implementation_plan(requirement)
+
+        async def edit_stage(plan, file_path, create):
+            await executor.aexecute_file(plan, file_path, changes, create=create)
+
+        async def test_stage(_, file_path):
+            test_file = await test_runner.agenerate_test_file(file_path)
+            if test_file:
+                generated_tests.append(test_file)
+
+        async def run_tests_stage(sandbox_path, *_):
+            executor.order_results(results["plan"], changes)
+            written = changes["modified_files"] + changes["created_files"] + generated_tests
+            await asyncio.to_thread(test_runner.sync_sandbox, sandbox_path, written)
+            return await test_runner.arun_tests(sandbox_path)
+
+        graph.add("sandbox", prepare_sandbox)
+        graph.add("plan", plan_stage)
+        try:
+            plan = await graph.result("plan")
+            results["plan"] = plan
+            results["changes"] = changes
+
+            files_to_modify, files_to_create = executor.plan_files(plan, changes)
+            join_deps = ["sandbox"]
+            for file_path, create in [(f, False) for f in files_to_modify] + [(f, True) for f in files_to_create]:
+                edit = f"edit:{file_path}"
+                if edit in graph:
+                    continue
+                graph.add(edit, lambda plan, file_path=file_path, create=create: edit_stage(plan, file_path, create),
+                          ["plan"], stage="edit", file_path=file_path)
+                join_deps.append(edit)
+                if test_runner.is_testable(file_path):
+                    test = f"generate_test:{file_path}"
+                    graph.add(test, lambda edited, file_path=file_path: test_stage(edited, file_path),
+                              [edit], stage="generate_test", file_path=file_path)
+                    join_deps.append(test)
+            graph.add("run_tests", run_tests_stage, join_deps)
+            await graph.join()
+
+            results["tests"] = {"generated_tests": sorted(generated_tests)}
+            results["test_results"] = await graph.result("run_tests")
+            # Repairs rerun tests in the same sandbox before it is removed
+            analysis = await self.system.repair_loop.arun(results, await graph.result("sandbox"))
+            if analysis is not None:
+                results['analysis'] = f" Faild with following analysis {analysis} !! DO NOT COMMIT !!"
+        finally:
+            await graph.cancel()
+            try:
+                sandbox = await sandbox_future
+            except Exception as e:
+                logger.error(f"Sandbox preparation failed: {e}")
+                sandbox = None
+            if sandbox is not None:
+                await asyncio.to_thread(test_runner.cleanup_sandbox, sandbox)
+        return graph.summary()
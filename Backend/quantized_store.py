@@ -0,0 +1,478 @@
+import os
+import copy
+import json
+import shutil
+import weakref
+import logging
+import tempfile
+from typing import Any, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MODES = ("float32", "int8", "pq")
+
+META_FILE = "quantized_store.json"
+ARRAYS = ("deleted", "scales", "codes", "codebooks")
+VECTORS_FILE = "quantized_vectors.f32"
+
+# Rows scored at a time, bounding the temporary float copy of the codes
+BLOCK_ROWS = 16384
+
+# Fraction of deleted vectors at which delete compacts the store
+COMPACT_THRESHOLD = float(os.getenv("VECTOR_COMPACT_THRESHOLD", "0.25"))
+
+
+class QuantizedVectors:
+    """Compressed in-memory vectors with exact re-ranking from disk.
+
+    Vectors are normalized (cosine similarity, as SimpleVectorStore uses)
+    and kept in memory only as codes:
+
+    - ``int8``: one byte per dimension plus a float scale per vector
+    - ``pq``: product quantization, one byte per group of dimensions, with
+      256 centroids per group trained by k-means on the stored vectors
+    - ``float32``: no codes, every search scans the full vectors
+
+    The full float32 vectors are appended to a file and memory-mapped, so
+    re-ranking the top ``k * rerank`` approximate candidates only pages in
+    those rows. A store loaded read-only maps its codes as well, so
+    processes sharing it share the pages.
+    """
+
+    def __init__(self, mode: str = "int8", rerank: int = 4, pq_subvectors: Optional[int] = None,
+                 vectors_path: Optional[str] = None):
+        """Initialize an empty store.
+
+        Args:
+            mode: "float32", "int8" or "pq"
+            rerank: Candidates re-ranked with the full vectors per result, 0
+                to return approximate scores
+            pq_subvectors: Bytes per vector in pq mode; defaults to one per 8
+                dimensions
+            vectors_path: File for the full vectors; a temporary file by default
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown quantization mode {mode!r}, expected one of {MODES}")
+        self.mode = mode
+        self.rerank = rerank
+        self.pq_subvectors = pq_subvectors
+        self.dim: Optional[int] = None
+        self.ids: List[str] = []
+        self.ref_doc_ids: List[Optional[str]] = []
+        self.deleted = np.zeros(0, dtype=bool)
+        self.codes: Optional[np.ndarray] = None
+        self.scales = np.zeros(0, dtype=np.float32)
+        self.codebooks: Optional[np.ndarray] = None
+        self.trained_count = 0
+        # Removes a temporary vectors file once no store refers to it
+        self._temporary: Optional[_TemporaryFile] = None
+        if vectors_path is None:
+            fd, vectors_path = tempfile.mkstemp(prefix="cursor_vectors_", suffix=".f32")
+            os.close(fd)
+            self._temporary = _TemporaryFile(vectors_path)
+        self.vectors_path = vectors_path
+        self.read_only = False
+        self._vectors: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def add(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]], ref_doc_ids: Optional[Sequence[Optional[str]]] = None):
+        """Append vectors.
+
+        Args:
+            ids: Node ids
+            embeddings: Vectors, all of the same dimension
+            ref_doc_ids: Source document of each node, for delete
+        """
+        self._check_writable()
+        if not len(ids):
+            return
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-dimensional vectors, got {vectors.shape[1]}")
+        with open(self.vectors_path, "r+b" if os.path.exists(self.vectors_path) else "wb") as f:
+            # Rows past this store's were appended by a copy that was dropped
+            f.seek(len(self) * self.dim * 4)
+            f.write(vectors.tobytes())
+            f.truncate()
+        self._vectors = None
+        self.ids.extend(ids)
+        self.ref_doc_ids.extend(ref_doc_ids if ref_doc_ids is not None else [None] * len(ids))
+        self.deleted = np.concatenate([self.deleted, np.zeros(len(ids), dtype=bool)])
+        if self.mode == "int8":
+            codes, scales = _int8_encode(vectors)
+            self.scales = np.concatenate([self.scales, scales])
+            self.codes = codes if self.codes is None else np.concatenate([self.codes, codes])
+        elif self.mode == "float32":
+            return
+        elif self.codebooks is not None and len(self) < 2 * self.trained_count:
+            codes = _pq_encode(vectors, self.codebooks)
+            self.codes = np.concatenate([self.codes, codes])
+        else:
+            # (Re)trained on the next search once the store has doubled
+            self.codebooks = None
+
+    def copy(self) -> "QuantizedVectors":
+        """A store with the same vectors that can be changed without changing this one.
+
+        Arrays are shared, since add replaces them rather than writing into
+        them; the id lists and the delete mask, which change in place, are
+        copied. The copy appends to the same vectors file, past the rows
+        this store maps, so it must be the only one of the two still changed.
+        """
+        clone = copy.copy(self)
+        clone.ids = list(self.ids)
+        clone.ref_doc_ids = list(self.ref_doc_ids)
+        clone.deleted = self.deleted.copy()
+        return clone
+
+    def delete(self, ref_doc_id: str):
+        """Drop the vectors of a source document.
+
+        They are only masked until COMPACT_THRESHOLD of the store is
+        deleted; then the store is compacted.
+        """
+        self._check_writable()
+        for i, doc_id in enumerate(self.ref_doc_ids):
+            if doc_id == ref_doc_id:
+                self.deleted[i] = True
+        if len(self) and self.deleted.sum() >= COMPACT_THRESHOLD * len(self):
+            self.compact()
+
+    def compact(self):
+        """Remove deleted vectors from the codes, the id lists and the vectors file.
+
+        The remaining vectors are written to a new temporary file, so
+        copies of this store and memory maps of the old file stay valid.
+        """
+        self._check_writable()
+        keep = np.flatnonzero(~self.deleted)
+        if len(keep) == len(self):
+            return
+        fd, vectors_path = tempfile.mkstemp(prefix="cursor_vectors_", suffix=".f32")
+        os.close(fd)
+        temporary = _TemporaryFile(vectors_path)
+        if len(keep):
+            vectors = self._full_vectors()
+            with open(vectors_path, "wb") as f:
+                for start in range(0, len(keep), BLOCK_ROWS):
+                    f.write(np.ascontiguousarray(vectors[keep[start:start + BLOCK_ROWS]]).tobytes())
+        logger.info(f"Compacted the vector store from {len(self)} to {len(keep)} vectors")
+        if self.mode == "int8":
+            self.scales = self.scales[keep]
+        if self.codes is not None:
+            # Untrained PQ codes don't cover every vector and are rebuilt on the next search
+            self.codes = self.codes[keep] if len(self.codes) == len(self) else None
+        self.ids = [self.ids[i] for i in keep]
+        self.ref_doc_ids = [self.ref_doc_ids[i] for i in keep]
+        self.deleted = np.zeros(len(keep), dtype=bool)
+        self.vectors_path = vectors_path
+        self._temporary = temporary
+        self._vectors = None
+
+    def search(self, query: Sequence[float], k: int, node_ids: Optional[Sequence[str]] = None) -> Tuple[List[str], List[float]]:
+        """Most similar vectors by cosine similarity.
+
+        Args:
+            query: Query vector
+            k: Number of results
+            node_ids: Only consider these nodes
+
+        Returns:
+            Node ids and similarities, best first
+        """
+        if not len(self) or k <= 0:
+            return [], []
+        query = _normalize(np.asarray(query, dtype=np.float32)[None, :])[0]
+        valid = ~self.deleted
+        if node_ids is not None:
+            valid &= np.isin(np.asarray(self.ids, dtype=object), list(node_ids))
+        candidates = np.flatnonzero(valid)
+        if not len(candidates):
+            return [], []
+
+        scores = self._approximate_scores(query)[candidates]
+        rerank = self.rerank and self.mode != "float32"
+        wanted = min(len(candidates), k * self.rerank if rerank else k)
+        top = np.argpartition(-scores, wanted - 1)[:wanted]
+        candidates, scores = candidates[top], scores[top]
+        if rerank:
+            # Sorted rows keep the reads sequential
+            order = np.argsort(candidates)
+            candidates = candidates[order]
+            scores = self._full_vectors()[candidates] @ query
+        best = np.argsort(-scores)[:k]
+        return [self.ids[i] for i in candidates[best]], [float(score) for score in scores[best]]
+
+    def nbytes(self) -> int:
+        """Resident size of the codes, scales, codebooks and delete mask."""
+        arrays = [self.codes, self.scales, self.codebooks, self.deleted]
+        return sum(array.nbytes for array in arrays if array is not None)
+
+    def save(self, directory: str):
+        """Persist the store into a directory (next to a llama_index persist dir)."""
+        os.makedirs(directory, exist_ok=True)
+        if self.mode == "pq":
+            self._train()
+        vectors_path = os.path.join(directory, VECTORS_FILE)
+        if os.path.abspath(vectors_path) != os.path.abspath(self.vectors_path):
+            # Replaced rather than overwritten, so stores mapping the old file keep it
+            shutil.copyfile(self.vectors_path, vectors_path + ".tmp")
+            os.replace(vectors_path + ".tmp", vectors_path)
+        for name in ARRAYS:
+            array = getattr(self, name)
+            path = _array_path(directory, name)
+            if array is not None:
+                np.save(path, array)
+            elif os.path.exists(path):
+                os.remove(path)
+        meta = {
+            "mode": self.mode,
+            "rerank": self.rerank,
+            "pq_subvectors": self.pq_subvectors,
+            "dim": self.dim,
+            "trained_count": self.trained_count,
+            "ids": self.ids,
+            "ref_doc_ids": self.ref_doc_ids,
+        }
+        temp_path = os.path.join(directory, META_FILE + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp_path, os.path.join(directory, META_FILE))
+
+    @classmethod
+    def load(cls, directory: str, read_only: bool = False) -> "QuantizedVectors":
+        """Load a saved store.
+
+        Args:
+            directory: Directory the store was saved into
+            read_only: Memory-map the codes instead of reading them, and refuse
+                changes; for stores shared between processes
+        """
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        store = cls(meta["mode"], meta["rerank"], meta["pq_subvectors"], vectors_path=os.path.join(directory, VECTORS_FILE))
+        store.dim = meta["dim"]
+        store.trained_count = meta["trained_count"]
+        store.ids = meta["ids"]
+        store.ref_doc_ids = meta["ref_doc_ids"]
+        for name in ARRAYS:
+            path = _array_path(directory, name)
+            if os.path.exists(path):
+                setattr(store, name, np.load(path, mmap_mode="r" if read_only else None))
+        store.read_only = read_only
+        if read_only:
+            if len(store) and store.dim:
+                # Mapped now, so the vectors stay readable if the directory is removed later
+                store._full_vectors()
+            return store
+        # Rows appended after the last save belong to no id
+        saved_size = len(store.ids) * (store.dim or 0) * 4
+        if os.path.getsize(store.vectors_path) > saved_size:
+            with open(store.vectors_path, "r+b") as f:
+                f.truncate(saved_size)
+        return store
+
+    @staticmethod
+    def exists(directory: str) -> bool:
+        return os.path.exists(os.path.join(directory, META_FILE))
+
+    def _check_writable(self):
+        if self.read_only:
+            raise RuntimeError(f"The vector store in {os.path.dirname(self.vectors_path)} is read-only")
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        scores = np.empty(len(self), dtype=np.float32)
+        if self.mode == "float32":
+            vectors = self._full_vectors()
+            for start in range(0, len(self), BLOCK_ROWS):
+                scores[start:start + BLOCK_ROWS] = vectors[start:start + BLOCK_ROWS] @ query
+            return scores
+        if self.mode == "int8":
+            for start in range(0, len(self), BLOCK_ROWS):
+                end = start + BLOCK_ROWS
+                scores[start:end] = (self.codes[start:end] @ query) * self.scales[start:end]
+            return scores
+        self._train()
+        subvectors = self.codebooks.shape[0]
+        # Asymmetric distance: the query stays exact, one table lookup per code byte
+        tables = np.einsum("msd,md->ms", self.codebooks, query.reshape(subvectors, -1))
+        for start in range(0, len(self), BLOCK_ROWS):
+            end = start + BLOCK_ROWS
+            scores[start:end] = tables[np.arange(subvectors), self.codes[start:end]].sum(axis=1)
+        return scores
+
+    def _full_vectors(self) -> np.ndarray:
+        if self._vectors is None or len(self._vectors) != len(self):
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(len(self), self.dim))
+        return self._vectors
+
+    def _train(self):
+        """Train the PQ codebooks and encode every vector, if not done for this size."""
+        if self.codebooks is not None or not len(self):
+            return
+        subvectors = self.pq_subvectors or _pq_subvectors(self.dim)
+        if self.dim % subvectors:
+            raise ValueError(f"pq_subvectors must divide the dimension {self.dim}")
+        vectors = self._full_vectors()
+        sample = vectors[np.sort(np.random.default_rng(0).choice(len(self), min(len(self), 32768), replace=False))]
+        self.codebooks = _pq_train(np.asarray(sample), subvectors)
+        self.codes = np.concatenate([
+            _pq_encode(np.asarray(vectors[start:start + 65536]), self.codebooks)
+            for start in range(0, len(self), 65536)
+        ])
+        self.trained_count = len(self)
+        logger.info(f"Trained {subvectors}x{self.codebooks.shape[1]} PQ codebooks on {len(sample)} vectors")
+
+
+def create_vector_store(mode: str, **kwargs: Any) -> Any:
+    """A llama_index vector store keeping quantized vectors.
+
+    Args:
+        mode: "float32", "int8" or "pq"
+        kwargs: Further QuantizedVectors arguments
+    """
+    return as_vector_store(QuantizedVectors(mode, **kwargs))
+
+
+def load_vector_store(directory: str, read_only: bool = False) -> Any:
+    """The llama_index vector store saved in a persist directory."""
+    return as_vector_store(QuantizedVectors.load(directory, read_only=read_only))
+
+
+def as_vector_store(vectors: QuantizedVectors) -> Any:
+    """A llama_index vector store serving existing vectors."""
+    return _store_class()(vectors)
+
+
+_STORE_CLASS = None
+
+
+def _store_class():
+    global _STORE_CLASS
+    if _STORE_CLASS is None:
+        _STORE_CLASS = _build_store_class()
+    return _STORE_CLASS
+
+
+def _build_store_class():
+    from llama_index.core.bridge.pydantic import PrivateAttr
+    from llama_index.core.vector_stores.types import BasePydanticVectorStore, VectorStoreQueryResult
+
+    class QuantizedVectorStore(BasePydanticVectorStore):
+        """llama_index adapter for QuantizedVectors; node text stays in the docstore."""
+
+        stores_text: bool = False
+        _vectors: Any = PrivateAttr()
+
+        def __init__(self, vectors: QuantizedVectors):
+            super().__init__()
+            self._vectors = vectors
+
+        @classmethod
+        def class_name(cls) -> str:
+            return "QuantizedVectorStore"
+
+        @property
+        def client(self) -> QuantizedVectors:
+            return self._vectors
+
+        def add(self, nodes: List[Any], **add_kwargs: Any) -> List[str]:
+            ids = [node.node_id for node in nodes]
+            self._vectors.add(ids, [node.get_embedding() for node in nodes], [node.ref_doc_id for node in nodes])
+            return ids
+
+        def delete(self, ref_doc_id: str, **delete_kwargs: Any) -> None:
+            self._vectors.delete(ref_doc_id)
+
+        def query(self, query: Any, **kwargs: Any) -> Any:
+            if query.filters is not None:
+                raise NotImplementedError("Metadata filters are not supported by the quantized vector store")
+            if query.query_embedding is None:
+                raise ValueError("Query embedding is required")
+            ids, similarities = self._vectors.search(query.query_embedding, query.similarity_top_k, node_ids=query.node_ids)
+            return VectorStoreQueryResult(ids=ids, similarities=similarities)
+
+        def persist(self, persist_path: str, fs: Any = None) -> None:
+            self._vectors.save(os.path.dirname(persist_path))
+
+    return QuantizedVectorStore
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def _int8_encode(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.round(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _pq_subvectors(dim: int) -> int:
+    target = max(1, dim // 8)
+    while dim % target:
+        target -= 1
+    return target
+
+
+def _pq_train(vectors: np.ndarray, subvectors: int, centroids: int = 256, iterations: int = 20) -> np.ndarray:
+    """k-means codebooks of shape (subvectors, centroids, dim / subvectors)."""
+    rng = np.random.default_rng(0)
+    centroids = min(centroids, len(vectors))
+    parts = vectors.reshape(len(vectors), subvectors, -1)
+    codebooks = np.empty((subvectors, centroids, parts.shape[2]), dtype=np.float32)
+    for m in range(subvectors):
+        data = parts[:, m, :]
+        centers = data[rng.choice(len(data), centroids, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest(data, centers)
+            counts = np.bincount(assignment, minlength=centroids)
+            sums = np.zeros_like(centers)
+            np.add.at(sums, assignment, data)
+            empty = counts == 0
+            centers[~empty] = sums[~empty] / counts[~empty, None]
+            # Re-seed clusters that lost all their points
+            centers[empty] = data[rng.choice(len(data), int(empty.sum()))]
+        codebooks[m] = centers
+    return codebooks
+
+
+def _pq_encode(vectors: np.ndarray, codebooks: np.ndarray) -> np.ndarray:
+    subvectors = codebooks.shape[0]
+    parts = vectors.reshape(len(vectors), subvectors, -1)
+    codes = np.empty((len(vectors), subvectors), dtype=np.uint8)
+    for m in range(subvectors):
+        codes[:, m] = _nearest(parts[:, m, :], codebooks[m])
+    return codes
+
+
+def _nearest(data: np.ndarray, centers: np.ndarray) -> np.ndarray:
+    distances = (centers * centers).sum(axis=1)[None, :] - 2 * data @ centers.T
+    return distances.argmin(axis=1)
+
+
+def _array_path(directory: str, name: str) -> str:
+    return os.path.join(directory, f"quantized_{name}.npy")
+
+
+class _TemporaryFile:
+    """A file removed once the last object referring to this one is collected."""
+
+    def __init__(self, path: str):
+        self.path = path
+        weakref.finalize(self, _remove_file, path)
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,216 @@
+import os
+import re
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set
+
+from agents import ChangeExecutor, TestSandboxRunner, RunBudget, run_sync
+from tracing import trace_span
+from workspace import workspace_for
+
+logger = logging.getLogger(__name__)
+
+# Paths of Python files in tracebacks and pytest reports, e.g. 'File "/tmp/x/app.py", line 3' or "app.py:3: in f"
+_TRACEBACK_PATH = re.compile(r'(?:File "([^"]+\.py)"|^([\w./-]+\.py):\d+)', re.MULTILINE)
+
+
+class RepairLoop:
+    """Fixes failing tests by feeding the failure analysis back into the ChangeExecutor.
+
+    Each iteration analyzes the failures, changes only the files they
+    implicate, syncs those into the existing sandbox and reruns only the
+    failed tests and the tests of the changed files. Once those pass, the
+    whole suite runs once more to confirm. The loop stops when the suite is
+    green, the iteration limit or token budget runs out, or no file can be
+    blamed.
+    """
+
+    def __init__(self, change_executor: ChangeExecutor, test_runner: TestSandboxRunner,
+                 max_iterations: Optional[int] = None, token_budget: Optional[int] = None):
+        """Initialize the repair loop.
+
+        Args:
+            change_executor: Executor that applied the original plan
+            test_runner: Runner that produced the failing results
+            max_iterations: Repair attempts per requirement, 0 to only analyze
+                the failures. Defaults to REPAIR_MAX_ITERATIONS (2).
+            token_budget: Prompt plus completion tokens for all attempts, 0 for
+                none. Defaults to REPAIR_TOKEN_BUDGET (40000).
+        """
+        self.change_executor = change_executor
+        self.test_runner = test_runner
+        if max_iterations is None:
+            max_iterations = int(os.getenv("REPAIR_MAX_ITERATIONS", "2"))
+        if token_budget is None:
+            token_budget = int(os.getenv("REPAIR_TOKEN_BUDGET", "40000"))
+        self.max_iterations = max_iterations
+        self.token_budget = token_budget
+
+    def run(self, results: Dict, sandbox_repo_path: Optional[str] = None) -> Optional[Dict]:
+        """Blocking version of arun."""
+        return run_sync(self.arun(results, sandbox_repo_path))
+
+    async def arun(self, results: Dict, sandbox_repo_path: Optional[str] = None) -> Optional[Dict]:
+        """Repair the changes of a run whose tests failed.
+
+        Args:
+            results: Results of process_requirement; changes and test_results
+                are updated in place and a summary is stored under 'repair'
+            sandbox_repo_path: Sandbox the tests ran in; the caller keeps
+                ownership of it. By default one is prepared when needed and
+                removed afterwards.
+
+        Returns:
+            Analysis of the remaining failures, or None if the tests pass
+        """
+        if results["test_results"].get("success", False):
+            return None
+        budget = RunBudget(0, self.token_budget, name="repair")
+        owned = sandbox_repo_path is None and self.max_iterations > 0
+        iterations, stop_reason = [], None
+        try:
+            with budget.tracer.activate(), trace_span("repair") as span:
+                while True:
+                    analysis = await self.test_runner.aanalyze_test_failures(results["test_results"])
+                    stop_reason = self._stop_reason(budget, iterations)
+                    files = [] if stop_reason else self.implicated_files(analysis, results)
+                    if not stop_reason and not files:
+                        stop_reason = "no implicated files"
+                    if stop_reason:
+                        break
+                    if sandbox_repo_path is None:
+                        sandbox_repo_path = await self.test_runner.aprepare_sandbox()
+                    with trace_span("repair.iteration", iteration=len(iterations) + 1):
+                        repair_results = await self.change_executor.aexecute_plan(self.repair_plan(analysis, files))
+                        self.change_executor.merge_results(results["changes"], repair_results)
+                        await asyncio.to_thread(self.test_runner.sync_sandbox, sandbox_repo_path, repair_results["modified_files"])
+                        test_paths = self.affected_tests(results["test_results"], repair_results["modified_files"])
+                        test_results = await self.test_runner.arun_tests(sandbox_repo_path, test_paths)
+                        if test_results["success"] and test_paths:
+                            test_results = await self.test_runner.arun_tests(sandbox_repo_path)
+                    results["test_results"] = test_results
+                    iterations.append(self._iteration(repair_results, test_paths, test_results))
+                    if test_results["success"]:
+                        analysis = None
+                        break
+                self._end_run(results, span, budget, iterations, stop_reason)
+        finally:
+            if owned and sandbox_repo_path is not None:
+                await asyncio.to_thread(self.test_runner.cleanup_sandbox, sandbox_repo_path)
+        return analysis
+
+    def implicated_files(self, analysis: Dict, results: Dict) -> List[str]:
+        """Files to repair: those named by the analysis' fixes, else those in the tracebacks.
+
+        Only files the run wrote are candidates, so a repair never rewrites
+        code or tests the user wrote to make them pass.
+
+        Args:
+            analysis: Output of analyze_test_failures
+            results: Results of process_requirement
+
+        Returns:
+            Existing files relative to the repository, in order of mention
+        """
+        changed = self.changed_files(results)
+        files = []
+        for fix in analysis.get("fixes") or []:
+            file_path = self._repo_path(fix.get("file", "")) if isinstance(fix, dict) else None
+            if file_path in changed and file_path not in files:
+                files.append(file_path)
+        if files:
+            return files
+        test_results = results["test_results"]
+        output = test_results.get("output", "") + "\n" + test_results.get("error", "")
+        for match in _TRACEBACK_PATH.finditer(output):
+            file_path = self._repo_path(match.group(1) or match.group(2))
+            if file_path in changed and file_path not in files:
+                files.append(file_path)
+        return files
+
+    def changed_files(self, results: Dict) -> Set[str]:
+        """Files the run modified, created or generated tests in, relative to the repository."""
+        changes = results.get("changes") or {}
+        changed = {os.path.normpath(path) for path in changes.get("modified_files", []) + changes.get("created_files", [])}
+        changed.update(os.path.relpath(test, self.test_runner.repo_path) for test in (results.get("tests") or {}).get("generated_tests", []))
+        return changed
+
+    def repair_plan(self, analysis: Dict, files: List[str]) -> Dict:
+        """A plan modifying the implicated files, with one step per suggested fix."""
+        summary = analysis.get("summary", "")
+        steps = []
+        for fix in analysis.get("fixes") or []:
+            if not isinstance(fix, dict):
+                continue
+            file_path = self._repo_path(fix.get("file", ""))
+            if file_path in files:
+                steps.append(f"In {file_path}, fix the failing tests. Issue: {fix.get('issue', summary)}. Fix: {fix.get('fix', '')}")
+        for file_path in files:
+            if not any(file_path in step for step in steps):
+                steps.append(f"In {file_path}, fix the failing tests. Failure summary: {summary}")
+        return {"files_to_modify": files, "files_to_create": [], "implementation_steps": steps}
+
+    def affected_tests(self, test_results: Dict, repaired_files: List[str]) -> List[str]:
+        """Tests to rerun after a repair: the failed ones and those of the repaired files.
+
+        An empty list means the failures couldn't be attributed and the whole
+        suite has to run.
+        """
+        failed = self.test_runner.failed_tests(test_results)
+        if not failed:
+            return []
+        tests = list(failed)
+        for test in self.test_runner.tests_for(repaired_files):
+            if not any(node == test or node.startswith(test + "::") for node in tests):
+                tests.append(test)
+        return tests
+
+    def _repo_path(self, file_path: str) -> Optional[str]:
+        """A path from the analysis or a traceback as an existing file relative to the repository."""
+        file_path = file_path.strip().strip("`'\"")
+        if not file_path:
+            return None
+        if os.path.isabs(file_path):
+            # Tracebacks from the sandbox: .../cursor_sandbox_xxx/sandbox_repo/<path>
+            marker = os.sep + "sandbox_repo" + os.sep
+            if marker in file_path:
+                file_path = file_path.split(marker, 1)[1]
+            else:
+                file_path = os.path.relpath(file_path, self.test_runner.repo_path)
+        file_path = os.path.normpath(file_path)
+        if file_path.startswith(".."):
+            return None
+        if not workspace_for(self.test_runner.repo_path).exists(file_path):
+            return None
+        return file_path
+
+    def _stop_reason(self, budget: RunBudget, iterations: List[Dict]) -> Optional[str]:
+        if len(iterations) >= self.max_iterations:
+            return "iteration limit reached"
+        exhausted = budget.exhausted()
+        if exhausted:
+            return f"{exhausted} budget exhausted"
+        return None
+
+    def _iteration(self, repair_results: Dict, test_paths: List[str], test_results: Dict) -> Dict:
+        return {
+            "files": repair_results["modified_files"],
+            "errors": repair_results["errors"],
+            "tests_run": test_paths or "all",
+            "success": test_results["success"],
+        }
+
+    def _end_run(self, results: Dict, span: Any, budget: RunBudget, iterations: List[Dict], stop_reason: Optional[str]):
+        used = budget.used()
+        success = results["test_results"].get("success", False)
+        stop_reason = "tests pass" if success else stop_reason
+        logger.info(f"Repair took {len(iterations)} iterations and {used['tokens']} tokens ({stop_reason})")
+        if span is not None:
+            span.attributes.update(iterations=len(iterations), stop_reason=stop_reason, tokens=used["tokens"])
+        if iterations:
+            results["repair"] = {
+                "iterations": iterations,
+                "success": success,
+                "stop_reason": stop_reason,
+                "tokens": used["tokens"],
+            }
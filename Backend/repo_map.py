@@ -0,0 +1,337 @@
+import os
+import re
+import ast
+import json
+import logging
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+from tracing import traced
+
+logger = logging.getLogger(__name__)
+
+REPO_MAP_FILE = "repo_map.json"
+# Bump when the summary format changes so persisted maps are rebuilt
+REPO_MAP_VERSION = 1
+
+DEFAULT_EXCLUDE_DIRS = [".git", "__pycache__", ".venv", "venv", "node_modules"]
+# Files above this size are listed but not read for a summary
+MAX_SUMMARY_BYTES = 1024 * 1024
+SUMMARY_CHARS = 120
+
+LANGUAGES = {
+    ".py": "Python", ".js": "JavaScript", ".jsx": "JavaScript", ".ts": "TypeScript",
+    ".tsx": "TypeScript", ".java": "Java", ".go": "Go", ".rs": "Rust", ".rb": "Ruby",
+    ".c": "C", ".h": "C", ".cpp": "C++", ".hpp": "C++", ".cs": "C#", ".php": "PHP",
+    ".swift": "Swift", ".kt": "Kotlin", ".scala": "Scala", ".sh": "Shell",
+    ".html": "HTML", ".css": "CSS", ".scss": "CSS", ".sql": "SQL", ".md": "Markdown",
+    ".rst": "reStructuredText", ".json": "JSON", ".yaml": "YAML", ".yml": "YAML",
+    ".toml": "TOML", ".ini": "INI", ".cfg": "INI", ".txt": "Text",
+}
+
+_DEFINITION = re.compile(
+    r"^\s*(?:export\s+)?(?:default\s+)?(?:public\s+|private\s+|static\s+|async\s+)*"
+    r"(?:class|function|def|func|fn|interface|struct|enum|const|type)\s+([A-Za-z_]\w*)",
+    re.MULTILINE,
+)
+_COMMENT = re.compile(r"^\s*(?://+|#+|/\*+|\*|<!--|--)\s*(.*?)\s*(?:\*/|-->)?\s*$")
+
+
+def _shorten(text: str, limit: int = SUMMARY_CHARS) -> str:
+    text = " ".join(text.split())
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def _format_size(num_bytes: int) -> str:
+    if num_bytes < 1024:
+        return f"{num_bytes} B"
+    if num_bytes < 1024 * 1024:
+        return f"{num_bytes / 1024:.1f} KB"
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+def summarize_file(rel_path: str, content: str) -> str:
+    """One-line heuristic summary of a file.
+
+    Uses the module docstring and top-level definitions for Python, the first
+    heading for Markdown, top-level keys for JSON, and the leading comment
+    and declared names for other languages.
+
+    Args:
+        rel_path: Path of the file relative to the repository
+        content: File content
+
+    Returns:
+        A summary of at most SUMMARY_CHARS characters
+    """
+    extension = os.path.splitext(rel_path)[1].lower()
+    lines = content.count("\n") + (1 if content and not content.endswith("\n") else 0)
+
+    if extension == ".py":
+        try:
+            tree = ast.parse(content)
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is not None:
+            docstring = (ast.get_docstring(tree) or "").strip().splitlines()
+            classes = [node.name for node in tree.body if isinstance(node, ast.ClassDef)]
+            functions = [node.name for node in tree.body
+                         if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and not node.name.startswith("_")]
+            parts = [docstring[0]] if docstring else []
+            if classes:
+                parts.append("classes: " + ", ".join(classes[:6]))
+            if functions:
+                parts.append("functions: " + ", ".join(functions[:6]))
+            if parts:
+                return _shorten("; ".join(parts))
+
+    if extension in (".md", ".rst"):
+        for line in content.splitlines():
+            heading = line.strip().lstrip("#").strip()
+            if heading and not set(heading) <= set("=-~*"):
+                return _shorten(heading)
+
+    if extension == ".json":
+        try:
+            data = json.loads(content)
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            return _shorten("keys: " + ", ".join(list(data)[:10]))
+
+    comment = ""
+    for line in content.splitlines()[:20]:
+        if not line.strip() or line.startswith("#!"):
+            continue
+        match = _COMMENT.match(line)
+        if match and match.group(1) and re.search(r"[A-Za-z]{3}", match.group(1)):
+            comment = match.group(1)
+        break
+    names = list(dict.fromkeys(_DEFINITION.findall(content)))[:6]
+    parts = [comment] if comment else []
+    if names:
+        parts.append("defines: " + ", ".join(names))
+    return _shorten("; ".join(parts)) if parts else f"{lines} lines"
+
+
+class RepoMap:
+    """Hierarchical structural overview of a repository.
+
+    Holds a one-line summary, size and language per file, rolled up per
+    directory. It is built at index time, persisted next to the index and
+    refreshed incrementally: only files whose size or modification time
+    changed are summarized again.
+    """
+
+    def __init__(self, repo_path: str, exclude_dirs: Optional[List[str]] = None):
+        """Initialize an empty map.
+
+        Args:
+            repo_path: Path to the repository
+            exclude_dirs: Directory names to skip
+        """
+        self.repo_path = repo_path
+        self.exclude_dirs = set(exclude_dirs or DEFAULT_EXCLUDE_DIRS)
+        # Relative path -> {"size", "mtime_ns", "language", "summary"}
+        self.files: Dict[str, Dict] = {}
+
+    @classmethod
+    def build(cls, repo_path: str, exclude_dirs: Optional[List[str]] = None) -> "RepoMap":
+        """Build the map for a repository from scratch."""
+        repo_map = cls(repo_path, exclude_dirs)
+        repo_map.refresh()
+        return repo_map
+
+    @classmethod
+    def load(cls, repo_path: str, index_path: str, exclude_dirs: Optional[List[str]] = None) -> "RepoMap":
+        """Load the map persisted with an index, or start an empty one.
+
+        Args:
+            repo_path: Path to the repository
+            index_path: Directory the index is persisted in
+            exclude_dirs: Directory names to skip
+
+        Returns:
+            The map; call ``refresh`` to bring it up to date
+        """
+        repo_map = cls(repo_path, exclude_dirs)
+        path = os.path.join(index_path, REPO_MAP_FILE)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("version") == REPO_MAP_VERSION:
+                repo_map.files = data["files"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.info(f"No usable repo map at {path}: {e}")
+        return repo_map
+
+    def copy(self) -> "RepoMap":
+        """A copy that can be refreshed while this map is being read."""
+        repo_map = RepoMap(self.repo_path, list(self.exclude_dirs))
+        repo_map.files = dict(self.files)
+        return repo_map
+
+    def save(self, index_path: str):
+        """Persist the map next to the index.
+
+        Args:
+            index_path: Directory the index is persisted in
+        """
+        os.makedirs(index_path, exist_ok=True)
+        path = os.path.join(index_path, REPO_MAP_FILE)
+        # Per-process temp file: workers sharing an index save the map concurrently
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"version": REPO_MAP_VERSION, "files": self.files}, f)
+        os.replace(temp_path, path)
+
+    def _walk(self) -> Iterable[str]:
+        for root, dirs, files in os.walk(self.repo_path):
+            dirs[:] = sorted(d for d in dirs if d not in self.exclude_dirs and not d.startswith("."))
+            for name in sorted(files):
+                if not name.startswith("."):
+                    yield os.path.relpath(os.path.join(root, name), self.repo_path).replace(os.sep, "/")
+
+    @traced("repo_map.refresh")
+    def refresh(self, paths: Optional[Iterable[str]] = None) -> List[str]:
+        """Bring the map up to date with the working tree.
+
+        Args:
+            paths: Only check these paths (absolute or relative to the
+                repository), e.g. the files a change just wrote. By default
+                the whole tree is scanned.
+
+        Returns:
+            Relative paths that were added, changed or removed
+        """
+        if paths is None:
+            candidates = set(self._walk())
+            removed = [rel_path for rel_path in self.files if rel_path not in candidates]
+        else:
+            candidates = {self._relative(path) for path in paths}
+            removed = [rel_path for rel_path in candidates if not os.path.isfile(self._absolute(rel_path))]
+            candidates -= set(removed)
+
+        changed = []
+        for rel_path in removed:
+            if self.files.pop(rel_path, None) is not None:
+                changed.append(rel_path)
+        for rel_path in sorted(candidates):
+            try:
+                stat = os.stat(self._absolute(rel_path))
+            except OSError:
+                continue
+            entry = self.files.get(rel_path)
+            if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+                continue
+            self.files[rel_path] = self._describe(rel_path, stat)
+            changed.append(rel_path)
+        if changed:
+            logger.info(f"Repo map updated {len(changed)} files")
+        return changed
+
+    def _relative(self, path: str) -> str:
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.repo_path)
+        return os.path.normpath(path).replace(os.sep, "/")
+
+    def _absolute(self, rel_path: str) -> str:
+        return os.path.join(self.repo_path, *rel_path.split("/"))
+
+    def _describe(self, rel_path: str, stat: os.stat_result) -> Dict:
+        language = LANGUAGES.get(os.path.splitext(rel_path)[1].lower(), "Other")
+        summary = ""
+        if stat.st_size <= MAX_SUMMARY_BYTES:
+            try:
+                with open(self._absolute(rel_path), encoding="utf-8") as f:
+                    summary = summarize_file(rel_path, f.read())
+            except (OSError, UnicodeDecodeError):
+                summary = "binary file"
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "language": language, "summary": summary}
+
+    def directories(self) -> Dict[str, Dict]:
+        """Per-directory rollup (including subdirectories).
+
+        Returns:
+            Directory path ("" for the root) -> file count, bytes and languages
+        """
+        rollup: Dict[str, Dict] = {}
+        for rel_path, entry in self.files.items():
+            parts = rel_path.split("/")[:-1]
+            for depth in range(len(parts) + 1):
+                directory = "/".join(parts[:depth])
+                stats = rollup.setdefault(directory, {"files": 0, "bytes": 0, "languages": Counter()})
+                stats["files"] += 1
+                stats["bytes"] += entry["size"]
+                if entry["language"] != "Other":
+                    stats["languages"][entry["language"]] += 1
+        return rollup
+
+    def _directory_line(self, directory: str, stats: Dict, indent: str) -> str:
+        languages = ", ".join(name for name, _ in stats["languages"].most_common(3))
+        name = directory.rsplit("/", 1)[-1] + "/" if directory else "./"
+        return f"{indent}{name} ({stats['files']} files, {_format_size(stats['bytes'])}{'; ' + languages if languages else ''})"
+
+    def render(self, max_chars: int = 4000) -> str:
+        """Render the map as an indented file tree with summaries.
+
+        If the full tree doesn't fit, directories deeper than the top levels
+        are shown as rollups only.
+
+        Args:
+            max_chars: Size limit of the rendering
+
+        Returns:
+            The overview text
+        """
+        if not self.files:
+            return "The repository is empty."
+        rollup = self.directories()
+        for max_file_depth in (None, 2, 1, 0):
+            text = self._render(rollup, max_file_depth)
+            if len(text) <= max_chars:
+                return text
+        return text[:max_chars - 20].rsplit("\n", 1)[0] + "\n... (truncated)"
+
+    def _render(self, rollup: Dict[str, Dict], max_file_depth: Optional[int]) -> str:
+        lines = [self._directory_line("", rollup[""], "")]
+        files_by_dir: Dict[str, List[str]] = {}
+        for rel_path in self.files:
+            files_by_dir.setdefault(rel_path.rsplit("/", 1)[0] if "/" in rel_path else "", []).append(rel_path)
+        subdirs: Dict[str, List[str]] = {}
+        for directory in rollup:
+            if directory:
+                subdirs.setdefault(directory.rsplit("/", 1)[0] if "/" in directory else "", []).append(directory)
+
+        def visit(directory: str, depth: int):
+            indent = "  " * (depth + 1)
+            if max_file_depth is None or depth <= max_file_depth:
+                for rel_path in sorted(files_by_dir.get(directory, [])):
+                    entry = self.files[rel_path]
+                    lines.append(f"{indent}{rel_path.rsplit('/', 1)[-1]} ({_format_size(entry['size'])}): {entry['summary']}")
+            for child in sorted(subdirs.get(directory, [])):
+                lines.append(self._directory_line(child, rollup[child], indent))
+                if max_file_depth is None or depth < max_file_depth:
+                    visit(child, depth + 1)
+
+        visit("", 0)
+        return "\n".join(lines)
+
+    def describe_files(self, extension: str, limit: int = 20) -> str:
+        """Summaries of the files with an extension, largest first.
+
+        Args:
+            extension: File extension such as ".py"
+            limit: Maximum number of files listed
+
+        Returns:
+            One line per file, or an empty string if there are none
+        """
+        extension = extension.lower()
+        if not extension:
+            return ""
+        matches = [(rel_path, entry) for rel_path, entry in self.files.items() if rel_path.lower().endswith(extension)]
+        matches.sort(key=lambda item: -item[1]["size"])
+        return "\n".join(
+            f"{rel_path} ({_format_size(entry['size'])}): {entry['summary']}" for rel_path, entry in matches[:limit]
+        )
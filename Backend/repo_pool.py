@@ -0,0 +1,130 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from agents import VCSIntegrator
+from metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# Seconds a path that is not a git repository is remembered as such
+RETRY_INTERVAL = float(os.getenv("REPO_POOL_RETRY_INTERVAL", "30"))
+
+
+class RepoPool:
+    """Pool of warm VCSIntegrator instances, one per repository.
+
+    Each integrator keeps its GitPython ``Repo`` open, so the persistent
+    ``git cat-file`` processes GitPython starts on first object access are
+    reused across requests instead of being spawned per call. Access to a
+    repository is serialized with a per-repository lock. A path that isn't a
+    repository is only opened again after the retry interval.
+    """
+
+    def __init__(self, retry_interval: Optional[float] = None):
+        """Initialize an empty pool.
+
+        Args:
+            retry_interval: Seconds before a path that isn't a repository is
+                opened again. Defaults to REPO_POOL_RETRY_INTERVAL (30).
+        """
+        self.retry_interval = RETRY_INTERVAL if retry_interval is None else retry_interval
+        self._integrators: Dict[str, VCSIntegrator] = {}
+        # When each pooled integrator without a repository was created
+        self._missing_since: Dict[str, float] = {}
+        self._locks: Dict[str, threading.RLock] = {}
+        self._pool_lock = threading.Lock()
+
+    def _key(self, repo_path: str) -> str:
+        return os.path.realpath(repo_path)
+
+    def get(self, repo_path: str) -> VCSIntegrator:
+        """Get the warm integrator for a repository, creating it on first use.
+
+        Callers that touch the repository must hold the lock from ``acquire``.
+
+        Args:
+            repo_path: Path to the repository
+
+        Returns:
+            The pooled VCS integrator
+        """
+        key = self._key(repo_path)
+        with self._pool_lock:
+            vcs = self._integrators.get(key)
+            missing_since = self._missing_since.get(key)
+            fresh = vcs is not None and (missing_since is None or time.monotonic() - missing_since < self.retry_interval)
+            record_cache("repo_pool", fresh)
+            if not fresh:
+                vcs = VCSIntegrator(repo_path=repo_path)
+                self._warm(vcs)
+                self._integrators[key] = vcs
+                if vcs.repo is None:
+                    self._missing_since[key] = time.monotonic()
+                else:
+                    self._missing_since.pop(key, None)
+                self._locks.setdefault(key, threading.RLock())
+            return vcs
+
+    @contextmanager
+    def acquire(self, repo_path: str) -> Iterator[VCSIntegrator]:
+        """Lock a repository and yield its pooled integrator.
+
+        The handle is evicted if the body raises, so a broken repository
+        (moved, re-cloned, corrupted) gets a fresh handle next time.
+
+        Args:
+            repo_path: Path to the repository
+        """
+        vcs = self.get(repo_path)
+        lock = self._locks[self._key(repo_path)]
+        with lock:
+            try:
+                yield vcs
+            except Exception:
+                self.evict(repo_path)
+                raise
+
+    def evict(self, repo_path: str):
+        """Drop and close the pooled handle for a repository.
+
+        Waits for the holder of the repository's lock, so a handle is never
+        closed while it is in use.
+
+        Args:
+            repo_path: Path to the repository
+        """
+        key = self._key(repo_path)
+        with self._pool_lock:
+            lock = self._locks.get(key)
+        if lock is None:
+            return
+        with lock:
+            with self._pool_lock:
+                vcs = self._integrators.pop(key, None)
+                self._missing_since.pop(key, None)
+            if vcs is not None and vcs.repo is not None:
+                vcs.repo.close()
+
+    def close_all(self):
+        """Close every pooled repository handle, waiting for those in use."""
+        with self._pool_lock:
+            keys = list(self._integrators)
+        for key in keys:
+            self.evict(key)
+
+    def _warm(self, vcs: VCSIntegrator):
+        """Start the persistent cat-file processes by resolving HEAD."""
+        if vcs.repo is None:
+            return
+        try:
+            vcs.repo.head.commit.hexsha
+        except Exception as e:
+            # Empty repository or unborn branch; nothing to warm yet
+            logger.debug(f"Could not warm repository {vcs.repo_path}: {e}")
+
+
+repo_pool = RepoPool()
@@ -0,0 +1,164 @@
+import os
+import gzip
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+try:
+    import orjson
+except ImportError:  # the standard library serializer is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # only gzip is offered
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Bodies smaller than this are sent uncompressed
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+JSON_CONTENT_TYPE = "application/json"
+
+
+def dumps(payload: Any) -> bytes:
+    """Serialize a payload to compact JSON, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_NON_STR_KEYS, default=str)
+    return json.dumps(payload, separators=(",", ":"), default=str).encode()
+
+
+def parse_fields(fields: Union[str, Iterable[str], None]) -> Optional[List[str]]:
+    """Field paths of a ``fields`` parameter: a comma-separated string or a list."""
+    if fields is None:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(",")
+    fields = [field.strip() for field in fields if field and field.strip()]
+    return fields or None
+
+
+def project(payload: Any, fields: Optional[List[str]]) -> Any:
+    """Keep only the selected fields of a payload.
+
+    Fields are dotted paths into nested objects, e.g. ``changes.modified_files``.
+    ``*`` matches every key of an object, so ``file_changes.*.diff`` keeps
+    only the diff of each file. Paths apply to every element of a list.
+    Selected fields missing from the payload are left out, and keys that
+    contain dots, like file paths, can only be matched with ``*``.
+
+    Args:
+        payload: Decoded JSON payload; it is not modified
+        fields: Paths to keep, or None to keep everything
+
+    Returns:
+        The projected payload
+    """
+    if not fields:
+        return payload
+    # Merged, so a whole field wins over paths into it, in either order
+    tree: Optional[Dict] = None
+    for field in fields:
+        selection: Dict = {}
+        for part in reversed(field.split(".")):
+            selection = {part: selection}
+        tree = _merge(tree, selection)
+    return _select(payload, tree)
+
+
+def _select(value: Any, tree: Dict) -> Any:
+    if not tree:
+        return value
+    if isinstance(value, list):
+        return [_select(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    selected = {}
+    for key, item in value.items():
+        subtree = _merge(tree.get(str(key)), tree.get("*"))
+        if subtree is not None:
+            selected[key] = _select(item, subtree)
+    return selected
+
+
+def _merge(a: Optional[Dict], b: Optional[Dict]) -> Optional[Dict]:
+    """Union of two selections; an empty one selects everything."""
+    if a is None or b is None:
+        return a if b is None else b
+    if not a or not b:
+        return {}
+    merged = dict(a)
+    for key, subtree in b.items():
+        merged[key] = _merge(merged.get(key), subtree)
+    return merged
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Best content coding the client accepts: "br", "gzip" or None for identity.
+
+    Args:
+        accept_encoding: Value of the Accept-Encoding request header
+    """
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+    available = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_weight = None, 0.0
+    for coding in available:
+        weight = weights.get(coding, weights.get("*", 0.0))
+        # Ties go to the earlier, better compressing coding
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=RESPONSE_GZIP_LEVEL)
+    return body
+
+
+def encode_json(payload: Any, fields: Union[str, Iterable[str], None] = None,
+                accept_encoding: Optional[str] = None) -> Tuple[bytes, Dict[str, str]]:
+    """Serialize, project and compress a JSON response body.
+
+    Args:
+        payload: Decoded JSON payload
+        fields: Field paths to keep, see project
+        accept_encoding: Value of the Accept-Encoding request header
+
+    Returns:
+        The body and the headers to send with it, besides the content type
+    """
+    return encode_body(dumps(project(payload, parse_fields(fields))), accept_encoding)
+
+
+def encode_body(body: bytes, accept_encoding: Optional[str] = None) -> Tuple[bytes, Dict[str, str]]:
+    """Compress a response body if it is large enough and the client accepts it.
+
+    Returns:
+        The body and the headers to send with it, besides the content type
+    """
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = negotiate_encoding(accept_encoding) if len(body) >= RESPONSE_COMPRESS_MIN_BYTES else None
+    if encoding is not None:
+        size = len(body)
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+        logger.debug(f"Compressed a {size} byte response to {len(body)} bytes with {encoding}")
+    return body, headers
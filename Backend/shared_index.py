@@ -0,0 +1,349 @@
+import os
+import json
+import mmap
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import weakref
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from quantized_store import QuantizedVectors, VECTORS_FILE, META_FILE, as_vector_store, load_vector_store
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent builders are not serialized
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS_DIR = "segments"
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "build.lock"
+WATCH_LOCK_FILE = "watch.lock"
+ATTACH_LOCK_FILE = "attach.lock"
+MANIFEST_FILE = "segment.json"
+DOCSTORE_FILE = "docstore.json"
+KV_DATA_FILE = "docstore.bin"
+KV_OFFSETS_FILE = "docstore_offsets.json"
+
+
+class IndexSegments:
+    """Immutable index segments under one index path, shared by worker processes.
+
+    A builder writes each new index into its own segment directory and then
+    replaces the CURRENT file naming the live segment, which is atomic.
+    Workers attach to the segment CURRENT names with its vectors and node
+    texts memory-mapped read-only, so the OS page cache holds one copy for
+    all of them. Superseded segments are kept for a while so workers still
+    attached to them can finish their requests, and are never removed while
+    a worker is attaching.
+    """
+
+    def __init__(self, index_path: str, keep: Optional[int] = None):
+        """Initialize the segment set.
+
+        Args:
+            index_path: Directory holding the segments and the CURRENT pointer
+            keep: Newest segments to keep. Defaults to INDEX_SEGMENTS_KEEP (2).
+        """
+        if keep is None:
+            keep = int(os.getenv("INDEX_SEGMENTS_KEEP", "2"))
+        self.index_path = index_path
+        self.keep = max(1, keep)
+
+    def current(self) -> Optional[str]:
+        """Name of the live segment, or None before the first publish."""
+        try:
+            with open(os.path.join(self.index_path, CURRENT_FILE)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def segment_path(self, name: str) -> str:
+        return os.path.join(self.index_path, SEGMENTS_DIR, name)
+
+    def manifest(self, name: str) -> Dict:
+        with open(os.path.join(self.segment_path(name), MANIFEST_FILE)) as f:
+            return json.load(f)
+
+    def segments(self) -> List[str]:
+        """Names of the published segments, oldest first."""
+        try:
+            names = os.listdir(os.path.join(self.index_path, SEGMENTS_DIR))
+        except FileNotFoundError:
+            return []
+        return sorted(name for name in names if not name.endswith(".tmp"))
+
+    @contextmanager
+    def build_lock(self) -> Iterator[None]:
+        """Hold the lock that lets one process at a time build and publish segments."""
+        os.makedirs(self.index_path, exist_ok=True)
+        with open(os.path.join(self.index_path, LOCK_FILE), "a") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                # Segments left half-written by a builder that died
+                segments_dir = os.path.join(self.index_path, SEGMENTS_DIR)
+                if os.path.isdir(segments_dir):
+                    for name in os.listdir(segments_dir):
+                        if name.endswith(".tmp"):
+                            shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def reading(self) -> Iterator[None]:
+        """Keep prune from removing segments while one is looked up and attached.
+
+        Shared between readers; prune waits for them, and they for prune's
+        removals, but not for builds.
+        """
+        with self._attach_lock(fcntl.LOCK_SH if fcntl is not None else None):
+            yield
+
+    @contextmanager
+    def _attach_lock(self, operation: Optional[int]) -> Iterator[None]:
+        os.makedirs(self.index_path, exist_ok=True)
+        with open(os.path.join(self.index_path, ATTACH_LOCK_FILE), "a") as f:
+            if operation is not None:
+                fcntl.flock(f.fileno(), operation)
+            try:
+                yield
+            finally:
+                if operation is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def try_watch_lock(self) -> Optional[Any]:
+        """Claim the right to watch the repository and publish its updates, without waiting.
+
+        Returns:
+            An open file holding the lock until it is closed or the process
+            exits, or None if another process holds it
+        """
+        os.makedirs(self.index_path, exist_ok=True)
+        f = open(os.path.join(self.index_path, WATCH_LOCK_FILE), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return None
+        return f
+
+    def publish(self, write: Callable[[str], Dict]) -> str:
+        """Write a new segment and make it the live one. Call with build_lock held.
+
+        Args:
+            write: Writes the segment into the directory it is given and
+                returns manifest entries
+
+        Returns:
+            Name of the new segment
+        """
+        # Names sort by publish time
+        now = time.time_ns()
+        name = f"{time.strftime('%Y%m%dT%H%M%S', time.gmtime(now // 10**9))}.{now % 10**9:09d}"
+        path = self.segment_path(name)
+        temp_path = path + ".tmp"
+        os.makedirs(temp_path)
+        manifest = dict(write(temp_path) or {}, name=name, created=time.time())
+        with open(os.path.join(temp_path, MANIFEST_FILE), "w") as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, path)
+        current_path = os.path.join(self.index_path, CURRENT_FILE)
+        with open(current_path + ".tmp", "w") as f:
+            f.write(name)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(current_path + ".tmp", current_path)
+        logger.info(f"Published index segment {name} in {self.index_path}")
+        self.prune()
+        return name
+
+    def prune(self):
+        """Remove all but the newest ``keep`` segments, never the live one.
+
+        Waits for workers attaching inside ``reading``, so a segment is never
+        removed between a worker reading CURRENT and mapping its files.
+        """
+        with self._attach_lock(fcntl.LOCK_EX if fcntl is not None else None):
+            current = self.current()
+            for name in self.segments()[:-self.keep]:
+                if name != current:
+                    # Workers attached to it map every file they read at attach time, and
+                    # mapped files stay readable after removal until the workers detach
+                    shutil.rmtree(self.segment_path(name), ignore_errors=True)
+
+
+def write_segment(index: Any, directory: str) -> Dict:
+    """Persist a llama_index index as a segment that workers can map read-only.
+
+    Only indexes kept in llama_index's SimpleVectorStore or in a quantized
+    store are supported. Vectors of a SimpleVectorStore are converted into a
+    float32 file, and the docstore into a file of JSON records with an
+    offset table.
+
+    Returns:
+        Manifest entries: node count and text size
+    """
+    from llama_index.core.vector_stores.simple import SimpleVectorStore
+
+    vector_store = index.vector_store
+    quantized = isinstance(getattr(vector_store, "client", None), QuantizedVectors)
+    if not quantized and not isinstance(vector_store, SimpleVectorStore):
+        raise ValueError(f"Can't write an index kept in a {vector_store.class_name()} as a shared segment")
+    index.storage_context.persist(persist_dir=directory)
+    if not quantized:
+        data = vector_store.data
+        ids = list(data.embedding_dict)
+        vectors = QuantizedVectors("float32", vectors_path=os.path.join(directory, VECTORS_FILE))
+        vectors.add(ids, [data.embedding_dict[node_id] for node_id in ids],
+                    [data.text_id_to_ref_doc_id.get(node_id) for node_id in ids])
+        vectors.save(directory)
+        os.remove(os.path.join(directory, "default__vector_store.json"))
+
+    docstore_path = os.path.join(directory, DOCSTORE_FILE)
+    with open(docstore_path) as f:
+        collections = json.load(f)
+    offsets: Dict[str, Dict[str, List[int]]] = {}
+    with open(os.path.join(directory, KV_DATA_FILE), "wb") as f:
+        for collection, values in collections.items():
+            entries = offsets[collection] = {}
+            for key, value in values.items():
+                record = json.dumps(value).encode()
+                entries[key] = [f.tell(), len(record)]
+                f.write(record)
+    with open(os.path.join(directory, KV_OFFSETS_FILE), "w") as f:
+        json.dump(offsets, f)
+    os.remove(docstore_path)
+
+    docs = index.docstore.docs
+    return {"nodes": len(docs), "bytes": sum(len(node.get_content().encode()) for node in docs.values())}
+
+
+def attach_segment(directory: str, embed_model: Any = None) -> Any:
+    """Open a segment as a read-only VectorStoreIndex without loading its vectors or texts."""
+    from llama_index.core import StorageContext, load_index_from_storage
+    from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+    from llama_index.core.storage.index_store import SimpleIndexStore
+
+    storage_context = StorageContext.from_defaults(
+        docstore=KVDocumentStore(_kv_store_class()(directory)),
+        index_store=SimpleIndexStore.from_persist_dir(directory),
+        vector_store=load_vector_store(directory, read_only=True),
+    )
+    return load_index_from_storage(storage_context, embed_model=embed_model)
+
+
+def open_segment(directory: str, embed_model: Any = None) -> Any:
+    """A private, writable copy of a segment's index, to update and publish as a new segment.
+
+    The vectors are copied to a temporary directory removed with the index;
+    the docstore is read into memory.
+    """
+    from llama_index.core import StorageContext, load_index_from_storage
+    from llama_index.core.storage.docstore import SimpleDocumentStore
+    from llama_index.core.storage.index_store import SimpleIndexStore
+    from llama_index.core.storage.kvstore import SimpleKVStore
+
+    working_dir = tempfile.mkdtemp(prefix="cursor_segment_")
+    for name in os.listdir(directory):
+        if name == META_FILE or name.startswith("quantized_"):
+            shutil.copyfile(os.path.join(directory, name), os.path.join(working_dir, name))
+    vectors = QuantizedVectors.load(working_dir)
+    weakref.finalize(vectors, shutil.rmtree, working_dir, True)
+    segment_kv = _kv_store_class()(directory)
+    data = {collection: segment_kv.get_all(collection) for collection in segment_kv.collections()}
+    storage_context = StorageContext.from_defaults(
+        docstore=SimpleDocumentStore(simple_kvstore=SimpleKVStore(data)),
+        index_store=SimpleIndexStore.from_persist_dir(directory),
+        vector_store=as_vector_store(vectors),
+    )
+    return load_index_from_storage(storage_context, embed_model=embed_model)
+
+
+_KV_STORE_CLASS = None
+
+
+def _kv_store_class():
+    global _KV_STORE_CLASS
+    if _KV_STORE_CLASS is None:
+        _KV_STORE_CLASS = _build_kv_store_class()
+    return _KV_STORE_CLASS
+
+
+def _build_kv_store_class():
+    from llama_index.core.storage.kvstore.types import DEFAULT_COLLECTION, BaseKVStore
+
+    class SegmentKVStore(BaseKVStore):
+        """Read-only key-value store over a segment's memory-mapped records."""
+
+        def __init__(self, directory: str):
+            with open(os.path.join(directory, KV_OFFSETS_FILE)) as f:
+                self._offsets: Dict[str, Dict[str, List[int]]] = json.load(f)
+            path = os.path.join(directory, KV_DATA_FILE)
+            self._data = b""
+            if os.path.getsize(path):
+                with open(path, "rb") as f:
+                    self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+            entry = self._offsets.get(collection, {}).get(key)
+            if entry is None:
+                return None
+            offset, length = entry
+            return json.loads(self._data[offset:offset + length])
+
+        async def aget(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+            return self.get(key, collection)
+
+        def collections(self) -> List[str]:
+            return list(self._offsets)
+
+        def get_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+            return {key: self.get(key, collection) for key in self._offsets.get(collection, {})}
+
+        async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> Dict[str, dict]:
+            return self.get_all(collection)
+
+        def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+            raise RuntimeError("Shared index segments are read-only")
+
+        async def aput(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+            self.put(key, val, collection)
+
+        def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+            raise RuntimeError("Shared index segments are read-only")
+
+        async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+            return self.delete(key, collection)
+
+    return SegmentKVStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an index and publish it as the live shared segment")
+    parser.add_argument("repo_path", help="Repository to index")
+    parser.add_argument("index_path", help="Shared index directory the workers attach to")
+    parser.add_argument("--rev", help="Commit or branch to index from git instead of the working tree")
+    args = parser.parse_args()
+
+    from agents import KnowledgeBuilder
+    from git_ingest import create_ingestor
+
+    builder = KnowledgeBuilder()
+    ingestor = create_ingestor(args.repo_path, args.rev)
+    with IndexSegments(args.index_path).build_lock():
+        nodes = ingestor.ingest()
+        index = builder.build_index(nodes, checkpoint_path=KnowledgeBuilder.checkpoint_path(args.index_path))
+        ingestor.record(nodes)
+        print(builder.publish_index(index, args.index_path))
+
+
+if __name__ == "__main__":
+    main()
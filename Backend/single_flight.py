@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+from metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    The first caller of a key runs the work; callers arriving while it is
+    in flight wait for it and get the same result, or the same exception.
+    Nothing is cached once the call completes, so a later call runs again.
+    Threads (``do``) and coroutines (``ado``) share the in-flight calls, so
+    either kind of caller can attach to a run started by the other.
+    """
+
+    def __init__(self, name: str):
+        """Initialize the group.
+
+        Args:
+            name: Name the coalesced calls are counted under in the cache metrics
+        """
+        self.name = name
+        self._calls: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable) -> Tuple[Future, bool]:
+        """The in-flight call of a key, and whether the caller has to run it."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        record_cache(self.name, not leader)
+        if not leader:
+            logger.info(f"Attaching to the in-flight {self.name} call")
+        return future, leader
+
+    def _finish(self, key: Hashable, future: Future, result: Any = None, error: BaseException = None):
+        with self._lock:
+            self._calls.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def in_flight(self) -> int:
+        """Number of calls currently running."""
+        with self._lock:
+            return len(self._calls)
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        """Run fn, or wait for the call of the same key already running.
+
+        Args:
+            key: Identifies duplicate calls
+            fn: Work to run when no call of the key is in flight
+
+        Returns:
+            The result of fn, from this call or the one joined
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._finish(key, future, error=e)
+            raise
+        self._finish(key, future, result)
+        return result
+
+    async def ado(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Async version of do.
+
+        Args:
+            key: Identifies duplicate calls
+            fn: Returns the coroutine to await when no call of the key is in flight
+
+        Returns:
+            The result of the coroutine, from this call or the one joined
+        """
+        future, leader = self._join(key)
+        if leader:
+            # Run as a task of its own, so cancelling the caller that started it doesn't cancel it for the others
+            task = asyncio.ensure_future(fn())
+            task.add_done_callback(lambda task: self._settle(key, future, task))
+        # Shielded so a caller that is cancelled doesn't cancel the shared call
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    def _settle(self, key: Hashable, future: Future, task: "asyncio.Task"):
+        if task.cancelled():
+            self._finish(key, future, error=asyncio.CancelledError())
+        elif task.exception() is not None:
+            self._finish(key, future, error=task.exception())
+        else:
+            self._finish(key, future, task.result())
@@ -0,0 +1,63 @@
+import os
+import time
+
+import pytest
+
+from blob_store import BlobStore, blob_hashes
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / "blobs"))
+
+
+def age(store, blob_hash, seconds):
+    then = time.time() - seconds
+    os.utime(store.path(blob_hash), (then, then))
+
+
+def test_put_stores_each_content_once(store):
+    first = store.put("print('hi')\n")
+    assert store.put("print('hi')\n") == first == BlobStore.hash("print('hi')\n")
+    assert store.get(first) == "print('hi')\n"
+    assert store.exists(first)
+    assert sum(len(names) for _, _, names in os.walk(store.root)) == 1
+
+
+def test_unknown_and_malformed_hashes_read_as_missing(store):
+    assert store.get(BlobStore.hash("never stored")) is None
+    assert store.get(None) is None and store.get("../../etc/passwd") is None
+    assert not store.exists("not-a-hash")
+    with pytest.raises(ValueError):
+        store.path("../escape")
+
+
+def test_collect_removes_only_old_unreferenced_blobs(store):
+    kept, dropped, recent = store.put("kept"), store.put("dropped"), store.put("recent")
+    age(store, kept, 7200)
+    age(store, dropped, 7200)
+    assert store.collect({kept}, min_age=3600) == 1
+    assert store.exists(kept) and store.exists(recent)
+    assert not store.exists(dropped)
+
+
+def test_storing_a_blob_again_refreshes_its_age(store):
+    blob_hash = store.put("content")
+    age(store, blob_hash, 7200)
+    store.put("content")
+    assert store.collect(set(), min_age=3600) == 0
+    assert store.exists(blob_hash)
+
+
+def test_collect_on_an_empty_store(store):
+    assert store.collect(set()) == 0
+
+
+def test_blob_hashes_finds_hash_keys_at_any_depth():
+    a, b = BlobStore.hash("a"), BlobStore.hash("b")
+    result = {
+        "changes": {"file_changes": {"x.py": {"original_hash": a, "modified_hash": b, "diff": a}}},
+        "items": [{"modified_hash": b}, {"modified_hash": "not a hash"}],
+        "original_hash": None,
+    }
+    assert sorted(blob_hashes(result)) == sorted([a, b, b])
@@ -0,0 +1,64 @@
+import re
+import shutil
+
+import pytest
+
+from diff_engine import DiffEngine
+
+needs_git = pytest.mark.skipif(shutil.which("git") is None, reason="git is not installed")
+
+BASE = "".join(f"line {i}\n" for i in range(20))
+
+CASES = {
+    "changed line": (BASE, BASE.replace("line 10\n", "line ten\n")),
+    "added lines": (BASE, BASE.replace("line 5\n", "line 5\nnew a\nnew b\n")),
+    "removed lines": (BASE, BASE.replace("line 3\nline 4\n", "")),
+    "two hunks": (BASE, BASE.replace("line 1\n", "one\n").replace("line 18\n", "eighteen\n")),
+    "new file": ("", "a\nb\n"),
+    "deleted file": ("a\nb\n", ""),
+    "newline added at end": ("a\nb", "a\nb\n"),
+    "newline removed at end": ("a\nb\n", "a\nb"),
+    "last line changed without newline": ("a\nb", "a\nc"),
+    "carriage returns are content": ("a\r\nb\n", "a\nb\n"),
+}
+
+
+def without_headings(diff):
+    # git appends the enclosing function to hunk headers; difflib doesn't
+    return re.sub(r"^(@@ [^@]+ @@).*$", r"\1", diff, flags=re.MULTILINE)
+
+
+@needs_git
+@pytest.mark.parametrize("name", CASES)
+def test_difflib_and_git_produce_the_same_diff(name):
+    original, modified = CASES[name]
+    engine = DiffEngine()
+    expected = engine._git_diff(original, modified, "pkg/file.py")
+    assert expected.startswith("--- a/pkg/file.py\n+++ b/pkg/file.py\n@@")
+    assert engine._difflib_diff(original, modified, "pkg/file.py") == without_headings(expected)
+
+
+def test_a_trailing_newline_change_is_not_an_empty_diff():
+    diff = DiffEngine()._difflib_diff("a\nb", "a\nb\n", "f.txt")
+    assert diff.splitlines()[-3:] == ["-b", "\\ No newline at end of file", "+b"]
+
+
+def test_identical_contents_have_no_diff():
+    assert DiffEngine().unified_diff(BASE, BASE, "f.py") == ""
+    assert DiffEngine().unified_diff(None, "", "f.py") == ""
+
+
+@needs_git
+def test_large_inputs_use_git_and_huge_ones_are_summarized():
+    original, modified = CASES["two hunks"]
+    engine = DiffEngine(fast_threshold=10, summary_threshold=10 ** 6)
+    assert "@@ -1,5 +1,5 @@" in engine.unified_diff(original, modified, "f.py")
+    summary = DiffEngine(fast_threshold=10, summary_threshold=20).unified_diff(original, modified, "f.py")
+    assert summary.splitlines()[-1].startswith("@@ summary: +2 -2 lines")
+
+
+def test_summaries_count_lines_without_git(monkeypatch):
+    engine = DiffEngine()
+    monkeypatch.setattr(engine, "git_executable", None)
+    original, modified = CASES["added lines"]
+    assert "+2 -0 lines" in engine.unified_diff(original, modified, "f.py", summary_only=True)
@@ -0,0 +1,54 @@
+import time
+
+from index_watcher import IndexWatcher
+
+
+class FakeSystem:
+    """An agent system with a private index updated in memory."""
+
+    def __init__(self, repo_path):
+        self.repo_path = str(repo_path)
+        self.index_path = str(repo_path) + ".index"
+        self.segments = None
+        self.watched = False
+        self.index_unsaved = False
+        self.updates = []
+        self.saves = 0
+
+    def update_index(self, paths):
+        self.updates.append(paths)
+        self.index_unsaved = True
+
+    def persist_index(self):
+        if not self.index_unsaved:
+            return False
+        self.index_unsaved = False
+        self.saves += 1
+        return True
+
+
+def test_updates_are_batched_and_saved_once_per_persist_interval(tmp_path):
+    (tmp_path / "a.py").write_text("a = 1\n")
+    watcher = IndexWatcher(debounce=0, poll_interval=60, persist_interval=60)
+    system = FakeSystem(tmp_path)
+    watcher.register(system)
+    watcher.notify(system.repo_path, ["a.py", str(tmp_path / "b.py")])
+    for repo_path in watcher._due(time.monotonic()):
+        watcher._update(repo_path)
+    watcher.notify(system.repo_path, ["a.py"])
+    for repo_path in watcher._due(time.monotonic()):
+        watcher._update(repo_path)
+    assert system.updates == [["a.py", "b.py"], ["a.py"]]
+    assert system.saves == 0
+    watcher.stop()
+    assert system.saves == 1 and not system.index_unsaved
+
+
+def test_ignored_paths_are_not_queued(tmp_path):
+    watcher = IndexWatcher(debounce=0, poll_interval=60)
+    system = FakeSystem(tmp_path)
+    watcher.register(system)
+    watcher.notify(system.repo_path, [".git/HEAD", "node_modules/x.js", "../outside.py"])
+    assert watcher._due(time.monotonic()) == []
+    watcher.unregister(system.repo_path)
+    assert not system.watched
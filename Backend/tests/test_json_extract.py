@@ -0,0 +1,95 @@
+import json
+import random
+
+import pytest
+
+from json_extract import extract_json, repair_json
+
+
+def random_value(rng: random.Random, depth: int = 0):
+    """A random JSON value shaped like a plan: nested objects, lists, code-like strings."""
+    kind = rng.choice(["object", "list", "string", "number", "literal"] if depth < 3 else ["string", "number", "literal"])
+    if kind == "object":
+        return {f"key_{i}": random_value(rng, depth + 1) for i in range(rng.randint(0, 4))}
+    if kind == "list":
+        return [random_value(rng, depth + 1) for _ in range(rng.randint(0, 4))]
+    if kind == "string":
+        return "".join(rng.choice('ab \n\t"\\/{}[],:\'x') for _ in range(rng.randint(0, 12)))
+    if kind == "number":
+        return rng.choice([0, -3, 42, 1.5, -0.25, 1e-7, 123456789])
+    return rng.choice([True, False, None])
+
+
+def sloppy_dumps(value) -> str:
+    """Serialize with a trailing comma after every non-empty object and array."""
+    if isinstance(value, dict):
+        return "{" + "".join(f"{json.dumps(k)}: {sloppy_dumps(v)}," for k, v in value.items()) + "}"
+    if isinstance(value, list):
+        return "[" + "".join(f"{sloppy_dumps(v)}," for v in value) + "]"
+    return json.dumps(value)
+
+
+def documents(count: int, seed: int):
+    rng = random.Random(seed)
+    for _ in range(count):
+        value = {"plan": random_value(rng)} if rng.random() < 0.8 else [random_value(rng)]
+        yield value, json.dumps(value, indent=rng.choice([None, 2]))
+
+
+@pytest.mark.parametrize("value,text", list(documents(200, seed=1)))
+def test_valid_json_round_trips(value, text):
+    assert extract_json(text) == value
+    assert json.loads(repair_json(text)) == value
+
+
+@pytest.mark.parametrize("value,text", list(documents(40, seed=2)))
+def test_every_prefix_parses_or_fails_cleanly(value, text):
+    for cut in range(1, len(text) + 1):
+        try:
+            parsed = extract_json(text[:cut])
+        except ValueError:
+            continue
+        assert isinstance(parsed, type(value)), text[:cut]
+
+
+@pytest.mark.parametrize("value,text", list(documents(100, seed=3)))
+def test_fences_prose_and_trailing_commas(value, text):
+    wrapped = f"Here is the plan:\n```json\n{sloppy_dumps(value)}\n```\nHope this helps."
+    assert extract_json(wrapped) == value
+
+
+@pytest.mark.parametrize("text,expected", [
+    ('{"k": 1.}', {"k": 1.0}),
+    ('{"k": .5}', {"k": 0.5}),
+    ('{"k": 1.5e}', {"k": 1.5}),
+    ('{"k": 007}', {"k": 7}),
+    ('{"k": +2}', {"k": 2}),
+    ('{"k": "value" "j": 2}', {"k": "value", "j": 2}),
+    ('{"k": "value"\n"j": 2}', {"k": "value", "j": 2}),
+    ('{"k": 1 "j": 2}', {"k": 1, "j": 2}),
+    ('[1 2 3]', [1, 2, 3]),
+    ('{"k": "He said "hi" there"}', {"k": 'He said "hi" there'}),
+    ("{'k': True, 'j': None}", {"k": True, "j": None}),
+    ('{"pattern": "\\d+"}', {"pattern": "\\d+"}),
+    ('{"code": "line one\nline two"}', {"code": "line one\nline two"}),
+])
+def test_repairs(text, expected):
+    assert extract_json(text) == expected
+
+
+@pytest.mark.parametrize("text,expected", [
+    ('{"a": 12', {"a": 12}),
+    ('{"a": 1.', {"a": 1}),
+    ('{"a": 1e', {"a": 1}),
+    ('{"a": -', {}),
+    ('{"a": "unfinished', {"a": "unfinished"}),
+    ('{"a": 1, "b', {"a": 1}),
+    ('[1, [2, 3', [1, [2, 3]]),
+])
+def test_truncated_documents_close_at_last_complete_token(text, expected):
+    assert extract_json(text) == expected
+
+
+def test_no_json_raises_value_error():
+    with pytest.raises(ValueError):
+        extract_json("No JSON here, see [DOC 3].")
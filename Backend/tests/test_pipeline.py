@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from pipeline import TaskGraph
+
+
+def run(main):
+    return asyncio.run(main())
+
+
+def test_tasks_get_their_dependencies_results_and_run_in_parallel():
+    order = []
+
+    async def main():
+        graph = TaskGraph()
+
+        async def leaf(name, delay):
+            order.append(f"{name} start")
+            await asyncio.sleep(delay)
+            order.append(f"{name} end")
+            return name
+
+        graph.add("slow", lambda: leaf("slow", 0.05))
+        graph.add("fast", lambda: leaf("fast", 0.01))
+
+        async def combine(slow, fast):
+            return slow + "+" + fast
+
+        graph.add("both", combine, deps=["slow", "fast"])
+        await graph.join()
+        return await graph.result("both"), graph
+
+    result, graph = run(main)
+    assert result == "slow+fast"
+    assert order[:2] == ["slow start", "fast start"]
+    assert graph.critical_path() == ["slow", "both"]
+    assert set(graph.summary()["tasks"]) == {"slow", "fast", "both"}
+
+
+def test_join_waits_for_tasks_added_while_running():
+    async def main():
+        graph = TaskGraph()
+
+        async def plan():
+            await asyncio.sleep(0)
+            for name in ("a.py", "b.py"):
+                graph.add(f"edit:{name}", lambda name=name: asyncio.sleep(0.01, result=name), deps=["plan"])
+            return ["a.py", "b.py"]
+
+        graph.add("plan", plan)
+        await graph.join()
+        return graph
+
+    graph = run(main)
+    assert "edit:a.py" in graph and "edit:b.py" in graph
+    assert set(graph.timings) == {"plan", "edit:a.py", "edit:b.py"}
+
+
+def test_duplicate_and_unknown_tasks_are_refused():
+    async def main():
+        graph = TaskGraph()
+        graph.add("a", lambda: asyncio.sleep(0))
+        with pytest.raises(ValueError):
+            graph.add("a", lambda: asyncio.sleep(0))
+        with pytest.raises(ValueError):
+            graph.add("b", lambda _: asyncio.sleep(0), deps=["missing"])
+        await graph.join()
+
+    run(main)
+
+
+def test_a_failure_cancels_the_other_tasks():
+    async def main():
+        graph = TaskGraph()
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        graph.add("fail", fail)
+        slow = graph.add("slow", lambda: asyncio.sleep(10))
+        with pytest.raises(RuntimeError):
+            await graph.join()
+        return slow
+
+    slow = run(main)
+    assert slow.cancelled()
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from quantized_store import QuantizedVectors
+
+
+def vectors(count, dim=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+@pytest.fixture(params=["float32", "int8"])
+def store(request, tmp_path):
+    store = QuantizedVectors(request.param, vectors_path=str(tmp_path / "vectors.f32"))
+    data = vectors(6)
+    store.add([f"n{i}" for i in range(6)], data, ["a", "a", "b", "b", "c", "c"])
+    return store, data
+
+
+def test_a_copy_changes_without_changing_the_original(store):
+    store, data = store
+    copy = store.copy()
+    copy.delete("a")
+    copy.add(["n6"], data[:1], ["d"])
+    assert store.search(data[0], 1)[0] == ["n0"]
+    assert copy.search(data[0], 1)[0] == ["n6"]
+    assert len(store) == 6 and not store.deleted.any()
+
+
+def test_a_dropped_copy_leaves_no_rows_behind(store):
+    store, data = store
+    store.copy().add(["dropped"], vectors(3, seed=1)[:1], ["x"])
+    copy = store.copy()
+    copy.add(["n6"], data[2:3], ["d"])
+    ids, scores = copy.search(data[2], 2)
+    assert set(ids) == {"n2", "n6"}
+    assert scores[0] == pytest.approx(1, abs=1e-5) and scores[1] == pytest.approx(1, abs=1e-5)
+
+
+def test_saving_a_copy_keeps_the_original_readable(store, tmp_path):
+    store, data = store
+    store.save(str(tmp_path / "saved"))
+    loaded = QuantizedVectors.load(str(tmp_path / "saved"))
+    copy = loaded.copy()
+    copy.add(["n6"], data[:1], ["d"])
+    copy.save(str(tmp_path / "saved"))
+    assert loaded.search(data[5], 1)[0] == ["n5"]
+    assert len(QuantizedVectors.load(str(tmp_path / "saved"))) == 7
+
+
+def test_deletes_past_the_threshold_compact_the_store(store, monkeypatch):
+    store, data = store
+    monkeypatch.setattr("quantized_store.COMPACT_THRESHOLD", 0.5)
+    store.delete("a")
+    assert len(store) == 6
+    original = store.copy()
+    store.delete("b")
+    assert store.ids == ["n4", "n5"] and store.ref_doc_ids == ["c", "c"]
+    assert not store.deleted.any()
+    assert store.search(data[4], 1) == (["n4"], [pytest.approx(1, abs=1e-5)])
+    # The compacted store moved to a file of its own
+    assert original.search(data[3], 1)[0] == ["n3"]
+    store.add(["n6"], data[:1], ["d"])
+    assert store.search(data[0], 1)[0] == ["n6"]
+
+
+def test_a_compacted_store_saves_and_reloads(store, tmp_path):
+    store, data = store
+    store.delete("a")
+    store.compact()
+    store.save(str(tmp_path / "saved"))
+    loaded = QuantizedVectors.load(str(tmp_path / "saved"))
+    assert loaded.ids == ["n2", "n3", "n4", "n5"]
+    assert loaded.search(data[3], 1)[0] == ["n3"]
+
+
+def test_pq_compaction_retrains_untrained_codes(tmp_path):
+    store = QuantizedVectors("pq", pq_subvectors=2, vectors_path=str(tmp_path / "vectors.f32"))
+    data = vectors(300, seed=2)
+    store.add([f"n{i}" for i in range(300)], data, [f"d{i % 3}" for i in range(300)])
+    store.search(data[0], 1)
+    store.add([f"m{i}" for i in range(300)], data, ["e"] * 300)
+    store.delete("e")
+    store.compact()
+    assert len(store) == 300 and store.search(data[7], 1)[0] == ["n7"]
@@ -0,0 +1,80 @@
+import gzip
+import json
+
+import pytest
+
+import responses
+from responses import encode_json, negotiate_encoding, parse_fields, project
+
+PAYLOAD = {
+    "change_id": "c1",
+    "changes": {
+        "modified_files": ["a.py"],
+        "file_changes": {
+            "pkg/a.py": {"diff": "-a\n+b\n", "original_hash": "h1", "modified_hash": "h2"},
+            "pkg/b.py": {"diff": "+c\n", "original_hash": None, "modified_hash": "h3"},
+        },
+    },
+    "tests": [{"name": "t1", "passed": True}, {"name": "t2", "passed": False}],
+}
+
+
+def test_no_fields_keep_everything():
+    assert project(PAYLOAD, None) is PAYLOAD
+    assert project(PAYLOAD, []) is PAYLOAD
+
+
+def test_dotted_paths_select_nested_fields():
+    assert project(PAYLOAD, ["change_id", "changes.modified_files"]) == {
+        "change_id": "c1",
+        "changes": {"modified_files": ["a.py"]},
+    }
+
+
+def test_a_star_matches_keys_containing_dots():
+    assert project(PAYLOAD, ["changes.file_changes.*.diff"]) == {
+        "changes": {"file_changes": {"pkg/a.py": {"diff": "-a\n+b\n"}, "pkg/b.py": {"diff": "+c\n"}}},
+    }
+
+
+def test_paths_apply_to_every_list_element():
+    assert project(PAYLOAD, ["tests.name"]) == {"tests": [{"name": "t1"}, {"name": "t2"}]}
+
+
+@pytest.mark.parametrize("fields", [["changes", "changes.modified_files"], ["changes.modified_files", "changes"]])
+def test_a_whole_field_wins_over_paths_into_it(fields):
+    assert project(PAYLOAD, fields) == {"changes": PAYLOAD["changes"]}
+
+
+def test_a_star_and_a_named_key_are_combined():
+    projected = project(PAYLOAD, ["changes.file_changes.*.diff", "changes.file_changes.pkg/a.py"])
+    assert projected["changes"]["file_changes"]["pkg/b.py"] == {"diff": "+c\n"}
+
+
+def test_missing_fields_are_left_out_and_the_payload_is_not_modified():
+    before = json.dumps(PAYLOAD, sort_keys=True)
+    assert project(PAYLOAD, ["nothing", "change_id.deeper"]) == {"change_id": "c1"}
+    assert json.dumps(PAYLOAD, sort_keys=True) == before
+
+
+def test_parse_fields_accepts_strings_and_lists():
+    assert parse_fields(" a, b.c ,,") == ["a", "b.c"]
+    assert parse_fields(["a", " "]) == ["a"]
+    assert parse_fields("") is None and parse_fields(None) is None
+
+
+def test_negotiate_encoding_respects_weights():
+    assert negotiate_encoding(None) is None
+    assert negotiate_encoding("gzip;q=0, identity") is None
+    assert negotiate_encoding("gzip, deflate") == "gzip"
+    assert negotiate_encoding("*") == ("br" if responses.brotli is not None else "gzip")
+
+
+def test_encode_json_compresses_large_bodies_only(monkeypatch):
+    monkeypatch.setattr(responses, "RESPONSE_COMPRESS_MIN_BYTES", 64)
+    body, headers = encode_json({"a": 1}, accept_encoding="gzip")
+    assert json.loads(body) == {"a": 1} and "Content-Encoding" not in headers
+    payload = {"text": "x" * 1000, "other": 1}
+    body, headers = encode_json(payload, fields="text", accept_encoding="gzip")
+    assert headers["Content-Encoding"] == "gzip" and headers["Vary"] == "Accept-Encoding"
+    assert json.loads(gzip.decompress(body)) == {"text": "x" * 1000}
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+
+import pytest
+
+from shared_index import IndexSegments, attach_segment, open_segment, write_segment
+
+
+def publish(segments, text="x"):
+    def write(directory):
+        with open(os.path.join(directory, "data.txt"), "w") as f:
+            f.write(text)
+        return {"nodes": 1, "bytes": len(text)}
+    with segments.build_lock():
+        return segments.publish(write)
+
+
+def test_publish_switches_current_and_prunes_old_segments(tmp_path):
+    segments = IndexSegments(str(tmp_path), keep=2)
+    assert segments.current() is None
+    names = [publish(segments, str(i)) for i in range(4)]
+    assert names == sorted(names)
+    assert segments.current() == names[-1]
+    assert segments.segments() == names[-2:]
+    assert segments.manifest(names[-1])["nodes"] == 1
+
+
+def test_prune_waits_for_workers_attaching(tmp_path):
+    segments = IndexSegments(str(tmp_path), keep=1)
+    first = publish(segments)
+    published = threading.Event()
+    with segments.reading():
+        assert segments.current() == first
+        thread = threading.Thread(target=lambda: (publish(segments), published.set()))
+        thread.start()
+        time.sleep(0.2)
+        # The new segment is live, but the one being attached is still there
+        assert not published.is_set()
+        assert os.path.isdir(segments.segment_path(first))
+    thread.join(timeout=5)
+    assert published.is_set()
+    assert not os.path.exists(segments.segment_path(first))
+
+
+def test_half_written_segments_are_removed_by_the_next_builder(tmp_path):
+    segments = IndexSegments(str(tmp_path))
+    os.makedirs(os.path.join(segments.segment_path("dead") + ".tmp"))
+    publish(segments)
+    assert not os.path.exists(segments.segment_path("dead") + ".tmp")
+
+
+def test_only_one_process_gets_the_watch_lock(tmp_path):
+    pytest.importorskip("fcntl")
+    segments = IndexSegments(str(tmp_path))
+    lock = segments.try_watch_lock()
+    assert lock is not None
+    try:
+        assert IndexSegments(str(tmp_path)).try_watch_lock() is None
+    finally:
+        lock.close()
+
+
+@pytest.fixture
+def index():
+    llama_index = pytest.importorskip("llama_index.core")
+    from llama_index.core.embeddings import MockEmbedding
+    from llama_index.core.schema import NodeRelationship, RelatedNodeInfo, TextNode
+
+    nodes = []
+    for doc_id in ("a.py", "b.py"):
+        for i in range(2):
+            node = TextNode(text=f"{doc_id} chunk {i}", id_=f"{doc_id}-{i}")
+            node.relationships[NodeRelationship.SOURCE] = RelatedNodeInfo(node_id=doc_id)
+            nodes.append(node)
+    return llama_index.VectorStoreIndex(nodes, embed_model=MockEmbedding(embed_dim=8))
+
+
+def test_a_written_segment_attaches_read_only(index, tmp_path):
+    from llama_index.core.embeddings import MockEmbedding
+
+    manifest = write_segment(index, str(tmp_path))
+    assert manifest == {"nodes": 4, "bytes": sum(len(f"{d} chunk {i}") for d in ("a.py", "b.py") for i in range(2))}
+    attached = attach_segment(str(tmp_path), embed_model=MockEmbedding(embed_dim=8))
+    retrieved = attached.as_retriever(similarity_top_k=4).retrieve("chunk")
+    assert sorted(result.node.node_id for result in retrieved) == ["a.py-0", "a.py-1", "b.py-0", "b.py-1"]
+    with pytest.raises(RuntimeError):
+        attached.delete_ref_doc("a.py", delete_from_docstore=True)
+
+
+def test_an_opened_segment_is_a_private_copy(index, tmp_path):
+    from llama_index.core.embeddings import MockEmbedding
+
+    write_segment(index, str(tmp_path))
+    opened = open_segment(str(tmp_path), embed_model=MockEmbedding(embed_dim=8))
+    opened.delete_ref_doc("a.py", delete_from_docstore=True)
+    retrieved = opened.as_retriever(similarity_top_k=4).retrieve("chunk")
+    assert sorted(result.node.node_id for result in retrieved) == ["b.py-0", "b.py-1"]
+    attached = attach_segment(str(tmp_path), embed_model=MockEmbedding(embed_dim=8))
+    assert len(attached.as_retriever(similarity_top_k=4).retrieve("chunk")) == 4
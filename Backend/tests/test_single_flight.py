@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_with_one_key_run_once():
+    flights = SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    leader = threading.Thread(target=lambda: results.append(flights.do("key", work)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flights.do("key", work))) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    time.sleep(0.1)
+    assert flights.in_flight() == 1
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+    assert calls == [1] and results == ["result"] * 4
+    assert flights.in_flight() == 0
+
+
+def test_errors_reach_every_caller_and_nothing_is_cached():
+    flights = SingleFlight("test")
+    with pytest.raises(ValueError):
+        flights.do("key", lambda: (_ for _ in ()).throw(ValueError("boom")))
+    assert flights.do("key", lambda: "again") == "again"
+    assert flights.do("other", lambda: "other") == "other"
+
+
+def test_async_callers_share_one_run_and_its_error():
+    flights = SingleFlight("test")
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise KeyError("missing")
+
+    async def main():
+        return await asyncio.gather(*(flights.ado("key", work) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert all(isinstance(result, KeyError) for result in results)
+    assert flights.in_flight() == 0
+
+
+def test_cancelling_the_caller_that_started_a_call_doesnt_cancel_it_for_the_others():
+    flights = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        leader = asyncio.ensure_future(flights.ado("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.ado("key", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == "done"
+    assert flights.in_flight() == 0
+
+
+def test_a_thread_can_join_a_call_started_by_a_coroutine():
+    flights = SingleFlight("test")
+    started = threading.Event()
+    results = []
+
+    async def work():
+        started.set()
+        await asyncio.sleep(0.1)
+        return "shared"
+
+    async def main():
+        return await flights.ado("key", work)
+
+    thread = threading.Thread(target=lambda: results.append(asyncio.run(main())))
+    thread.start()
+    started.wait(5)
+    results.append(flights.do("key", lambda: "not shared"))
+    thread.join(5)
+    assert results == ["shared", "shared"]
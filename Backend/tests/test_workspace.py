@@ -0,0 +1,240 @@
+import os
+import stat
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+from blob_store import BlobStore
+from workspace import OverlayWorkspace, SandboxPool, Workspace, sync_tree, workspace_for
+
+
+@pytest.fixture
+def repo(tmp_path):
+    root = tmp_path / "repo"
+    (root / "pkg").mkdir(parents=True)
+    (root / "pkg" / "a.py").write_text("a = 1\n")
+    (root / "run.sh").write_text("#!/bin/sh\n")
+    os.chmod(root / "run.sh", 0o755)
+    return root
+
+
+@pytest.fixture(params=["memory", "directory", "blobs"])
+def overlay(request, repo, tmp_path):
+    """An overlay of each kind: in memory, persisted inline, persisted as blob hashes."""
+    if request.param == "memory":
+        return OverlayWorkspace(str(repo))
+    blobs = BlobStore(str(tmp_path / "blobs")) if request.param == "blobs" else None
+    return OverlayWorkspace(str(repo), str(tmp_path / "overlay"), blobs)
+
+
+def reopen(overlay):
+    return OverlayWorkspace(overlay.repo_path, overlay.overlay_dir, overlay.blobs)
+
+
+def test_reads_see_pending_edits_and_the_repository_is_untouched(overlay, repo):
+    overlay.write("pkg/a.py", "a = 2\n")
+    overlay.write("pkg/new.py", "b = 1\n")
+    assert overlay.read("pkg/a.py") == "a = 2\n"
+    assert overlay.read(str(repo / "pkg" / "new.py")) == "b = 1\n"
+    assert overlay.exists("pkg/new.py") and not Workspace(str(repo)).exists("pkg/new.py")
+    assert overlay.original("pkg/a.py") == "a = 1\n"
+    assert overlay.original("pkg/new.py") is None
+    assert (repo / "pkg" / "a.py").read_text() == "a = 1\n"
+    assert overlay.pending_files() == ["pkg/a.py", "pkg/new.py"]
+
+
+def test_writes_outside_the_repository_are_refused(overlay):
+    with pytest.raises(ValueError):
+        overlay.write("../escape.py", "x")
+
+
+def test_persisted_edits_survive_a_reload(overlay):
+    if overlay.overlay_dir is None:
+        pytest.skip("in-memory overlays aren't persisted")
+    overlay.write("pkg/a.py", "a = 2\n")
+    overlay.write("pkg/new.py", "b = 1\n")
+    reloaded = reopen(overlay)
+    assert reloaded.pending_files() == ["pkg/a.py", "pkg/new.py"]
+    assert reloaded.read("pkg/a.py") == "a = 2\n"
+    assert reloaded.conflicts() == []
+
+
+def test_apply_writes_the_edits_and_forgets_them(overlay, repo):
+    overlay.write("pkg/a.py", "a = 2\n")
+    overlay.write("pkg/new.py", "b = 1\n")
+    assert overlay.apply() == ["pkg/a.py", "pkg/new.py"]
+    assert (repo / "pkg" / "a.py").read_text() == "a = 2\n"
+    assert (repo / "pkg" / "new.py").read_text() == "b = 1\n"
+    assert overlay.pending_files() == []
+    if overlay.overlay_dir:
+        assert not os.path.exists(overlay.overlay_dir)
+        assert reopen(overlay).pending_files() == []
+    assert not [name for name in os.listdir(repo / "pkg") if name.endswith(".tmp")]
+
+
+def test_apply_keeps_file_permissions(overlay, repo):
+    overlay.write("run.sh", "#!/bin/sh\necho hi\n")
+    overlay.apply()
+    assert os.stat(repo / "run.sh").st_mode & stat.S_IXUSR
+
+
+def test_apply_replaces_links_instead_of_writing_through_them(overlay, repo, tmp_path):
+    outside = tmp_path / "outside.py"
+    outside.write_text("untouched\n")
+    os.symlink(outside, repo / "link.py")
+    overlay.write("link.py", "edited\n")
+    overlay.apply()
+    assert not os.path.islink(repo / "link.py")
+    assert outside.read_text() == "untouched\n"
+
+
+def test_edits_made_in_the_repository_meanwhile_conflict(overlay, repo):
+    overlay.write("pkg/a.py", "a = 2\n")
+    (repo / "pkg" / "a.py").write_text("a = 'by hand'\n")
+    assert overlay.conflicts() == ["pkg/a.py"]
+    with pytest.raises(ValueError):
+        overlay.apply()
+    assert (repo / "pkg" / "a.py").read_text() == "a = 'by hand'\n"
+    assert overlay.pending_files() == ["pkg/a.py"]
+
+
+def test_a_created_file_that_appeared_meanwhile_conflicts(overlay, repo):
+    overlay.write("pkg/new.py", "b = 1\n")
+    (repo / "pkg" / "new.py").write_text("b = 'other'\n")
+    assert overlay.conflicts() == ["pkg/new.py"]
+
+
+def test_accepting_a_second_change_doesnt_revert_the_first(repo, tmp_path):
+    first = OverlayWorkspace(str(repo), str(tmp_path / "first"))
+    second = OverlayWorkspace(str(repo), str(tmp_path / "second"))
+    first.write("pkg/a.py", "a = 'first'\n")
+    second.write("pkg/a.py", "a = 'second'\n")
+    second.write("pkg/other.py", "c = 1\n")
+    first.apply()
+    assert reopen(second).conflicts() == ["pkg/a.py"]
+    with pytest.raises(ValueError):
+        reopen(second).apply()
+    assert (repo / "pkg" / "a.py").read_text() == "a = 'first'\n"
+    assert not (repo / "pkg" / "other.py").exists()
+
+
+def test_a_repository_already_holding_the_edit_doesnt_conflict(overlay, repo):
+    overlay.write("pkg/a.py", "a = 2\n")
+    (repo / "pkg" / "a.py").write_text("a = 2\n")
+    assert overlay.conflicts() == []
+
+
+def test_the_base_is_the_repository_version_at_the_first_write(overlay, repo):
+    overlay.write("pkg/a.py", "a = 2\n")
+    overlay.write("pkg/a.py", "a = 3\n")
+    assert overlay.conflicts() == []
+    overlay.apply()
+    assert (repo / "pkg" / "a.py").read_text() == "a = 3\n"
+
+
+def test_materialize_writes_into_another_tree(overlay, repo, tmp_path):
+    sandbox = tmp_path / "sandbox"
+    (sandbox / "pkg").mkdir(parents=True)
+    os.symlink(repo / "pkg" / "a.py", sandbox / "pkg" / "a.py")
+    overlay.write("pkg/a.py", "a = 2\n")
+    assert overlay.materialize(str(sandbox)) == ["pkg/a.py"]
+    assert (sandbox / "pkg" / "a.py").read_text() == "a = 2\n"
+    assert (repo / "pkg" / "a.py").read_text() == "a = 1\n"
+
+
+def test_discard_drops_the_edits(overlay, repo):
+    overlay.write("pkg/a.py", "a = 2\n")
+    overlay.discard()
+    assert overlay.pending_files() == []
+    assert overlay.read("pkg/a.py") == "a = 1\n"
+
+
+def test_workspace_for_routes_through_the_active_overlay(overlay, repo):
+    assert not isinstance(workspace_for(str(repo)), OverlayWorkspace)
+    with overlay.activate():
+        assert workspace_for(str(repo)) is overlay
+        assert not isinstance(workspace_for(str(repo / "pkg")), OverlayWorkspace)
+    assert not isinstance(workspace_for(str(repo)), OverlayWorkspace)
+
+
+def sandbox_files(root):
+    return sorted(
+        os.path.relpath(os.path.join(directory, name), root)
+        for directory, _, names in os.walk(root) for name in names
+    )
+
+
+def test_sync_tree_copies_the_repository(repo, tmp_path):
+    os.makedirs(repo / ".venv" / "lib")
+    (repo / ".venv" / "lib" / "dep.py").write_text("dep\n")
+    sandbox = tmp_path / "sandbox"
+    sync_tree(str(repo), str(sandbox))
+    assert (sandbox / "pkg" / "a.py").read_text() == "a = 1\n"
+    assert not os.path.islink(sandbox / "pkg" / "a.py")
+    assert os.path.islink(sandbox / ".venv")
+    (sandbox / "pkg" / "a.py").write_text("changed by a test\n")
+    assert (repo / "pkg" / "a.py").read_text() == "a = 1\n"
+
+
+def test_sync_tree_refreshes_only_what_changed(repo, tmp_path):
+    sandbox = tmp_path / "sandbox"
+    sync_tree(str(repo), str(sandbox))
+    # What the last run left: an edit, a created file, a cache directory
+    (sandbox / "pkg" / "a.py").write_text("edited\n")
+    (sandbox / "pkg" / "created.py").write_text("x\n")
+    os.makedirs(sandbox / "pkg" / "__pycache__")
+    (sandbox / "pkg" / "__pycache__" / "a.pyc").write_bytes(b"\0")
+    # What changed in the repository meanwhile
+    (repo / "pkg" / "b.py").write_text("b = 1\n")
+    os.remove(repo / "run.sh")
+    (repo / "run.sh").write_text("#!/bin/sh\nexit 0\n")
+
+    sync_tree(str(repo), str(sandbox))
+    assert sandbox_files(sandbox) == sandbox_files(repo)
+    assert (sandbox / "pkg" / "a.py").read_text() == "a = 1\n"
+    assert (sandbox / "run.sh").read_text() == "#!/bin/sh\nexit 0\n"
+    untouched = os.stat(sandbox / "pkg" / "b.py").st_ino
+    sync_tree(str(repo), str(sandbox))
+    assert os.stat(sandbox / "pkg" / "b.py").st_ino == untouched
+
+
+def test_sandbox_git_dir_borrows_the_repository_objects(repo, tmp_path):
+    git = shutil.which("git")
+    if git is None:
+        pytest.skip("git is not installed")
+    env = dict(os.environ, GIT_AUTHOR_NAME="t", GIT_AUTHOR_EMAIL="t@t", GIT_COMMITTER_NAME="t", GIT_COMMITTER_EMAIL="t@t")
+    for command in (["init", "-q"], ["add", "-A"], ["commit", "-qm", "init"]):
+        subprocess.run([git, *command], cwd=repo, env=env, check=True)
+    sandbox = tmp_path / "sandbox"
+    sync_tree(str(repo), str(sandbox))
+    assert os.listdir(sandbox / ".git" / "objects") == ["info"]
+    log = subprocess.run([git, "log", "--format=%s"], cwd=sandbox, capture_output=True, text=True, check=True)
+    assert log.stdout.strip() == "init"
+    # Commits made by the tests stay in the sandbox
+    subprocess.run([git, "commit", "-qm", "sandbox", "--allow-empty"], cwd=sandbox, env=env, check=True)
+    log = subprocess.run([git, "log", "--format=%s", "-1"], cwd=repo, capture_output=True, text=True, check=True)
+    assert log.stdout.strip() == "init"
+    sync_tree(str(repo), str(sandbox))
+    log = subprocess.run([git, "log", "--format=%s", "-1"], cwd=sandbox, capture_output=True, text=True, check=True)
+    assert log.stdout.strip() == "init"
+
+
+def test_sandbox_pool_reuses_released_sandboxes(repo):
+    pool = SandboxPool(size=1)
+    try:
+        first = pool.acquire(str(repo))
+        second = pool.acquire(str(repo))
+        assert first != second
+        (Path(first) / "left_over.py").write_text("x\n")
+        pool.release(str(repo), first)
+        pool.release(str(repo), second)
+        assert not os.path.exists(second)
+        again = pool.acquire(str(repo))
+        assert again == first
+        assert sandbox_files(again) == sandbox_files(repo)
+        pool.release(str(repo), again)
+    finally:
+        pool.close_all()
+    assert not os.path.exists(first)
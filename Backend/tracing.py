@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "cursor-clone-backend")
+
+_current_tracer: contextvars.ContextVar = contextvars.ContextVar("current_tracer", default=None)
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+# Counters kept on every span and rolled up into the run summary
+COUNTERS = (
+    "llm_calls",
+    "prompt_tokens",
+    "completion_tokens",
+    "embedding_calls",
+    "retrievals",
+    "retrieval_ms",
+    "bytes_copied",
+)
+
+
+class Span:
+    """A timed unit of work with attributes and counters."""
+
+    def __init__(self, name: str, trace_id: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            **{key: value for key, value in self.counters.items() if value},
+            **({"error": self.error} if self.error else {}),
+        }
+
+
+class Tracer:
+    """Collects spans, LLM/retrieval counters and copy sizes for one run."""
+
+    def __init__(self, name: str = "run"):
+        """Initialize the tracer.
+
+        Args:
+            name: Name of the root of the trace
+        """
+        self.name = name
+        self.trace_id = uuid.uuid4().hex
+        self.spans: List[Span] = []
+        self.totals = dict.fromkeys(COUNTERS, 0)
+        self.start_ns = time.time_ns()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self) -> Iterator["Tracer"]:
+        """Make this tracer the current one for the calling context."""
+        token = _current_tracer.set(self)
+        try:
+            yield self
+        finally:
+            _current_tracer.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        """Time a block of work as a child of the current span.
+
+        Args:
+            name: Span name, e.g. "planning.react_agent"
+            attributes: Span attributes
+        """
+        span = Span(name, self.trace_id, _current_span.get(), attributes)
+        with self._lock:
+            self.spans.append(span)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.error = str(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+
+    def add(self, counter: str, value: float = 1):
+        """Add to a counter on the current span and the run totals."""
+        with self._lock:
+            self.totals[counter] += value
+            span = _current_span.get()
+            if span is not None:
+                span.counters[counter] += value
+
+    def record_llm_call(self, prompt_tokens: int, completion_tokens: int):
+        self.add("llm_calls")
+        self.add("prompt_tokens", prompt_tokens)
+        self.add("completion_tokens", completion_tokens)
+
+    def record_retrieval(self, latency_ms: float):
+        self.add("retrievals")
+        self.add("retrieval_ms", latency_ms)
+
+    def record_bytes_copied(self, num_bytes: int):
+        self.add("bytes_copied", num_bytes)
+
+    def summary(self) -> Dict:
+        """Summarize the run: totals, per-stage rollup and the individual spans.
+
+        Returns:
+            A JSON serializable dictionary
+        """
+        stages: Dict[str, Dict] = {}
+        for span in self.spans:
+            stage = stages.setdefault(span.name, {"count": 0, "total_ms": 0.0, **dict.fromkeys(COUNTERS, 0)})
+            stage["count"] += 1
+            stage["total_ms"] += span.duration_ms
+            for key, value in span.counters.items():
+                stage[key] += value
+        for stage in stages.values():
+            stage["total_ms"] = round(stage["total_ms"], 3)
+            stage["retrieval_ms"] = round(stage["retrieval_ms"], 3)
+
+        totals = dict(self.totals)
+        totals["retrieval_ms"] = round(totals["retrieval_ms"], 3)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "total_ms": round((time.time_ns() - self.start_ns) / 1e6, 3),
+            "totals": totals,
+            "stages": stages,
+            "spans": [span.to_dict() for span in self.spans],
+        }
+
+    def to_otlp(self) -> Dict:
+        """Export the spans in OpenTelemetry OTLP/JSON format.
+
+        Returns:
+            An OTLP ``ExportTraceServiceRequest`` as a dictionary
+        """
+        spans = []
+        for span in self.spans:
+            attributes = dict(span.attributes)
+            attributes.update({f"cursor.{key}": value for key, value in span.counters.items() if value})
+            otlp_span = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+                "attributes": _otlp_attributes(attributes),
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            }
+            if span.parent_id:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+                "scopeSpans": [{
+                    "scope": {"name": "cursor-clone.tracing"},
+                    "spans": spans,
+                }],
+            }]
+        }
+
+    def export(self, path: str):
+        """Write the OTLP/JSON export to a file.
+
+        Args:
+            path: File to write
+        """
+        with open(path, "w") as f:
+            json.dump(self.to_otlp(), f)
+        logger.info(f"Exported trace {self.trace_id} to {path}")
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict]:
+    converted = []
+    for key, value in attributes.items():
+        if isinstance(value, bool):
+            converted.append({"key": key, "value": {"boolValue": value}})
+        elif isinstance(value, int):
+            converted.append({"key": key, "value": {"intValue": str(value)}})
+        elif isinstance(value, float):
+            converted.append({"key": key, "value": {"doubleValue": value}})
+        else:
+            converted.append({"key": key, "value": {"stringValue": str(value)}})
+    return converted
+
+
+def current_tracer() -> Optional[Tracer]:
+    """The tracer active in the calling context, if any."""
+    return _current_tracer.get()
+
+
+@contextmanager
+def trace_span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time a block as a span of the current tracer.
+
+    The duration always feeds the agent_stage_duration_seconds histogram;
+    without an active tracer no span is recorded.
+    """
+    start = time.perf_counter()
+    try:
+        tracer = _current_tracer.get()
+        if tracer is None:
+            yield None
+            return
+        with tracer.span(name, **attributes) as span:
+            yield span
+    finally:
+        metrics.AGENT_STAGE_LATENCY.observe(time.perf_counter() - start, stage=name)
+
+
+def traced(name: str, *attribute_args: str):
+    """Decorator running a function (sync or async) inside a span of the current tracer.
+
+    Args:
+        name: Span name
+        attribute_args: Names of arguments recorded as span attributes
+    """
+    def decorator(fn):
+        signature = inspect.signature(fn)
+
+        def attributes(args, kwargs) -> Dict[str, Any]:
+            if not attribute_args:
+                return {}
+            bound = signature.bind_partial(*args, **kwargs).arguments
+            return {arg: bound[arg] for arg in attribute_args if arg in bound}
+
+        if asyncio.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with trace_span(name, **attributes(args, kwargs)):
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with trace_span(name, **attributes(args, kwargs)):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(counter: str, value: float = 1):
+    """Add to a counter of the current tracer; a no-op without one."""
+    tracer = _current_tracer.get()
+    if tracer is not None:
+        tracer.add(counter, value)
+
+
+def counting_copy(src: str, dst: str, *, follow_symlinks: bool = True) -> str:
+    """``shutil.copy2`` that records the copied bytes on the current tracer."""
+    import shutil
+    result = shutil.copy2(src, dst, follow_symlinks=follow_symlinks)
+    try:
+        record("bytes_copied", os.path.getsize(dst))
+    except OSError:
+        pass
+    return result
+
+
+_callback_handler = None
+_callback_lock = threading.Lock()
+
+
+def get_callback_handler():
+    """The llama_index callback handler feeding LLM/retrieval events to the metrics and current tracer."""
+    global _callback_handler
+    if _callback_handler is None:
+        with _callback_lock:
+            if _callback_handler is None:
+                _callback_handler = _build_callback_handler()
+    return _callback_handler
+
+
+def install(*components: Any):
+    """Attach the tracing callback handler globally and to the given llama_index components.
+
+    Args:
+        components: LLMs or embedding models built outside of Settings
+    """
+    from llama_index.core import Settings
+
+    handler = get_callback_handler()
+    managers = [Settings.callback_manager] + [
+        getattr(component, "callback_manager", None) for component in components
+    ]
+    for manager in managers:
+        if manager is not None and handler not in manager.handlers:
+            manager.add_handler(handler)
+
+
+def _build_callback_handler():
+    from llama_index.core.callbacks import CBEventType, EventPayload
+    from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+    from llama_index.core.utils import get_tokenizer
+
+    tokenizer = get_tokenizer()
+
+    def count_tokens(text: Any) -> int:
+        return len(tokenizer(str(text))) if text else 0
+
+    def usage_tokens(response: Any) -> Optional[tuple]:
+        raw = getattr(response, "raw", None) or {}
+        usage = raw.get("usage") if isinstance(raw, dict) else getattr(raw, "usage", None)
+        if usage is None:
+            usage = raw.get("usage_metadata") if isinstance(raw, dict) else getattr(raw, "usage_metadata", None)
+        if usage is None:
+            return None
+        get = usage.get if isinstance(usage, dict) else lambda key: getattr(usage, key, None)
+        prompt = get("prompt_tokens") or get("prompt_token_count")
+        completion = get("completion_tokens") or get("candidates_token_count")
+        if prompt is None and completion is None:
+            return None
+        return int(prompt or 0), int(completion or 0)
+
+    class TracingCallbackHandler(BaseCallbackHandler):
+        """Forwards llama_index LLM, embedding and retrieval events to the metrics and the current tracer."""
+
+        def __init__(self):
+            super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+            self._starts: Dict[str, int] = {}
+
+        def on_event_start(self, event_type, payload=None, event_id="", parent_id="", **kwargs):
+            if event_type in (CBEventType.LLM, CBEventType.RETRIEVE, CBEventType.EMBEDDING):
+                self._starts[event_id] = time.perf_counter_ns()
+            return event_id
+
+        def on_event_end(self, event_type, payload=None, event_id="", **kwargs):
+            start_ns = self._starts.pop(event_id, None)
+            if start_ns is None:
+                return
+            elapsed_s = (time.perf_counter_ns() - start_ns) / 1e9
+            tracer = _current_tracer.get()
+            payload = payload or {}
+            if event_type == CBEventType.LLM:
+                response = payload.get(EventPayload.RESPONSE) or payload.get(EventPayload.COMPLETION)
+                tokens = usage_tokens(response)
+                if tokens is None:
+                    prompt = payload.get(EventPayload.PROMPT) or payload.get(EventPayload.MESSAGES)
+                    completion = getattr(response, "text", None) or getattr(response, "message", response)
+                    tokens = (count_tokens(prompt), count_tokens(completion))
+                metrics.LLM_CALLS.inc()
+                metrics.LLM_TOKENS.inc(tokens[0], kind="prompt")
+                metrics.LLM_TOKENS.inc(tokens[1], kind="completion")
+                metrics.LLM_LATENCY.observe(elapsed_s)
+                if tracer is not None:
+                    tracer.record_llm_call(*tokens)
+            elif event_type == CBEventType.RETRIEVE:
+                metrics.RETRIEVAL_LATENCY.observe(elapsed_s)
+                if tracer is not None:
+                    tracer.record_retrieval(elapsed_s * 1e3)
+            elif event_type == CBEventType.EMBEDDING:
+                metrics.EMBEDDING_CALLS.inc()
+                if tracer is not None:
+                    tracer.add("embedding_calls")
+
+        def start_trace(self, trace_id=None):
+            pass
+
+        def end_trace(self, trace_id=None, trace_map=None):
+            pass
+
+    return TracingCallbackHandler()
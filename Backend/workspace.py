@@ -0,0 +1,468 @@
+import os
+import json
+import atexit
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from blob_store import BlobStore
+from tracing import counting_copy
+
+logger = logging.getLogger(__name__)
+
+_current_workspace: contextvars.ContextVar = contextvars.ContextVar("workspace", default=None)
+
+# "copy" builds sandboxes from copies of the repository files; "link" links
+# them, which is faster but lets tests that write to them change the repository
+SANDBOX_MODE = os.getenv("SANDBOX_MODE", "copy")
+
+# Sandboxes kept per repository after a test run, so the next run only
+# refreshes the files that differ instead of copying the tree again
+SANDBOX_POOL_SIZE = int(os.getenv("SANDBOX_POOL_SIZE", "2"))
+
+# Dependency directories linked into a sandbox as a whole instead of file by file
+LINKED_DIRS = {"node_modules", ".venv", "venv"}
+
+GIT_DIR = ".git"
+
+# Overlay file mapping the edited paths to their blobs
+EDITS_FILE = "edits.json"
+
+# Overlay file mapping the edited paths to the hash of the repository file
+# each edit was based on, or null for files the edit creates
+BASES_FILE = ".bases.json"
+
+
+class Workspace:
+    """Reads and writes the files of a repository directly on disk."""
+
+    def __init__(self, repo_path: str):
+        """Initialize the workspace.
+
+        Args:
+            repo_path: Path to the repository
+        """
+        self.repo_path = repo_path
+
+    def rel_path(self, file_path: str) -> str:
+        """A path relative to the repository, absolute paths inside it included."""
+        if os.path.isabs(file_path):
+            file_path = os.path.relpath(file_path, self.repo_path)
+        return os.path.normpath(file_path)
+
+    def full_path(self, file_path: str) -> str:
+        return os.path.join(self.repo_path, self.rel_path(file_path))
+
+    def exists(self, file_path: str) -> bool:
+        return os.path.isfile(self.full_path(file_path))
+
+    def read(self, file_path: str) -> str:
+        with open(self.full_path(file_path), 'r') as f:
+            return f.read()
+
+    def write(self, file_path: str, content: str):
+        full_path = self.full_path(file_path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'w') as f:
+            f.write(content)
+
+    def is_pending(self, file_path: str) -> bool:
+        """Whether a file has an edit that isn't in the repository yet."""
+        return False
+
+    def pending_files(self) -> List[str]:
+        return []
+
+    def materialize(self, target_dir: str) -> List[str]:
+        """Write the pending edits into a copy of the repository.
+
+        Returns:
+            Relative paths of the files written
+        """
+        return []
+
+
+class OverlayWorkspace(Workspace):
+    """Pending edits of one change, layered over an untouched repository.
+
+    Writes go to memory and, when an overlay directory is given, to a small
+    per-change directory so the edits outlive the request that made them.
+    With a blob store the edited contents are kept there instead, and the
+    overlay only holds their hashes. Reads see the pending edits first and
+    the repository otherwise. The edits reach the repository only through
+    apply; discarding them is free. The first write of a file records the
+    hash of its repository version, so apply can refuse edits whose file
+    changed in the repository since, by hand or by another accepted change.
+    """
+
+    def __init__(self, repo_path: str, overlay_dir: Optional[str] = None, blobs: Optional[BlobStore] = None):
+        """Initialize the overlay, loading edits already stored in ``overlay_dir``.
+
+        Args:
+            repo_path: Path to the repository
+            overlay_dir: Directory persisting the edits, or None to keep them
+                in memory only
+            blobs: Store holding the edited contents; they are kept in the
+                overlay when omitted
+        """
+        super().__init__(repo_path)
+        self.overlay_dir = overlay_dir
+        self.blobs = blobs
+        # Relative path -> content, or its hash when the contents are in the blob store
+        self._files: Dict[str, str] = {}
+        # Relative path -> hash of the repository file when it was first written, None if it didn't exist
+        self._bases: Dict[str, Optional[str]] = {}
+        self._lock = threading.Lock()
+        if overlay_dir and os.path.isdir(overlay_dir):
+            for root, _, files in os.walk(overlay_dir):
+                for name in files:
+                    if name.endswith(".tmp") or (root == overlay_dir and (name == BASES_FILE or (blobs and name == EDITS_FILE))):
+                        continue
+                    path = os.path.join(root, name)
+                    with open(path, 'r') as f:
+                        content = f.read()
+                    self._files[os.path.relpath(path, overlay_dir)] = blobs.put(content) if blobs else content
+            edits_path = os.path.join(overlay_dir, EDITS_FILE)
+            if blobs and os.path.exists(edits_path):
+                with open(edits_path, 'r') as f:
+                    self._files.update(json.load(f))
+            # Overlays written before bases were recorded can't be checked for conflicts
+            bases_path = os.path.join(overlay_dir, BASES_FILE)
+            if os.path.exists(bases_path):
+                with open(bases_path, 'r') as f:
+                    self._bases.update(json.load(f))
+
+    def _content(self, rel_path: str) -> str:
+        value = self._files[rel_path]
+        if self.blobs is None:
+            return value
+        content = self.blobs.get(value)
+        if content is None:
+            raise FileNotFoundError(f"Blob {value} of the pending edit of {rel_path} is missing")
+        return content
+
+    def exists(self, file_path: str) -> bool:
+        return self.rel_path(file_path) in self._files or super().exists(file_path)
+
+    def read(self, file_path: str) -> str:
+        rel_path = self.rel_path(file_path)
+        if rel_path in self._files:
+            return self._content(rel_path)
+        return super().read(file_path)
+
+    def write(self, file_path: str, content: str):
+        rel_path = self.rel_path(file_path)
+        if rel_path.startswith(os.pardir):
+            raise ValueError(f"{file_path} is outside the repository")
+        value = content if self.blobs is None else self.blobs.put(content)
+        with self._lock:
+            if rel_path not in self._files and rel_path not in self._bases:
+                self._bases[rel_path] = file_hash(os.path.join(self.repo_path, rel_path))
+                if self.overlay_dir:
+                    _write_atomic(os.path.join(self.overlay_dir, BASES_FILE), json.dumps(self._bases))
+            self._files[rel_path] = value
+            if self.overlay_dir:
+                if self.blobs is None:
+                    _write_atomic(os.path.join(self.overlay_dir, rel_path), content)
+                else:
+                    _write_atomic(os.path.join(self.overlay_dir, EDITS_FILE), json.dumps(self._files))
+
+    def original(self, file_path: str) -> Optional[str]:
+        """Content of a file in the repository, without pending edits."""
+        return super().read(file_path) if super().exists(file_path) else None
+
+    def is_pending(self, file_path: str) -> bool:
+        return self.rel_path(file_path) in self._files
+
+    def pending_files(self) -> List[str]:
+        return sorted(self._files)
+
+    def materialize(self, target_dir: str) -> List[str]:
+        for rel_path in list(self._files):
+            # Replaced rather than written to, so a link into the repository is never written through
+            _write_atomic(os.path.join(target_dir, rel_path), self._content(rel_path))
+        return self.pending_files()
+
+    def conflicts(self) -> List[str]:
+        """Pending files whose repository version changed since the overlay first wrote them.
+
+        Files that already hold the pending content don't conflict.
+        """
+        conflicts = []
+        for rel_path, value in list(self._files.items()):
+            if rel_path not in self._bases:
+                continue
+            current = file_hash(os.path.join(self.repo_path, rel_path))
+            pending = value if self.blobs is not None else BlobStore.hash(value)
+            if current != self._bases[rel_path] and current != pending:
+                conflicts.append(rel_path)
+        return sorted(conflicts)
+
+    def apply(self) -> List[str]:
+        """Write the pending edits into the repository and forget them.
+
+        Nothing is written if any file conflicts; callers that apply edits
+        of several overlays to one repository have to serialize the calls.
+
+        Returns:
+            Relative paths of the files written
+
+        Raises:
+            ValueError: If files changed in the repository since they were edited
+        """
+        conflicts = self.conflicts()
+        if conflicts:
+            raise ValueError(f"Files changed in the repository since the change was made: {', '.join(conflicts)}")
+        written = self.materialize(self.repo_path)
+        logger.info(f"Applied {len(written)} pending files to {self.repo_path}")
+        self.discard()
+        return written
+
+    def discard(self):
+        """Drop the pending edits."""
+        self._files.clear()
+        self._bases.clear()
+        if self.overlay_dir:
+            shutil.rmtree(self.overlay_dir, ignore_errors=True)
+
+    @contextmanager
+    def activate(self) -> Iterator["OverlayWorkspace"]:
+        """Route the agents' file access for this repository through the overlay."""
+        token = _current_workspace.set(self)
+        try:
+            yield self
+        finally:
+            _current_workspace.reset(token)
+
+
+def current_workspace() -> Optional[OverlayWorkspace]:
+    return _current_workspace.get()
+
+
+def workspace_for(repo_path: str) -> Workspace:
+    """The active overlay if it belongs to ``repo_path``, else direct access to the repository."""
+    workspace = _current_workspace.get()
+    if workspace is not None and os.path.abspath(workspace.repo_path) == os.path.abspath(repo_path):
+        return workspace
+    return Workspace(repo_path)
+
+
+class SandboxPool:
+    """Test sandboxes kept between runs and refreshed instead of rebuilt.
+
+    A released sandbox is kept, up to ``size`` per repository, and the next
+    acquire brings it back in line with the repository with sync_tree. Only
+    the first run of a repository, and runs that overlap more than ``size``
+    others, copy the whole tree; the others cost a stat of every file and
+    the copies of the files that changed since. Kept sandboxes take the
+    repository's size on disk each, and are removed at exit.
+    """
+
+    def __init__(self, size: int = SANDBOX_POOL_SIZE):
+        """Initialize an empty pool.
+
+        Args:
+            size: Sandboxes kept per repository, 0 to remove each after its run
+        """
+        self.size = size
+        self._idle: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        atexit.register(self.close_all)
+
+    def acquire(self, repo_path: str) -> str:
+        """A sandbox matching the repository, for the caller's exclusive use until release.
+
+        Returns:
+            Path of the sandboxed repository
+        """
+        with self._lock:
+            idle = self._idle.get(os.path.realpath(repo_path))
+            sandbox_repo_path = idle.pop() if idle else None
+        if sandbox_repo_path is None:
+            sandbox_repo_path = os.path.join(tempfile.mkdtemp(prefix="cursor_sandbox_"), "sandbox_repo")
+        try:
+            sync_tree(repo_path, sandbox_repo_path)
+        except Exception:
+            shutil.rmtree(os.path.dirname(sandbox_repo_path), ignore_errors=True)
+            raise
+        return sandbox_repo_path
+
+    def release(self, repo_path: str, sandbox_repo_path: str):
+        """Return a sandbox from acquire, keeping it for the next run if the pool has room."""
+        with self._lock:
+            idle = self._idle.setdefault(os.path.realpath(repo_path), [])
+            if len(idle) < self.size and sandbox_repo_path not in idle:
+                idle.append(sandbox_repo_path)
+                return
+        shutil.rmtree(os.path.dirname(sandbox_repo_path), ignore_errors=True)
+
+    def close_all(self):
+        """Remove every kept sandbox."""
+        with self._lock:
+            sandboxes = [path for idle in self._idle.values() for path in idle]
+            self._idle.clear()
+        for sandbox_repo_path in sandboxes:
+            shutil.rmtree(os.path.dirname(sandbox_repo_path), ignore_errors=True)
+
+
+sandbox_pool = SandboxPool()
+
+
+def sync_tree(source: str, target: str):
+    """Make a test sandbox match a repository tree, creating it if needed.
+
+    Files are copied, so nothing the tests write reaches the repository.
+    With SANDBOX_MODE=link they are links to the originals instead: files
+    the tests create (caches, __pycache__) still land in the sandbox, but
+    files they modify in place change the repository. Links can't be made
+    read-only without changing the repository's own files, so only use it
+    for suites that don't write to tracked files. Dependency directories
+    are linked as a whole in both modes. The git directory is never linked:
+    the sandbox gets its own refs, index and config, and borrows the
+    repository's objects through git alternates.
+
+    Entries that are already up to date are left alone: copies whose size
+    and modification time match the original (copies keep the original's
+    time), and links that point where they should. Everything else in the
+    target, such as files the tests or earlier edits wrote, is replaced or
+    removed. Refreshing a sandbox therefore costs a stat of every file plus
+    the copies of the files that changed.
+    """
+    _sync_dir(source, target)
+
+
+def _sync_dir(source: str, target: str, git_root: Optional[str] = None):
+    """Sync one directory level and recurse; ``git_root`` is the git directory being synced, if any."""
+    os.makedirs(target, exist_ok=True)
+    stale = {entry.name: entry for entry in os.scandir(target)}
+    for entry in os.scandir(source):
+        current = stale.pop(entry.name, None)
+        target_path = os.path.join(target, entry.name)
+        if _git_ignored(entry.name, source, git_root):
+            continue
+        if entry.is_symlink() and entry.is_dir():
+            # os.walk wouldn't descend into linked directories either; keep the link
+            _sync_link(current, target_path, os.readlink(entry.path), directory=True)
+        elif entry.is_dir(follow_symlinks=False):
+            if entry.name == GIT_DIR and git_root is None:
+                _sync_git_dir(entry.path, target_path, current)
+            elif entry.name in LINKED_DIRS and git_root is None:
+                _sync_link(current, target_path, os.path.abspath(entry.path), directory=True)
+            else:
+                if current is not None and not current.is_dir(follow_symlinks=False):
+                    _remove(current)
+                _sync_dir(entry.path, target_path, git_root)
+        elif entry.name == GIT_DIR and git_root is None:
+            # A worktree's pointer to a shared git directory
+            continue
+        elif entry.is_symlink() and not os.path.exists(entry.path):
+            _sync_link(current, target_path, os.readlink(entry.path))
+        elif SANDBOX_MODE == "link" and git_root is None:
+            _sync_link(current, target_path, os.path.abspath(entry.path))
+        else:
+            source_stat = entry.stat()
+            if current is not None and current.is_file(follow_symlinks=False):
+                target_stat = current.stat(follow_symlinks=False)
+                if (target_stat.st_size, target_stat.st_mtime_ns) == (source_stat.st_size, source_stat.st_mtime_ns):
+                    continue
+            if current is not None:
+                _remove(current)
+            counting_copy(entry.path, target_path)
+    for entry in stale.values():
+        if not _git_ignored(entry.name, source, git_root):
+            _remove(entry)
+
+
+def _git_ignored(name: str, source: str, git_root: Optional[str]) -> bool:
+    """Entries of a git directory that are never synced into the sandbox's."""
+    if git_root is None:
+        return False
+    # Objects are read through alternates; stale locks would block git in the sandbox
+    return name.endswith(".lock") or (source == git_root and name == "objects")
+
+
+def _sync_link(current: Optional[os.DirEntry], target_path: str, link: str, directory: bool = False):
+    if current is not None:
+        if current.is_symlink() and os.readlink(current.path) == link:
+            return
+        _remove(current)
+    if os.path.isabs(link):
+        _link_or_copy(link, target_path, directory=directory)
+    else:
+        os.symlink(link, target_path, target_is_directory=directory)
+
+
+def _remove(entry: os.DirEntry):
+    if entry.is_dir(follow_symlinks=False):
+        shutil.rmtree(entry.path)
+    else:
+        os.remove(entry.path)
+
+
+def link_file(source: str, target: str):
+    """Point a sandbox file at its repository original, replacing what was there."""
+    if os.path.lexists(target):
+        os.remove(target)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if SANDBOX_MODE == "copy":
+        counting_copy(source, target)
+    else:
+        _link_or_copy(source, target)
+
+
+def _link_or_copy(source: str, target: str, directory: bool = False):
+    try:
+        os.symlink(os.path.abspath(source), target, target_is_directory=directory)
+    except OSError:
+        if directory:
+            shutil.copytree(source, target, symlinks=True, copy_function=counting_copy)
+        else:
+            counting_copy(source, target)
+
+
+def _sync_git_dir(source: str, target: str, current: Optional[os.DirEntry]):
+    """A git directory of the sandbox's own, sharing the repository's objects."""
+    if current is not None and not current.is_dir(follow_symlinks=False):
+        _remove(current)
+    _sync_dir(source, target, git_root=source)
+    info_dir = os.path.join(target, "objects", "info")
+    os.makedirs(info_dir, exist_ok=True)
+    alternates = os.path.abspath(os.path.join(source, "objects")) + "\n"
+    alternates_path = os.path.join(info_dir, "alternates")
+    if not os.path.exists(alternates_path):
+        with open(alternates_path, 'w') as f:
+            f.write(alternates)
+
+
+def file_hash(path: str) -> Optional[str]:
+    """SHA-256 of a file's bytes, as BlobStore.hash computes it for contents, or None if it doesn't exist."""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    except (FileNotFoundError, IsADirectoryError, NotADirectoryError):
+        return None
+    return digest.hexdigest()
+
+
+def _write_atomic(path: str, content: str):
+    """Write a file aside and swap it in, so readers see the old or the new content, never a part."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temp_path, 'w') as f:
+            f.write(content)
+        if os.path.isfile(path) and not os.path.islink(path):
+            # Keep the permissions of the file it replaces, e.g. the executable bit
+            shutil.copymode(path, temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise